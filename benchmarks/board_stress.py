@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多棋盘并发压测
+
+每个棋盘由一个客户端进程反复“落子 -> 悔棋”，依次测试1、2、4...个棋盘同时进行时的总吞吐量。
+棋盘锁只串行化同一棋盘上的操作，理想情况下总吞吐量随棋盘数线性增长，直到服务器饱和；
+“扩展效率”即实际总吞吐量与“单棋盘吞吐量 x 棋盘数”之比。
+
+默认按CPU核数启动gunicorn worker（棋盘状态存于临时SQLite文件，各worker共享），客户端也各占一个进程，
+两边都不受单个解释器的GIL限制。吞吐量能否随棋盘数增长取决于空闲的核：
+- 单个gthread worker（--workers 1）受GIL限制最多用满一个核，一个核饱和后总吞吐量不再增长，
+  扩展效率下降反映的是CPU上限，不是棋盘之间的锁竞争
+- 服务器worker和客户端进程共用本机的核，核数少于“worker数 + 棋盘数”时同样会提前饱和
+无论能否线性扩展，压测都会检查所有请求成功：多个棋盘上并发的落子和悔棋互不干扰。
+
+用法：
+    python benchmarks/board_stress.py                      # 自动以gthread方式启动gobang并压测
+    python benchmarks/board_stress.py --game hexagon_game
+    python benchmarks/board_stress.py --url http://127.0.0.1:35102 --boards 1,4,16
+    python benchmarks/board_stress.py --workers 1          # 单worker，进程内存储
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各游戏的一步落子（悔棋时撤销的就是这一步）
+MOVES = {
+    'gobang': {'color': 1, 'move': {'x': 7, 'y': 7}},
+    'hexagon_game': {'color': '#d9534f', 'move': {'p1': [0, 0], 'p2': [3, 0]}},
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(game, threads, workers, data_dir):
+    """与main.py相同的方式启动游戏服务器，返回(进程, 地址)"""
+    port = free_port()
+    env = dict(os.environ, PLAYGROUND_SECRET_KEY='board-stress')
+    if workers > 1:
+        env['PLAYGROUND_STATE_STORE'] = f'sqlite:{os.path.join(data_dir, game)}.sqlite3'
+    cmd = [
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers),
+        '--worker-class', 'gthread',
+        '--threads', str(threads),
+        '--log-level', 'warning',
+        'app:app'
+    ]
+    process = subprocess.Popen(cmd, cwd=os.path.join(ROOT_DIR, game), env=env)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            if requests.get(f'{url}/health', timeout=1).ok:
+                return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'{game} 服务器启动失败')
+
+
+def board_id_for(run, index):
+    return f'B{run:03d}{index:04d}'
+
+
+def play(url, game, board_id, ready, go, stop, results):
+    """准备好棋盘后等待go，然后循环落子和悔棋，直到stop被设置；结束时把各请求的耗时放入results"""
+    spec = MOVES[game]
+    client = requests.Session()
+    client.post(f'{url}/api/reset', params={'board_id': board_id})
+    client.post(f'{url}/api/select_color', params={'board_id': board_id}, json={'color': spec['color']})
+    ready.put(board_id)
+    go.wait()
+    latencies = []
+    try:
+        while not stop.is_set():
+            for path, body in (('/api/move', spec['move']), ('/api/undo', None)):
+                started = time.perf_counter()
+                response = client.post(f'{url}{path}', params={'board_id': board_id}, json=body)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{path} 返回 {response.status_code}: {response.text}')
+    except Exception as e:
+        results.put((board_id, latencies, repr(e)))
+        return
+    results.put((board_id, latencies, None))
+
+
+def run_round(url, game, board_ids, duration):
+    """board_ids中每个元素对应一个客户端进程，返回(总请求数/秒, p50毫秒, p95毫秒)；任一请求失败时抛出RuntimeError"""
+    context = multiprocessing.get_context('spawn')
+    ready, results = context.Queue(), context.Queue()
+    go, stop = context.Event(), context.Event()
+    clients = [context.Process(target=play, args=(url, game, board_id, ready, go, stop, results), daemon=True)
+               for board_id in board_ids]
+    for client in clients:
+        client.start()
+    # 所有客户端进程启动并准备好棋盘后才开始计时
+    for _ in clients:
+        ready.get()
+    go.set()
+    time.sleep(duration)
+    stop.set()
+    collected = [results.get() for _ in clients]
+    for client in clients:
+        client.join()
+    errors = [f'{board_id}: {error}' for board_id, _, error in collected if error]
+    if errors:
+        raise RuntimeError('请求失败\n' + '\n'.join(errors))
+    samples = sorted(t for _, per_board, _ in collected for t in per_board)
+    if not samples:
+        return 0.0, 0.0, 0.0
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    return len(samples) / duration, statistics.median(samples) * 1000, p95 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多棋盘并发压测')
+    parser.add_argument('--game', choices=sorted(MOVES), default='gobang')
+    parser.add_argument('--url', help='压测已运行的服务器；不指定时自动启动一个')
+    parser.add_argument('--boards', default='1,2,4,8,16,32', help='逗号分隔的棋盘数')
+    parser.add_argument('--duration', type=float, default=3.0, help='每组持续秒数')
+    parser.add_argument('--threads', type=int, default=64, help='自动启动时gunicorn的线程数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='自动启动时gunicorn的worker进程数，默认为CPU核数（多于1个时使用SQLite存储）')
+    args = parser.parse_args()
+
+    counts = [int(n) for n in args.boards.split(',')]
+    data_dir = tempfile.TemporaryDirectory()
+    process, url = (None, args.url) if args.url else start_server(args.game, args.threads, args.workers, data_dir.name)
+    try:
+        cpus = os.cpu_count() or 1
+        if args.url:
+            print(f'压测 {url}，本机 {cpus} 核')
+        else:
+            store = 'SQLite存储' if args.workers > 1 else '进程内存储'
+            print(f'{args.game}: {args.workers} 个gthread worker（{store}），本机 {cpus} 核，每个棋盘一个客户端进程')
+        print(f'{"棋盘数":>6} {"总请求/秒":>10} {"每棋盘请求/秒":>14} {"p50(ms)":>9} {"p95(ms)":>9}')
+        baseline = None
+        for run, count in enumerate(counts):
+            board_ids = [board_id_for(run, i) for i in range(count)]
+            throughput, p50, p95 = run_round(url, args.game, board_ids, args.duration)
+            baseline = baseline or throughput / count
+            print(f'{count:>6} {throughput:>10.0f} {throughput / count:>14.0f} {p50:>9.2f} {p95:>9.2f}'
+                  f'   扩展效率 {throughput / (baseline * count):.0%}')
+        print('所有请求均成功：各棋盘上并发的落子和悔棋互不干扰')
+        if not args.url and (args.workers == 1 or cpus < args.workers + max(counts)):
+            # 如实说明：此时扩展效率下降是CPU饱和，不是棋盘锁造成的串行
+            limit = '单个gthread worker受GIL限制只能用满一个核' if args.workers == 1 else \
+                f'{args.workers} 个worker和最多 {max(counts)} 个客户端进程共用 {cpus} 个核'
+            print(f'注意：{limit}，CPU饱和后总吞吐量不再随棋盘数增长，'
+                  f'之后的扩展效率反映的是CPU上限而不是棋盘之间的锁竞争')
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        data_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
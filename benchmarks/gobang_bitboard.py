@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+五子棋落子后胜负判定的微基准
+
+对比两种实现在同一批随机对局上每步的耗时：
+- 二维数组：原来的check_win（从落子点向四个方向逐格数）+ 扫描全部225格判断平局
+- 位棋盘：gobang/bitboard.py 的has_five（移位与按位与）+ 棋子计数判断平局
+
+用法：
+    python benchmarks/gobang_bitboard.py
+    python benchmarks/gobang_bitboard.py --games 200 --repeat 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from gobang import bitboard
+
+SIZE = 15
+
+
+def list_check_win(board, x, y, color):
+    """改用位棋盘之前gobang/app.py中的check_win，作为对照"""
+    size = len(board)
+    directions = [(1, 0), (0, 1), (1, 1), (1, -1)]
+    for dx, dy in directions:
+        count = 1
+        for dir in [1, -1]:
+            nx, ny = x, y
+            while True:
+                nx += dx * dir
+                ny += dy * dir
+                if 0 <= nx < size and 0 <= ny < size and board[ny][nx] == color:
+                    count += 1
+                else:
+                    break
+        if count >= 5:
+            return True
+    return False
+
+
+def random_games(count, seed):
+    """生成count局随机对局，每局为[(x, y, color), ...]，出现5连或下满时结束"""
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        cells = [(x, y) for y in range(SIZE) for x in range(SIZE)]
+        rng.shuffle(cells)
+        board = [[0] * SIZE for _ in range(SIZE)]
+        moves = []
+        for i, (x, y) in enumerate(cells):
+            color = 1 if i % 2 == 0 else -1
+            board[y][x] = color
+            moves.append((x, y, color))
+            if list_check_win(board, x, y, color):
+                break
+        games.append(moves)
+    return games
+
+
+def play_lists(games):
+    results = []
+    for moves in games:
+        board = [[0] * SIZE for _ in range(SIZE)]
+        for x, y, color in moves:
+            board[y][x] = color
+            over = list_check_win(board, x, y, color) or all(all(cell != 0 for cell in row) for row in board)
+        results.append(over)
+    return results
+
+
+def play_bitboard(games):
+    results = []
+    for moves in games:
+        bits = bitboard.empty()
+        stones = 0
+        for x, y, color in moves:
+            bitboard.place(bits, SIZE, x, y, color)
+            stones += 1
+            over = bitboard.has_five(bits[color], SIZE) or stones == SIZE * SIZE
+        results.append(over)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='五子棋胜负判定微基准')
+    parser.add_argument('--games', type=int, default=100, help='随机对局数')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最快的一次')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    games = random_games(args.games, args.seed)
+    steps = sum(len(moves) for moves in games)
+    assert play_lists(games) == play_bitboard(games), '两种实现的判定结果不一致'
+
+    print(f'{args.games}局随机对局，共{steps}步')
+    print(f'{"实现":<8} {"每步(us)":>10}')
+    baseline = None
+    for name, play in (('二维数组', play_lists), ('位棋盘', play_bitboard)):
+        best = min(timeit.repeat(lambda: play(games), number=1, repeat=args.repeat))
+        per_step = best / steps * 1e6
+        baseline = baseline or per_step
+        print(f'{name:<8} {per_step:>10.2f}   {baseline / per_step:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
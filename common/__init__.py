@@ -0,0 +1 @@
+# 各游戏服务器共用的公共模块
@@ -0,0 +1,289 @@
+"""
+异步(ASGI)服务模式：把游戏的Flask应用包装成ASGI应用，由gunicorn的asgi worker（-k asgi）运行
+
+- 普通请求交给线程池执行原有的Flask路由，接口与同步模式完全相同
+- 长轮询 `GET /api/gamestate?board_id=...&since_version=V&wait=秒`：版本号仍为V时，
+  连接停在事件循环里等待该棋盘变化（一个future，几KB），不占线程；变化、超时或棋盘不存在时
+  再交给Flask路由，返回新的gamestate，超时则是原有的 `{"unchanged": true}`
+- 唤醒来自各游戏的notify_*_changed（LongPoll.notify，可在任意线程调用）。
+  共享存储（sqlite）下其他worker的修改不会唤醒本进程，等待期间每LONG_POLL_CHECK秒重新检查一次版本号
+
+- SSE推送（/api/stream）：生成器在异步模式下不阻塞等待，而是产出StreamWait，由事件循环等到棋盘变化
+  （同长轮询）再到线程池取下一块，空闲的推送连接同样不占线程
+
+同步模式（gthread）下wait参数被忽略，请求立即返回；SSE推送每条连接占一个线程。
+"""
+
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs
+
+ASGI_THREADS = int(os.environ.get('PLAYGROUND_ASGI_THREADS', '32'))  # 执行Flask路由的线程数
+LONG_POLL_MAX = 30   # 秒，wait参数的上限
+LONG_POLL_CHECK = 1  # 秒，共享存储下等待期间检查其他worker修改的间隔
+LONG_POLL_PATH = '/api/gamestate'
+ASGI_ENVIRON_KEY = 'playground.asgi'  # 异步模式下WSGI environ中的标记，流式路由据此改为产出StreamWait
+
+
+class LongPoll:
+    """board_id -> 等待该棋盘变化的future集合
+
+    版本号从游戏的存储（common/state_store.py）中读取，在线程池中进行，不阻塞事件循环。
+    future只在事件循环里增删；notify在修改棋盘的线程里调用，经call_soon_threadsafe转到事件循环。
+    先登记future再检查版本号，检查之后发生的变化一定能唤醒它，不会漏掉通知。
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._waiters = {}
+        self._loop = None
+
+    def notify(self, board_id):
+        """棋盘board_id的版本号已变化，唤醒等待它的长轮询。调用方无需持有事件循环"""
+        loop = self._loop
+        # 只读判断，没有等待者的棋盘不打扰事件循环
+        if loop is not None and board_id in self._waiters:
+            loop.call_soon_threadsafe(self._wake, board_id)
+
+    def waiting(self):
+        """当前正在等待的长轮询数"""
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def version(self, board_id):
+        """棋盘当前的版本号，不存在时为None"""
+        with self._store.reading(board_id):
+            board = self._store.get(board_id)
+            return None if board is None else board['version']
+
+    def _wake(self, board_id):
+        for waiter in self._waiters.pop(board_id, ()):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _add(self, board_id):
+        waiter = self._loop.create_future()
+        self._waiters.setdefault(board_id, set()).add(waiter)
+        return waiter
+
+    def _discard(self, board_id, waiter):
+        waiters = self._waiters.get(board_id)
+        if waiters is not None:
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[board_id]
+
+    async def park(self, board_id, since, timeout, executor):
+        """等到棋盘版本号不再是since、棋盘不存在或超时"""
+        loop = self._loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            waiter = self._add(board_id)
+            try:
+                version = await loop.run_in_executor(executor, self.version, board_id)
+                remaining = deadline - loop.time()
+                # since可带视图后缀（见conditional_response的variant），只比较版本号部分
+                if version is None or str(version) != since.split('-', 1)[0] or remaining <= 0:
+                    return
+                if self._store.shared:
+                    remaining = min(remaining, LONG_POLL_CHECK)
+                try:
+                    await asyncio.wait_for(waiter, remaining)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                self._discard(board_id, waiter)
+
+
+class StreamWait:
+    """异步模式下SSE生成器产出的等待请求：等到棋盘board_id的版本号不再是version、棋盘不存在或超过timeout秒，
+    再继续取下一块。等待在事件循环里进行（LongPoll.park），不占线程"""
+
+    def __init__(self, long_poll, board_id, version, timeout):
+        self.long_poll = long_poll
+        self.board_id = board_id
+        self.version = version
+        self.timeout = timeout
+
+
+def parse_long_poll(scope, prefix=''):
+    """路径前缀prefix下的长轮询请求返回(board_id, since_version, 等待秒数)，否则返回None"""
+    if scope['method'] != 'GET' or scope['path'] != prefix + LONG_POLL_PATH:
+        return None
+    args = parse_qs(scope['query_string'].decode('latin-1'))
+    board_id = args.get('board_id', [''])[0]
+    since = args.get('since_version', [None])[0]
+    try:
+        wait = min(float(args.get('wait', ['0'])[0]), LONG_POLL_MAX)
+    except ValueError:
+        return None
+    # wait=nan时两个比较都为False
+    if not board_id or since is None or not wait > 0:
+        return None
+    # 与各游戏路由相同的房间id校验，不合法的id不能到达存储（JournalStore用它拼文件路径），交给Flask路由返回400
+    if not board_id.isalnum() or len(board_id) != 8:
+        return None
+    return board_id, since, wait
+
+
+def wsgi_environ(scope, body):
+    """由ASGI的HTTP scope构造WSGI environ（PEP 3333）"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        ASGI_ENVIRON_KEY: True,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        # 重复的请求头按WSGI惯例用逗号合并
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _start_wsgi(wsgi_app, environ):
+    """在线程中调用WSGI应用，返回(状态码, 响应头, 响应体, 流)。
+    普通响应在线程内读完并关闭，流为None；SSE等流式响应只取第一块，流为(result, 迭代器)
+    """
+    started = []
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started[:] = [int(status.split(' ', 1)[0]),
+                      [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+        return written.append
+
+    result = wsgi_app(environ, start_response)
+    iterator = iter(result)
+    # 取第一块内容，确保start_response已被调用
+    first = next(iterator, b'')
+    status, headers = started
+    if dict(headers).get(b'content-type', b'').startswith(b'text/event-stream'):
+        return status, headers, b''.join(written) + first, (result, iterator)
+    try:
+        return status, headers, b''.join(written) + first + b''.join(iterator), None
+    finally:
+        _close(result)
+
+
+def _next_chunk(iterator):
+    return next(iterator, None)
+
+
+def _close(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+class AsgiApp:
+    """ASGI应用：HTTP请求转给线程池里的WSGI应用，长轮询先在事件循环里等待（见LongPoll）
+
+    long_poll为单个游戏的LongPoll；多个游戏挂在同一应用下时（见game_host.py）为 {路径前缀: LongPoll}
+    """
+
+    def __init__(self, wsgi_app, long_poll=None, threads=ASGI_THREADS):
+        self.wsgi_app = wsgi_app
+        if isinstance(long_poll, LongPoll):
+            long_poll = {'': long_poll}
+        self.long_polls = long_poll or {}
+        self._threads = threads
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._threads, thread_name_prefix='asgi')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        # 不支持websocket，直接返回即由服务器关闭连接
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        for prefix, long_poll in self.long_polls.items():
+            request = parse_long_poll(scope, prefix)
+            if request:
+                await long_poll.park(*request, executor)
+                break
+        environ = wsgi_environ(scope, b''.join(chunks))
+        status, headers, body, stream = await loop.run_in_executor(executor, _start_wsgi, self.wsgi_app, environ)
+        if stream is None:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        await self._stream(loop, executor, receive, send, status, headers, body, *stream)
+
+    async def _stream(self, loop, executor, receive, send, status, headers, body, result, iterator):
+        """流式响应（SSE）：逐块在线程中取内容，取到StreamWait时在事件循环里等待棋盘变化，客户端断开后停止"""
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while body is not None:
+                if isinstance(body, StreamWait):
+                    wait = asyncio.ensure_future(
+                        body.long_poll.park(body.board_id, str(body.version), body.timeout, executor))
+                    await asyncio.wait([wait, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                    if disconnected.done():
+                        wait.cancel()
+                        break
+                elif body:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                fetch = loop.run_in_executor(executor, _next_chunk, iterator)
+                await asyncio.wait([fetch, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                # 生成器正在线程中执行时不能关闭，等这一块取完（只是读棋盘和序列化，不会阻塞）
+                body = await fetch
+                if disconnected.done():
+                    break
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            await loop.run_in_executor(executor, _close, result)
@@ -0,0 +1,38 @@
+"""
+每个棋盘一把锁
+
+同一棋盘上的落子、悔棋、重置等修改操作互斥执行，不同棋盘之间互不阻塞。
+全局锁（如BOARDS_LOCK）只在查找或增删棋盘时短暂持有。
+
+加锁顺序：先取棋盘锁，再取全局锁；持有全局锁时不得再去获取棋盘锁。
+"""
+
+from threading import Condition, Lock, RLock
+from weakref import WeakValueDictionary
+
+
+class BoardLocks:
+    """board_id -> 条件变量（基于可重入锁）
+
+    - `with locks.get(board_id):` 即持有该棋盘的锁，同一线程可重入
+    - 条件变量可直接用于wait/notify_all，推送连接借此等待棋盘变化
+    - 锁对象不放进棋盘数据本身，棋盘保持为可序列化的纯数据
+    - 只保留弱引用：没有线程持有或等待时自动回收，棋盘销毁后无需手动清理
+    """
+
+    def __init__(self, factory=None):
+        self._factory = factory or (lambda board_id: Condition(RLock()))
+        self._locks = WeakValueDictionary()
+        self._lock = Lock()
+
+    def get(self, board_id):
+        with self._lock:
+            lock = self._locks.get(board_id)
+            if lock is None:
+                lock = self._factory(board_id)
+                self._locks[board_id] = lock
+            return lock
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
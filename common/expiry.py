@@ -0,0 +1,29 @@
+"""
+棋盘过期清理
+
+各游戏服务器不再每隔固定时间扫描全部棋盘：存储按最后活跃时间维护有序结构
+（MemoryStore的最小堆、SQLiteStore的last_active索引），清理线程睡到最早的棋盘可能到期时才醒来，
+每次只处理真正到期的棋盘。新棋盘和被访问过的棋盘到期时间都不早于“现在+过期时长”，
+所以线程睡眠期间不需要被唤醒。
+"""
+
+import time
+from threading import Thread
+
+MIN_SLEEP = 1  # 秒，两次清理之间的最短间隔，避免大量棋盘先后到期时频繁醒来
+
+
+def start_expiry_thread(store, expire_after, name='board-expiry'):
+    """启动后台线程，删除无人在线且超过expire_after秒未被访问的棋盘。
+    被删除的棋盘由存储的on_delete回调通知（如作废已缓存的gamestate）
+    """
+    def run():
+        while True:
+            oldest = store.oldest_active()
+            wait = expire_after if oldest is None else oldest + expire_after - time.time()
+            time.sleep(min(max(wait, MIN_SLEEP), expire_after))
+            store.delete_expired(time.time() - expire_after)
+
+    thread = Thread(target=run, daemon=True, name=name)
+    thread.start()
+    return thread
@@ -0,0 +1,78 @@
+"""
+按棋盘版本缓存序列化后的gamestate
+
+同一棋盘、同一版本下所有客户端共享一份序列化好的JSON字节串，
+只有your_turn、my_color这类与观看者相关的少量字段在返回前拼接到末尾。
+N个观战者轮询同一棋盘时，每步棋只需序列化一次。
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from flask import Response, jsonify, request
+
+
+class ResponseCache:
+    """board_id -> (version, {variant: JSON字节串})
+
+    - 版本号变化后旧的序列化结果自动作废，修改棋盘时也可调用invalidate立即释放
+    - variant区分同一版本下的不同视图（如是否附带合法线条、增量棋谱的起点）
+    - 最多缓存max_boards个棋盘，超出时淘汰最久未访问的
+    """
+
+    def __init__(self, dumps, max_boards=1024):
+        self._dumps = dumps
+        self._max_boards = max_boards
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, board_id, version, build, variant=None, viewer=None):
+        """取缓存的序列化结果，未命中时调用build()生成与观看者无关的dict并序列化。
+        viewer为与观看者相关的字段(dict)，拼接到JSON对象末尾后一起返回bytes。
+        """
+        with self._lock:
+            entry = self._entries.get(board_id)
+            if entry is None or entry[0] != version:
+                entry = (version, {})
+                self._entries[board_id] = entry
+            self._entries.move_to_end(board_id)
+            while len(self._entries) > self._max_boards:
+                self._entries.popitem(last=False)
+            body = entry[1].get(variant)
+        if body is None:
+            body = self._dumps(build()).encode('utf-8')
+            with self._lock:
+                entry[1][variant] = body
+        if viewer:
+            body = self.splice(body, viewer)
+        return body
+
+    def splice(self, body, fields):
+        """把fields拼接进已序列化的JSON对象末尾"""
+        extra = ', '.join(f'{self._dumps(key)}: {self._dumps(value)}' for key, value in fields.items())
+        if body == b'{}':
+            return b'{' + extra.encode('utf-8') + b'}'
+        return body[:-1] + b', ' + extra.encode('utf-8') + b'}'
+
+    def invalidate(self, board_id):
+        with self._lock:
+            self._entries.pop(board_id, None)
+
+
+def conditional_response(etag, version, build_body, variant=''):
+    """带版本号的条件GET：
+    - 请求头If-None-Match与当前ETag一致时返回304
+    - 参数since_version与当前版本一致时返回简短的unchanged响应
+    - 否则返回build_body()生成的JSON字节串，并附带ETag
+    variant为同一版本下不同视图的后缀（如附带合法线条的'-L'），需同时加在etag和since_version上，
+    客户端拿着另一种视图的版本号请求时仍返回完整内容
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif request.args.get('since_version') == f'{version}{variant}':
+        response = jsonify({'unchanged': True, 'version': version})
+    else:
+        response = Response(build_body(), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,653 @@
+"""
+棋盘状态存储
+
+各游戏服务器通过STORE读写棋盘，不再直接操作进程内的字典：
+- MemoryStore：进程内字典，只能配合单个gunicorn worker使用（默认）
+- SQLiteStore：本机SQLite文件，多个worker进程共享同一份棋盘，可使用 --workers N
+- JournalStore：进程内存储 + 磁盘上的快照和操作日志，服务器重启后棋盘不丢失
+
+通过环境变量 PLAYGROUND_STATE_STORE 选择：
+    memory                 进程内存储（默认）
+    sqlite                 使用 <项目根目录>/data/<游戏名>.sqlite3
+    sqlite:<路径>          使用指定的数据库文件
+    journal                使用 <项目根目录>/data/<游戏名>/ 目录
+    journal:<目录>         使用 <目录>/<游戏名>/
+
+JournalStore另读取：
+    PLAYGROUND_MEMORY_BUDGET    内存中棋盘的预算，如 32M（默认）、512K；超出后把最久未访问的棋盘换出到磁盘
+    PLAYGROUND_BOARD_RETENTION  换出到磁盘的棋盘保留的秒数，默认7天
+
+版本号：新建棋盘的起始版本号取STORE.initial_version()，它大于本存储中已移除的棋盘用过的所有版本号。
+同一board_id的棋盘被删除后再新建，版本号不会从0重新开始，各worker按版本号缓存的gamestate、
+客户端手里的ETag和since_version都不会与旧棋盘混淆。
+
+用法约定：
+    with STORE.lock(board_id):                      # 修改前持有棋盘锁（同一线程内可重入）
+        board = STORE.get(board_id, create_board)   # SQLiteStore返回的是副本
+        ...修改board...
+        STORE.put(board_id, board, op)              # 写回后其他worker才能看到，op为可重放的操作记录
+
+    with STORE.reading(board_id):                   # 只读时保证读到的是一致的状态
+        board = STORE.get(board_id)
+"""
+
+import fcntl
+import heapq
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+from contextlib import nullcontext
+
+from common.board_locks import BoardLocks
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOUCH_INTERVAL = 5   # 秒，SQLiteStore中last_active的最短写入间隔
+SNAPSHOT_EVERY = 64  # JournalStore每个棋盘累计多少条日志后写一次快照并清空日志
+MEMORY_BUDGET = '32M'        # JournalStore内存中棋盘的默认预算（按序列化后的字节数估算）
+BOARD_RETENTION = 7 * 86400  # 秒，JournalStore换出到磁盘的棋盘默认保留多久
+
+
+class MemoryStore:
+    """进程内字典存储，get返回的就是棋盘对象本身，修改立即生效
+
+    过期和淘汰：按最后活跃时间维护一个最小堆，每个棋盘只有一个条目。
+    touch只改棋盘自身的last_active，不动堆；条目出堆时若发现棋盘期间被访问过，按新的时间重新入堆。
+    因此清理时只处理堆顶真正到期的棋盘，持有字典锁的时间与到期的棋盘数成正比，与棋盘总数无关。
+    """
+
+    shared = False  # 是否在多个进程间共享
+
+    def __init__(self, max_boards=None, on_delete=None):
+        self._boards = {}
+        self._lock = threading.Lock()  # 只保护字典本身的查找和增删
+        self._locks = BoardLocks()
+        self._expiry = []         # (last_active, board_id) 最小堆，last_active可能早于棋盘实际的值
+        self._scheduled = set()   # 已在堆中的board_id
+        self._max_boards = max_boards  # 棋盘数上限，超出时淘汰最久未访问的；None为不限
+        self._on_delete = on_delete    # 棋盘因过期、淘汰或delete被移除后的回调(board_id)
+        self._version_floor = 0        # 离开内存的棋盘用过的最大版本号+1，新棋盘从这里开始
+
+    def lock(self, board_id):
+        return self._locks.get(board_id)
+
+    def condition(self, board_id):
+        """棋盘变化时用于唤醒推送连接的条件变量，与棋盘锁是同一个对象"""
+        return self._locks.get(board_id)
+
+    def reading(self, board_id):
+        # 棋盘对象被原地修改，读取时也需要持有棋盘锁
+        return self._locks.get(board_id)
+
+    def get(self, board_id, create=None):
+        """取棋盘；不存在且给出create时调用create()新建"""
+        evicted = []
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None and create is not None:
+                board = create()
+                evicted = self._add(board_id, board)
+        self._evicted(evicted)
+        return board
+
+    def put(self, board_id, board, op=None):
+        evicted = []
+        with self._lock:
+            if board_id in self._boards:
+                self._boards[board_id] = board
+            else:
+                evicted = self._add(board_id, board)
+        self._evicted(evicted)
+
+    def touch(self, board_id, board):
+        board['last_active'] = time.time()
+
+    def initial_version(self):
+        """新建棋盘的起始版本号。get在持有字典锁时调用create，这里不再加锁，读一个整数本身是原子的"""
+        return self._version_floor
+
+    def delete(self, board_id):
+        with self._lock:
+            board = self._boards.pop(board_id, None)
+            if board is not None:
+                self._retire(board)
+        if board is not None:
+            self._removed([board_id])
+
+    def oldest_active(self):
+        """最早可能到期的棋盘的last_active，没有棋盘时返回None；清理线程据此决定睡多久"""
+        with self._lock:
+            return self._expiry[0][0] if self._expiry else None
+
+    def delete_expired(self, before):
+        """删除无人在线且在before之前就不再活跃的棋盘，返回被删除的board_id"""
+        deleted = self._take_expired(before)
+        self._removed(deleted)
+        return deleted
+
+    def _take_expired(self, before):
+        """把到期的棋盘移出内存，返回其board_id"""
+        deleted = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] < before:
+                board_id, board = self._pop_oldest()
+                if board is None:
+                    continue
+                if board.get('last_active', 0) >= before:
+                    self._schedule(board_id, board['last_active'])
+                elif board.get('online', 0) > 0:
+                    # 仍有人在线：过一个过期周期再检查
+                    self._schedule(board_id, time.time())
+                else:
+                    del self._boards[board_id]
+                    self._retire(board)
+                    deleted.append(board_id)
+        return deleted
+
+    def __contains__(self, board_id):
+        with self._lock:
+            return board_id in self._boards
+
+    def __len__(self):
+        with self._lock:
+            return len(self._boards)
+
+    def _add(self, board_id, board):
+        """新增棋盘并返回因超出上限被淘汰的board_id，调用方需持有字典锁"""
+        evicted = []
+        while self._max_boards is not None and len(self._boards) >= self._max_boards and self._expiry:
+            oldest, oldest_board = self._pop_oldest()
+            if oldest is not None:
+                del self._boards[oldest]
+                self._retire(oldest_board)
+                evicted.append(oldest)
+        self._boards[board_id] = board
+        if board_id not in self._scheduled:
+            self._schedule(board_id, board.get('last_active', time.time()))
+        return evicted
+
+    def _retire(self, board):
+        """棋盘离开内存，之后新建的棋盘版本号要大于它的，调用方需持有字典锁"""
+        self._version_floor = max(self._version_floor, board.get('version', 0) + 1)
+
+    def _schedule(self, board_id, last_active):
+        heapq.heappush(self._expiry, (last_active, board_id))
+        self._scheduled.add(board_id)
+
+    def _pop_oldest(self):
+        """弹出最久未访问的棋盘，返回(board_id, 棋盘)；堆为空时返回(None, None)。
+        出堆的条目若已过时（棋盘已删除或期间被访问过）则丢弃或按新时间重新入堆，继续找下一个
+        """
+        while self._expiry:
+            last_active, board_id = heapq.heappop(self._expiry)
+            board = self._boards.get(board_id)
+            if board is None:
+                self._scheduled.discard(board_id)
+                continue
+            actual = board.get('last_active', last_active)
+            if actual > last_active:
+                heapq.heappush(self._expiry, (actual, board_id))
+                continue
+            self._scheduled.discard(board_id)
+            return board_id, board
+        return None, None
+
+    def _removed(self, board_ids):
+        """棋盘被移除后调用，子类可在此清理磁盘上的数据"""
+        if self._on_delete:
+            for board_id in board_ids:
+                self._on_delete(board_id)
+
+    def _evicted(self, board_ids):
+        """棋盘因超出上限被淘汰后调用，进程内存储只能直接删除"""
+        self._removed(board_ids)
+
+
+class FileBoardLock:
+    """进程内的可重入锁 + 跨进程的文件锁(flock)
+
+    同一进程内的线程先在条件变量上排队，只有最外层的加锁才去取文件锁，
+    所以同一线程可以重入，且文件锁不会被同进程的其他线程误判为已持有。
+    """
+
+    def __init__(self, path):
+        self.condition = threading.Condition(threading.RLock())
+        # 推送连接只持有条件变量，借此让锁对象一同保持存活，不被BoardLocks回收
+        self.condition.board_lock = self
+        self._path = path
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self.condition.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._depth -= 1
+                self.condition.release()
+                raise
+            self._fd = fd
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.condition.release()
+
+
+class SQLiteStore:
+    """SQLite文件存储，棋盘整体pickle后存为一行，供同一台机器上的多个worker进程共享
+
+    - 每个棋盘的修改用文件锁串行化，不同棋盘之间互不阻塞
+    - get返回反序列化出的副本，修改后必须put才会生效
+    - 其他worker上的修改无法通过条件变量唤醒，推送连接需要定期检查版本号
+    """
+
+    shared = True
+
+    def __init__(self, path, max_boards=None, on_delete=None):
+        self._path = path
+        self._lock_dir = path + '.locks'
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._local = threading.local()
+        self._locks = BoardLocks(lambda board_id: FileBoardLock(os.path.join(self._lock_dir, f'{board_id}.lock')))
+        self._touched = {}
+        self._max_boards = max_boards
+        self._on_delete = on_delete  # 只对本进程删除的棋盘回调
+        self._db().execute(
+            'CREATE TABLE IF NOT EXISTS boards ('
+            ' board_id TEXT PRIMARY KEY,'
+            ' version INTEGER NOT NULL,'
+            ' online INTEGER NOT NULL,'
+            ' last_active REAL NOT NULL,'
+            ' data BLOB NOT NULL)')
+        # 按活跃时间的索引：查最早的棋盘和到期的棋盘都只需扫描索引的一端
+        self._db().execute('CREATE INDEX IF NOT EXISTS boards_last_active ON boards (last_active)')
+        # 已删除的棋盘用过的最大版本号+1，各worker共享，新棋盘从这里开始
+        self._db().execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._db().execute("INSERT OR IGNORE INTO meta VALUES ('version_floor', 0)")
+
+    def _db(self):
+        """每个线程一个连接，自动提交"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def lock(self, board_id):
+        return self._locks.get(board_id)
+
+    def condition(self, board_id):
+        return self._locks.get(board_id).condition
+
+    def reading(self, board_id):
+        # 每次读取都是从同一行反序列化出的独立副本，天然一致，无需加锁
+        return nullcontext()
+
+    def get(self, board_id, create=None):
+        row = self._db().execute('SELECT data FROM boards WHERE board_id = ?', (board_id,)).fetchone()
+        if row is None:
+            if create is None:
+                return None
+            # 多个worker同时创建时只有第一个写入生效，随后统一读回
+            board = create()
+            inserted = self._db().execute('INSERT OR IGNORE INTO boards VALUES (?, ?, ?, ?, ?)',
+                                          self._row(board_id, board)).rowcount
+            if inserted and self._max_boards is not None:
+                self._evict(board_id)
+            row = self._db().execute('SELECT data FROM boards WHERE board_id = ?', (board_id,)).fetchone()
+        return pickle.loads(row[0])
+
+    def _evict(self, keep):
+        """超出上限时删除最久未访问的棋盘（不含刚创建的keep）"""
+        excess = self._db().execute('SELECT COUNT(*) FROM boards').fetchone()[0] - self._max_boards
+        if excess <= 0:
+            return
+        rows = self._db().execute('SELECT board_id FROM boards WHERE board_id != ? ORDER BY last_active LIMIT ?',
+                                  (keep, excess)).fetchall()
+        for (board_id,) in rows:
+            self.delete(board_id)
+
+    def put(self, board_id, board, op=None):
+        self._db().execute('INSERT OR REPLACE INTO boards VALUES (?, ?, ?, ?, ?)', self._row(board_id, board))
+
+    def touch(self, board_id, board):
+        """只更新活跃时间，避免每次读取都整行重写；同一棋盘TOUCH_INTERVAL秒内最多写一次"""
+        now = time.time()
+        board['last_active'] = now
+        if now - self._touched.get(board_id, 0) < TOUCH_INTERVAL:
+            return
+        self._touched[board_id] = now
+        self._db().execute('UPDATE boards SET last_active = ? WHERE board_id = ?', (now, board_id))
+
+    def initial_version(self):
+        return self._db().execute("SELECT value FROM meta WHERE key = 'version_floor'").fetchone()[0]
+
+    def delete(self, board_id):
+        self._touched.pop(board_id, None)
+        if self._delete_row(board_id) and self._on_delete:
+            self._on_delete(board_id)
+
+    def _delete_row(self, board_id, condition='', params=()):
+        """删除一行并在同一事务中抬高version_floor，返回是否删除"""
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute("UPDATE meta SET value = MAX(value, COALESCE("
+                       f"(SELECT version + 1 FROM boards WHERE board_id = ?{condition}), 0))"
+                       " WHERE key = 'version_floor'", (board_id, *params))
+            deleted = db.execute(f'DELETE FROM boards WHERE board_id = ?{condition}', (board_id, *params)).rowcount
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return bool(deleted)
+
+    def oldest_active(self):
+        return self._db().execute('SELECT MIN(last_active) FROM boards').fetchone()[0]
+
+    def delete_expired(self, before):
+        rows = self._db().execute('SELECT board_id FROM boards WHERE last_active < ? AND online <= 0',
+                                  (before,)).fetchall()
+        deleted = []
+        for (board_id,) in rows:
+            # 查询之后可能被其他worker访问过，删除时再判断一次
+            if self._delete_row(board_id, ' AND online <= 0 AND last_active < ?', (before,)):
+                self._touched.pop(board_id, None)
+                deleted.append(board_id)
+                if self._on_delete:
+                    self._on_delete(board_id)
+        return deleted
+
+    def __contains__(self, board_id):
+        return self._db().execute('SELECT 1 FROM boards WHERE board_id = ?', (board_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM boards').fetchone()[0]
+
+    @staticmethod
+    def _row(board_id, board):
+        return (board_id, board.get('version', 0), board.get('online', 0), board.get('last_active', time.time()),
+                pickle.dumps(board, pickle.HIGHEST_PROTOCOL))
+
+
+class JournalStore(MemoryStore):
+    """进程内存储 + 每个棋盘一份快照(.snapshot)和一份追加写的操作日志(.log)
+
+    - put携带op时只向日志追加一条(版本号, 更新时间, op)，每SNAPSHOT_EVERY条写一次快照并清空日志
+    - put不带op（如重置后整盘替换）时直接写快照
+    - 启动时不读取任何文件；某个棋盘第一次被访问时才加载快照并用replay(board, op)重放日志
+    - 快照中的版本号之前的日志记录会被跳过，写快照后清空日志之前崩溃也不会重复重放
+    - 日志写入操作系统即返回，不逐条fsync：能扛住进程重启和worker回收，不保证断电时的最后几步
+
+    内存预算：磁盘上的快照和日志始终是最新的，棋盘随时可以从内存中“换出”而不丢数据。
+    - 每个棋盘占用的内存按其快照加日志的字节数估算，总和超过memory_budget时换出最久未访问的棋盘
+    - 过期和超出max_boards的棋盘也只换出，不删除文件；再次访问时由get透明地重新加载
+    - 换出后超过retention秒仍无人访问的棋盘才删除文件
+    """
+
+    _HEADER = struct.Struct('>I')  # 每条日志记录前的长度
+    _SNAPSHOT = '.snapshot'
+
+    def __init__(self, directory, replay, snapshot_every=SNAPSHOT_EVERY, max_boards=None, on_delete=None,
+                 memory_budget=None, retention=None):
+        super().__init__(max_boards, on_delete)
+        os.makedirs(directory, exist_ok=True)
+        self._dir = directory
+        self._replay = replay
+        self._snapshot_every = snapshot_every
+        self._pending = {}  # board_id -> 上次快照后的日志条数；不在其中表示磁盘上还没有快照
+        self._memory_budget = memory_budget  # 内存中棋盘的估算字节数上限，None为不限
+        self._retention = retention          # 换出的棋盘保留多少秒后删除文件，None为一直保留
+        self._sizes = {}        # 内存中的board_id -> 估算字节数
+        self._memory_used = 0
+        self._archive = None    # (换出时间, board_id) 最小堆，第一次清理时扫描目录建立
+        self._archived = {}     # 只在磁盘上的board_id -> 换出时间，用于识别堆中过时的条目
+
+    def get(self, board_id, create=None):
+        board = super().get(board_id)
+        if board is not None:
+            return board
+        with self.lock(board_id):
+            board = super().get(board_id)
+            if board is None:
+                board, size = self._recover(board_id)
+                if board is not None:
+                    with self._lock:
+                        self._archived.pop(board_id, None)
+                    super().put(board_id, board)
+                    self._account(board_id, size)
+                    self._enforce_budget(board_id)
+            if board is None and create is not None:
+                board = super().get(board_id, create)
+            return board
+
+    def put(self, board_id, board, op=None):
+        super().put(board_id, board)
+        pending = self._pending.get(board_id)
+        if op is None or pending is None or pending + 1 >= self._snapshot_every:
+            self._account(board_id, self._write_snapshot(board_id, board))
+        else:
+            size = self._append(board_id, (board.get('version'), board.get('updated_at'), op))
+            self._pending[board_id] = pending + 1
+            self._account(board_id, self._sizes.get(board_id, 0) + size)
+        self._enforce_budget(board_id)
+
+    def delete_expired(self, before):
+        """过期的棋盘只换出到磁盘；换出超过retention秒的棋盘删除文件。返回离开内存或被删除的board_id"""
+        spilled = self._take_expired(before)
+        self._spilled(spilled)
+        return spilled + self._purge_archive()
+
+    def memory_used(self):
+        """内存中棋盘的估算字节数"""
+        with self._lock:
+            return self._memory_used
+
+    def _account(self, board_id, size):
+        with self._lock:
+            if board_id in self._boards:
+                self._memory_used += size - self._sizes.get(board_id, 0)
+                self._sizes[board_id] = size
+
+    def _enforce_budget(self, keep):
+        """超出内存预算时换出最久未访问的棋盘；keep（正在使用的棋盘）和仍有人在线的棋盘不换出"""
+        if self._memory_budget is None:
+            return
+        spilled = []
+        skipped = []
+        with self._lock:
+            while self._memory_used > self._memory_budget:
+                board_id, board = self._pop_oldest()
+                if board_id is None:
+                    break
+                if board_id == keep or board.get('online', 0) > 0:
+                    skipped.append((board_id, board))
+                    continue
+                del self._boards[board_id]
+                self._retire(board)
+                self._memory_used -= self._sizes.pop(board_id, 0)
+                spilled.append(board_id)
+            for board_id, board in skipped:
+                self._schedule(board_id, board.get('last_active', time.time()))
+        self._spilled(spilled)
+
+    def _evicted(self, board_ids):
+        self._spilled(board_ids)
+
+    def _spilled(self, board_ids):
+        """棋盘已移出内存，文件保留；登记换出时间，到期后由_purge_archive删除"""
+        now = time.time()
+        with self._lock:
+            for board_id in board_ids:
+                self._memory_used -= self._sizes.pop(board_id, 0)
+                self._archived[board_id] = now
+                if self._archive is not None:
+                    heapq.heappush(self._archive, (now, board_id))
+        super()._removed(board_ids)
+
+    def _purge_archive(self):
+        if self._retention is None:
+            return []
+        if self._archive is None:
+            self._scan_archive()
+        before = time.time() - self._retention
+        due = []
+        with self._lock:
+            while self._archive and self._archive[0][0] < before:
+                spilled_at, board_id = heapq.heappop(self._archive)
+                # 已重新载入内存或之后又换出过一次的，条目已过时
+                if self._archived.get(board_id) == spilled_at:
+                    del self._archived[board_id]
+                    due.append(board_id)
+        purged = []
+        for board_id in due:
+            with self.lock(board_id):
+                if board_id not in self:
+                    self._remove_files(board_id)
+                    purged.append(board_id)
+        return purged
+
+    def _scan_archive(self):
+        """登记启动前就在磁盘上的棋盘，以快照的修改时间作为换出时间"""
+        found = []
+        for entry in os.scandir(self._dir):
+            if entry.name.endswith(self._SNAPSHOT):
+                found.append((entry.name[:-len(self._SNAPSHOT)], entry.stat().st_mtime))
+        with self._lock:
+            for board_id, mtime in found:
+                if board_id not in self._boards:
+                    self._archived.setdefault(board_id, mtime)
+            self._archive = [(spilled_at, board_id) for board_id, spilled_at in self._archived.items()]
+            heapq.heapify(self._archive)
+
+    def _removed(self, board_ids):
+        for board_id in board_ids:
+            self._remove_files(board_id)
+        with self._lock:
+            for board_id in board_ids:
+                self._memory_used -= self._sizes.pop(board_id, 0)
+        super()._removed(board_ids)
+
+    def _paths(self, board_id):
+        base = os.path.join(self._dir, board_id)
+        return base + self._SNAPSHOT, base + '.log'
+
+    def _write_snapshot(self, board_id, board):
+        """先写临时文件再原子替换，最后清空日志；返回快照的字节数"""
+        snapshot_path, log_path = self._paths(board_id)
+        tmp_path = snapshot_path + '.tmp'
+        data = pickle.dumps(board, pickle.HIGHEST_PROTOCOL)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, snapshot_path)
+        open(log_path, 'wb').close()
+        self._pending[board_id] = 0
+        return len(data)
+
+    def _append(self, board_id, record):
+        """追加一条日志记录，返回写入的字节数"""
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        data = self._HEADER.pack(len(data)) + data
+        with open(self._paths(board_id)[1], 'ab') as f:
+            f.write(data)
+        return len(data)
+
+    def _recover(self, board_id):
+        """从快照和日志恢复棋盘，返回(棋盘, 快照和日志的字节数)；磁盘上没有该棋盘时返回(None, 0)"""
+        snapshot_path, log_path = self._paths(board_id)
+        try:
+            with open(snapshot_path, 'rb') as f:
+                snapshot = f.read()
+        except FileNotFoundError:
+            return None, 0
+        board = pickle.loads(snapshot)
+        replayed = 0
+        try:
+            with open(log_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        offset = 0
+        while offset + self._HEADER.size <= len(data):
+            (length,) = self._HEADER.unpack_from(data, offset)
+            end = offset + self._HEADER.size + length
+            if end > len(data):
+                break
+            version, updated_at, op = pickle.loads(data[offset + self._HEADER.size:end])
+            offset = end
+            if version is not None and version <= board.get('version', 0):
+                continue
+            self._replay(board, op)
+            if version is not None:
+                board['version'] = version
+            if updated_at is not None:
+                board['updated_at'] = updated_at
+            replayed += 1
+        # 在线人数属于进程运行期的状态，重启后由客户端心跳重新计数
+        if 'online' in board:
+            board['online'] = 0
+        if offset < len(data):
+            # 末尾是写了一半的记录（进程在追加时被杀），截掉后继续追加
+            with open(log_path, 'r+b') as f:
+                f.truncate(offset)
+        self._pending[board_id] = replayed
+        return board, len(snapshot) + offset
+
+    def _remove_files(self, board_id):
+        self._pending.pop(board_id, None)
+        for path in self._paths(board_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def create_store(name, replay=None, max_boards=None, on_delete=None):
+    """按环境变量PLAYGROUND_STATE_STORE创建存储。
+    name为游戏名，用于默认的数据文件名；replay(board, op)用于JournalStore重放操作日志；
+    max_boards为棋盘数上限（超出时淘汰最久未访问的）；on_delete(board_id)在本进程移除棋盘后调用。
+    """
+    spec = os.environ.get('PLAYGROUND_STATE_STORE', 'memory')
+    kind, _, path = spec.partition(':')
+    if kind == 'memory':
+        return MemoryStore(max_boards, on_delete)
+    if kind == 'sqlite':
+        if not path:
+            os.makedirs(os.path.join(ROOT_DIR, 'data'), exist_ok=True)
+            path = os.path.join(ROOT_DIR, 'data', f'{name}.sqlite3')
+        return SQLiteStore(path, max_boards, on_delete)
+    if kind == 'journal':
+        # 路径为数据根目录，各游戏各占一个子目录
+        directory = os.path.join(path or os.path.join(ROOT_DIR, 'data'), name)
+        budget = parse_bytes(os.environ.get('PLAYGROUND_MEMORY_BUDGET', MEMORY_BUDGET))
+        retention = int(os.environ.get('PLAYGROUND_BOARD_RETENTION', BOARD_RETENTION))
+        return JournalStore(directory, replay, max_boards=max_boards, on_delete=on_delete,
+                            memory_budget=budget, retention=retention)
+    raise ValueError(f'未知的PLAYGROUND_STATE_STORE: {spec}')
+
+
+def parse_bytes(text):
+    """'64M'、'512K'、'1G'或纯数字 -> 字节数"""
+    text = text.strip().upper()
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def secret_key():
+    """多个worker之间共享的session密钥：优先读取环境变量PLAYGROUND_SECRET_KEY"""
+    key = os.environ.get('PLAYGROUND_SECRET_KEY')
+    return key.encode('utf-8') if key else os.urandom(24)
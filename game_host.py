@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+单进程多游戏模式：各游戏的Flask应用按路径前缀挂在同一个WSGI应用下，由一个gunicorn服务器（可多worker）运行
+
+    /gobang/...        五子棋
+    /hexagon_game/...  三角连锁棋
+    /siege/...         围城棋
+
+- 各游戏只在每个worker里导入一次，共用一个解释器；不再为每个游戏单独占一个端口和一组进程
+- 静态文件由SharedDataMiddleware直接从各游戏的static目录返回，不经过游戏的Flask应用
+- 页面和脚本里的地址都带上前缀（模板中的request.script_root），直接运行各游戏的app.py时前缀为空，行为不变
+- 各游戏的session cookie限定在自己的前缀下，同名的cookie互不覆盖
+- 同步模式运行 game_host:app，异步模式运行 game_host:asgi_app（长轮询按前缀交给对应游戏，见common/asgi.py）
+"""
+
+import importlib
+import os
+import sys
+
+from flask import Flask, jsonify
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.middleware.shared_data import SharedDataMiddleware
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from common.asgi import AsgiApp
+
+HOSTED_GAMES = ('gobang', 'hexagon_game', 'siege')
+STATIC_MAX_AGE = 3600  # 秒，静态文件的缓存时间
+
+
+def load_games(names):
+    """导入各游戏的app模块，返回 {游戏名: 模块}"""
+    modules = {}
+    for name in names:
+        module = importlib.import_module(f'{name}.app')
+        module.app.config['SESSION_COOKIE_PATH'] = f'/{name}/'
+        modules[name] = module
+    return modules
+
+
+GAMES = load_games(HOSTED_GAMES)
+
+root = Flask(__name__)
+
+
+@root.route('/health')
+def health():
+    return 'ok', 200
+
+
+@root.route('/')
+def index():
+    """各游戏的入口地址"""
+    return jsonify({name: f'/{name}/' for name in GAMES})
+
+
+app = SharedDataMiddleware(
+    DispatcherMiddleware(root, {f'/{name}': module.app for name, module in GAMES.items()}),
+    {f'/{name}/static': os.path.join(ROOT_DIR, name, 'static') for name in GAMES},
+    cache_timeout=STATIC_MAX_AGE)
+
+asgi_app = AsgiApp(app, {f'/{name}': module.LONG_POLL for name, module in GAMES.items()})
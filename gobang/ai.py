@@ -0,0 +1,274 @@
+"""
+五子棋AI：威胁空间候选点 + 迭代加深的alpha-beta搜索 + Zobrist置换表
+
+search_move在AI子进程中运行（见app.py的ai_pool），不占用处理请求的线程，也不争抢其GIL。
+置换表按board_id保存在子进程内，同一棋盘的后续几步继续复用；同一棋盘总是交给同一个子进程。
+
+搜索使用四周各留PAD格“墙”的一维数组，任意方向取11格的窗口都不会越界，
+窗口内的棋型分值按内容缓存，落子时只重新计算经过该点的4个窗口。
+"""
+
+import random
+import time
+from collections import OrderedDict
+
+from gobang import bitboard
+
+PAD = 5              # 棋盘四周的墙宽，等于窗口的半径
+WALL = 2             # 墙的取值，棋子为1/-1，空为0
+FIVE = 10 ** 7       # 窗口中出现5连的分值
+MAKES_FIVE = FIVE // 2  # 落子后分值增加超过此值即成五（原有的冲四被替换，增量略小于FIVE）
+WIN = 10 ** 9        # 必胜局面的分值，减去步数后仍远大于普通局面
+OPEN_FOUR = 100000
+FOUR = 10000
+MAX_DEPTH = 16
+ROOT_WIDTH = 12      # 根节点最多展开的候选点数
+NODE_WIDTH = 8       # 其余节点最多展开的候选点数
+TIME_CHECK_NODES = 256        # 每搜索多少个节点检查一次是否超时
+TABLE_BOARDS = 32             # 每个子进程最多保留多少个棋盘的置换表
+TABLE_MAX_ENTRIES = 200000    # 单个置换表的条目上限，超出后清空
+WINDOW_CACHE_MAX = 500000     # 窗口棋型分值缓存的条目上限，超出后清空
+ZOBRIST_SEED = 20240601       # 固定种子，各子进程的哈希一致
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# 棋型分值：x为己方，o为对方棋子或墙，.为空
+PATTERNS = [
+    ('xxxxx', FIVE),
+    ('.xxxx.', OPEN_FOUR),
+    ('xxxx.', FOUR), ('.xxxx', FOUR), ('xxx.x', FOUR), ('x.xxx', FOUR), ('xx.xx', FOUR),
+    ('.xxx.', 1000), ('.xx.x.', 1000), ('.x.xx.', 1000),
+    ('xxx..', 100), ('..xxx', 100), ('xx.x.', 100), ('.x.xx', 100), ('x.xx.', 100), ('.xx.x', 100),
+    ('..xx..', 100), ('.x.x.', 30), ('.xx..', 10), ('..xx.', 10),
+]
+
+_WINDOW_SCORES = {}
+_TABLES = OrderedDict()  # board_id -> 置换表 {哈希: (深度, 分值, 类型, 最佳落点)}
+_ZOBRIST = {}            # size -> {颜色: [每格的随机数]}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _pattern_score(line):
+    return sum(line.count(pattern) * value for pattern, value in PATTERNS)
+
+
+def window_score(window):
+    """窗口(元组)的棋型分值 (黑, 白)"""
+    score = _WINDOW_SCORES.get(window)
+    if score is None:
+        if len(_WINDOW_SCORES) >= WINDOW_CACHE_MAX:
+            _WINDOW_SCORES.clear()
+        black = ''.join('x' if c == 1 else '.' if c == 0 else 'o' for c in window)
+        white = ''.join('x' if c == -1 else '.' if c == 0 else 'o' for c in window)
+        score = _WINDOW_SCORES[window] = (_pattern_score(black), _pattern_score(white))
+    return score
+
+
+def zobrist_keys(size):
+    keys = _ZOBRIST.get(size)
+    if keys is None:
+        rng = random.Random(ZOBRIST_SEED + size)
+        cells = (size + 2 * PAD) ** 2
+        keys = _ZOBRIST[size] = {color: [rng.getrandbits(64) for _ in range(cells)] for color in bitboard.COLORS}
+    return keys
+
+
+def transposition_table(board_id):
+    table = _TABLES.get(board_id)
+    if table is None:
+        table = _TABLES[board_id] = {}
+        while len(_TABLES) > TABLE_BOARDS:
+            _TABLES.popitem(last=False)
+    else:
+        _TABLES.move_to_end(board_id)
+    if len(table) > TABLE_MAX_ENTRIES:
+        table.clear()
+    return table
+
+
+class Position:
+    """搜索用的可变局面：落子/撤销时增量维护哈希、局面分值和邻近计数"""
+
+    def __init__(self, bits, size):
+        self.size = size
+        self.width = width = size + 2 * PAD
+        self.cells = [WALL] * (width * width)
+        self.near = [0] * (width * width)  # 周围两格内的棋子数，大于0的空点才作为候选
+        self.points = [self.index(x, y) for y in range(size) for x in range(size)]
+        self.directions = (1, width, width + 1, width - 1)
+        self.neighbors = [dy * width + dx for dy in range(-2, 3) for dx in range(-2, 3) if dx or dy]
+        self.keys = zobrist_keys(size)
+        self.hash = 0
+        self.score = 0  # 黑方棋型分值 - 白方棋型分值
+        self.stones = 0
+        for i in self.points:
+            self.cells[i] = 0
+        rows = bitboard.to_rows(bits, size)
+        for y in range(size):
+            for x in range(size):
+                if rows[y][x]:
+                    self.play(self.index(x, y), rows[y][x])
+
+    def index(self, x, y):
+        return (y + PAD) * self.width + x + PAD
+
+    def coords(self, i):
+        y, x = divmod(i, self.width)
+        return x - PAD, y - PAD
+
+    def delta(self, i, color):
+        """在空点i落下color后 (黑分值变化, 白分值变化)"""
+        cells = self.cells
+        black = white = 0
+        for d in self.directions:
+            lo, hi = i - PAD * d, i + PAD * d + 1
+            before = window_score(tuple(cells[lo:hi:d]))
+            cells[i] = color
+            after = window_score(tuple(cells[lo:hi:d]))
+            cells[i] = 0
+            black += after[0] - before[0]
+            white += after[1] - before[1]
+        return black, white
+
+    def play(self, i, color):
+        black, white = self.delta(i, color)
+        self.cells[i] = color
+        self.score += black - white
+        self.hash ^= self.keys[color][i]
+        self.stones += 1
+        for offset in self.neighbors:
+            self.near[i + offset] += 1
+        return black, white
+
+    def undo(self, i, color, delta):
+        self.cells[i] = 0
+        self.score -= delta[0] - delta[1]
+        self.hash ^= self.keys[color][i]
+        self.stones -= 1
+        for offset in self.neighbors:
+            self.near[i + offset] -= 1
+
+    def candidates(self, color, width):
+        """威胁空间候选点，返回 (是否一步成五, [落点...])
+
+        - 能一步成五：只返回该点
+        - 对方能一步成五：只返回所有挡点
+        - 能走出活四（对方无四时必胜）：只返回该点
+        - 对方能走出活四：只考虑挡点和己方冲四
+        - 其余按进攻与防守收益之和排序，保留前width个
+        """
+        cells, near = self.cells, self.near
+        scored = []
+        for i in self.points:
+            if cells[i] or not near[i]:
+                continue
+            mine = self.delta(i, color)
+            theirs = self.delta(i, -color)
+            attack = mine[0] if color == 1 else mine[1]
+            defend = theirs[1] if color == 1 else theirs[0]
+            if attack >= MAKES_FIVE:
+                return True, [i]
+            scored.append((attack, defend, i))
+        if not scored:
+            return False, [self.index(self.size // 2, self.size // 2)] if not self.stones else []
+        blocks = [i for attack, defend, i in scored if defend >= MAKES_FIVE]
+        if blocks:
+            return False, blocks
+        fours = [i for attack, defend, i in scored if attack >= OPEN_FOUR]
+        if fours:
+            return False, fours[:1]
+        if any(defend >= OPEN_FOUR for attack, defend, i in scored):
+            scored = [s for s in scored if s[1] >= OPEN_FOUR or s[0] >= FOUR]
+        scored.sort(key=lambda s: s[0] + s[1], reverse=True)
+        return False, [i for attack, defend, i in scored[:width]]
+
+
+class Search:
+    def __init__(self, position, table, deadline):
+        self.position = position
+        self.table = table
+        self.deadline = deadline
+        self.nodes = 0
+
+    def negamax(self, depth, alpha, beta, color, ply):
+        self.nodes += 1
+        if self.nodes % TIME_CHECK_NODES == 0 and time.perf_counter() > self.deadline:
+            raise _Timeout()
+        position = self.position
+        entry = self.table.get(position.hash)
+        best_move = None
+        if entry is not None:
+            entry_depth, entry_score, flag, best_move = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return entry_score
+                if flag == LOWER and entry_score >= beta:
+                    return entry_score
+                if flag == UPPER and entry_score <= alpha:
+                    return entry_score
+        if depth == 0:
+            return position.score * color
+        win, moves = position.candidates(color, NODE_WIDTH)
+        if win:
+            return WIN - ply
+        if not moves:
+            return 0
+        if best_move in moves:
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+        original_alpha = alpha
+        best = -WIN * 2
+        for i in moves:
+            delta = position.play(i, color)
+            try:
+                score = -self.negamax(depth - 1, -beta, -alpha, -color, ply + 1)
+            finally:
+                position.undo(i, color, delta)
+            if score > best:
+                best, best_move = score, i
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break
+        flag = UPPER if best <= original_alpha else LOWER if best >= beta else EXACT
+        self.table[position.hash] = (depth, best, flag, best_move)
+        return best
+
+    def root(self, color, time_limit):
+        """迭代加深，返回最后一轮完整搜索的 (落点, 分值, 深度)"""
+        position = self.position
+        win, moves = position.candidates(color, ROOT_WIDTH)
+        if win or len(moves) == 1:
+            return moves[0], WIN if win else 0, 0
+        best_move, best_score, completed = moves[0], 0, 0
+        for depth in range(1, MAX_DEPTH + 1):
+            scores = {}
+            alpha = -WIN * 2
+            try:
+                for i in moves:
+                    delta = position.play(i, color)
+                    try:
+                        scores[i] = -self.negamax(depth - 1, -WIN * 2, -alpha, -color, 1)
+                    finally:
+                        position.undo(i, color, delta)
+                    alpha = max(alpha, scores[i])
+            except _Timeout:
+                break
+            # 上一轮的分值决定下一轮的搜索顺序，先搜最好的着法以便更早剪枝
+            moves.sort(key=lambda i: scores[i], reverse=True)
+            best_move, best_score, completed = moves[0], scores[moves[0]], depth
+            if abs(best_score) >= WIN - MAX_DEPTH or time.perf_counter() > self.deadline:
+                break
+        return best_move, best_score, completed
+
+
+def search_move(board_id, bits, size, color, time_limit):
+    """为color选一步棋，返回 {'x', 'y', 'score', 'depth', 'nodes'}"""
+    deadline = time.perf_counter() + time_limit
+    position = Position(bits, size)
+    search = Search(position, transposition_table(board_id), deadline)
+    move, score, depth = search.root(color, time_limit)
+    x, y = position.coords(move)
+    return {'x': x, 'y': y, 'score': score, 'depth': depth, 'nodes': search.nodes}
@@ -1,20 +1,59 @@
 import os
-import copy
+import sys
 import string
 import random
 import time
+import copy
+import hmac
+import secrets
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from flask import Flask, render_template, jsonify, request, session
-from threading import Lock, Thread
+from flask import Flask, render_template, jsonify, request, session, Response
+from threading import BoundedSemaphore, Lock
+
+# 将项目根目录加入模块搜索路径，以便引用公共模块common
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from common.asgi import ASGI_ENVIRON_KEY, AsgiApp, LongPoll, StreamWait
+from common.expiry import start_expiry_thread
+from common.response_cache import ResponseCache, conditional_response
+from common.state_store import create_store, secret_key
+from gobang import ai, bitboard
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = secret_key()  # 多个worker需共享同一密钥，见PLAYGROUND_SECRET_KEY
+RESPONSE_CACHE = ResponseCache(app.json.dumps)
 
-# 多棋盘全局变量
-BOARDS = {}
-BOARDS_LOCK = Lock()
-CLEANUP_INTERVAL = 60  # 秒
+# 多棋盘存储：默认进程内存储，设置PLAYGROUND_STATE_STORE=sqlite后可多worker共享，
+# 设置为journal时落盘，重启后按需重放（replay_op定义在后面）
+STORE = create_store('gobang', replay=lambda board, op: replay_op(board, op), on_delete=RESPONSE_CACHE.invalidate)
+# 异步模式下的长轮询：/api/gamestate?since_version=V&wait=秒 在棋盘变化前不占线程（见common/asgi.py）
+LONG_POLL = LongPoll(STORE)
 BOARD_EXPIRE = 120     # 超过2分钟无人访问自动销毁
+UNDO_LIMIT = 20        # 最多可连续悔棋的步数
+WELCOME_MESSAGE = "欢迎来到五子棋！请选择颜色开始游戏。"
+STREAM_PING_INTERVAL = 15  # 秒，SSE保活注释的发送间隔
+STREAM_MAX_AGE = 300       # 秒，单条SSE连接的最长存活时间，到期后浏览器自动重连
+STREAM_RETRY_MS = 3000     # 毫秒，建议浏览器断线重连的等待时间
+STREAM_POLL_INTERVAL = 1   # 秒，共享存储下推送连接检查其他worker修改的间隔
+# 同步模式下每条推送连接在等待期间独占一个worker线程（main.py的GAME_SERVER_THREADS），每个进程同时保持的连接数
+# 需远低于线程数，把线程留给落子等请求；超出时返回503，浏览器改用轮询
+STREAM_MAX_CLIENTS = int(os.environ.get('PLAYGROUND_STREAM_CLIENTS', '16'))
+STREAM_SLOTS = BoundedSemaphore(STREAM_MAX_CLIENTS)
+BATCH_MAX_MOVES = 500      # /api/moves/batch单次最多的步数
+# 回放对局时批量请求需要替双方落子：请求头X-Replay-Token与此相同时，每步可用color指定颜色；
+# 未设置时批量落子和/api/move一样只能使用session中的颜色
+REPLAY_TOKEN = os.environ.get('PLAYGROUND_REPLAY_TOKEN')
+AI_PROCESSES = int(os.environ.get('PLAYGROUND_AI_PROCESSES', os.cpu_count() or 1))  # AI搜索子进程数
+AI_TIME_LIMIT = 1.0        # 秒，AI每步默认的思考时间
+AI_MAX_TIME_LIMIT = 5.0    # 秒，请求可指定的思考时间上限
+AI_RESULT_GRACE = 5.0      # 秒，超过思考时间这么久仍未返回结果则放弃（如子进程排队或刚启动）
+AI_POOLS = []              # 每个AI子进程一个单进程池，同一棋盘固定交给同一个子进程以复用置换表
+AI_POOLS_LOCK = Lock()
 
 # 棋盘id生成
 def gen_board_id():
@@ -24,44 +63,54 @@ def gen_board_id():
 def create_new_board():
     size = 15
     now = datetime.now().isoformat() + 'Z'
+    # 同一id的棋盘删除后再新建，版本号和棋谱时间线编号都接着旧棋盘往上数，见STORE.initial_version
+    version = STORE.initial_version()
     state = {
         'size': size,
-        'board': [[0 for _ in range(size)] for _ in range(size)],
         'players': [1, -1],  # 1=黑，-1=白
         'last_move': None,
         'last_move_color': None,
         'winner': None,
         'game_over': False,
-        'message': "欢迎来到五子棋！请选择颜色开始游戏。"
+        'message': WELCOME_MESSAGE
     }
     return {
         'state': state,
-        'history': [],
+        'bits': bitboard.empty(),  # 位棋盘{颜色: 掩码}，接口中的board二维数组由此导出
+        'stones': 0,               # 棋盘上的棋子数，下满即平局
+        'history': deque(maxlen=UNDO_LIMIT),  # 可悔棋的最近落子(x, y, color)，超出上限自动丢弃最早的
+        'moves': [],              # 完整棋谱，每步为(x, y, color)
+        'epoch': version,         # 棋谱时间线编号，悔棋或重置时自增
+        'seats': {},              # 颜色 -> 最后选择该颜色的玩家（session中的player_id），电脑只能替无人执的一方落子
         'online': 0,
         'last_active': time.time(),
-        'created_at': now
+        'created_at': now,
+        'updated_at': now,
+        'version': version        # 棋盘每次变化自增，用于推送和条件GET
     }
 
 def get_board(board_id, create_if_missing=True):
-    with BOARDS_LOCK:
-        if board_id not in BOARDS:
-            if not create_if_missing:
-                return None
-            BOARDS[board_id] = create_new_board()
-        board = BOARDS[board_id]
-        board['last_active'] = time.time()
-        return board
-
-def cleanup_boards():
-    while True:
-        time.sleep(CLEANUP_INTERVAL)
-        now = time.time()
-        with BOARDS_LOCK:
-            expired = [bid for bid, b in BOARDS.items() if b['online'] <= 0 and now - b['last_active'] > BOARD_EXPIRE]
-            for bid in expired:
-                del BOARDS[bid]
-
-Thread(target=cleanup_boards, daemon=True).start()
+    """取棋盘并刷新活跃时间。使用共享存储时返回的是副本，修改需经notify_board_changed写回"""
+    board = STORE.get(board_id, create_new_board if create_if_missing else None)
+    if board is not None:
+        STORE.touch(board_id, board)
+    return board
+
+def notify_board_changed(board_id, board, op=None):
+    """棋盘状态发生变化：版本号自增并写回存储，作废已缓存的序列化结果，唤醒所有推送连接和长轮询。
+    op为本次修改的操作记录，供操作日志重放（见replay_op）。调用方需持有该棋盘的锁。
+    """
+    board['version'] += 1
+    board['updated_at'] = datetime.now().isoformat() + 'Z'
+    STORE.put(board_id, board, op)
+    RESPONSE_CACHE.invalidate(board_id)
+    LONG_POLL.notify(board_id)
+    changed = STORE.condition(board_id)
+    with changed:
+        changed.notify_all()
+
+# 后台清理无人访问的棋盘，被删除的棋盘经on_delete作废已缓存的gamestate
+start_expiry_thread(STORE, BOARD_EXPIRE)
 
 @app.route('/')
 def index():
@@ -71,59 +120,51 @@ def index():
 def health():
     return 'ok', 200
 
-@app.route('/api/gamestate')
-def get_gamestate():
-    board_id = request.args.get('board_id')
-    my_color = request.args.get('my_color', None)
-    if my_color is not None:
-        try:
-            my_color = int(my_color)
-            if my_color not in [1, -1]:
-                my_color = None
-        except Exception:
-            my_color = None
+def parse_color(value):
+    """解析颜色参数，非法时返回None"""
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except Exception:
+        return None
+    return value if value in [1, -1] else None
+
+def resolve_my_color(board_id):
+    """优先取请求参数my_color，否则取session中保存的颜色"""
+    my_color = parse_color(request.args.get('my_color', None))
     if my_color is None:
-        my_color = session.get(f'player_color_{board_id}', None)
-        if my_color is not None:
-            try:
-                my_color = int(my_color)
-                if my_color not in [1, -1]:
-                    my_color = None
-            except Exception:
-                my_color = None
-    if not board_id or not board_id.isalnum() or len(board_id) != 8:
-        return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id, create_if_missing=True)
+        my_color = parse_color(session.get(f'player_color_{board_id}', None))
+    return my_color
+
+def get_current_turn(state):
+    """当前轮到哪一方，黑棋先行"""
+    if state['last_move_color'] is None:
+        return 1
+    return -state['last_move_color']
+
+def viewer_fields(board, my_color):
+    """与观看者相关的字段，在共享的序列化结果之后单独拼接"""
+    your_turn = 1 if (my_color is not None and my_color == get_current_turn(board['state'])) else 0
+    return {'your_turn': your_turn, 'my_color': my_color}
+
+def state_view(board):
+    """落子、悔棋、重置接口返回的state，board二维数组由位棋盘导出"""
+    state = board['state']
+    return dict(state, board=bitboard.to_rows(board['bits'], state['size']))
+
+def build_gamestate(board_id, board):
+    """构建标准格式的gamestate（不含your_turn、my_color等观看者字段）"""
     state = board['state']
 
     # 构建move_history
-    move_history = []
-    for h in board['history']:
-        if h.get('last_move'):
-            move = h['last_move']
-            move_history.append({
-                'position': {'x': move['x'], 'y': move['y']},
-                'color': move['color']
-            })
-    if state['last_move']:
-        move = state['last_move']
-        move_history.append({
-            'position': {'x': move['x'], 'y': move['y']},
-            'color': move['color']
-        })
+    move_history = [{'position': {'x': x, 'y': y}, 'color': color} for x, y, color in board['moves']]
     last_move_data = state['last_move'] if state['last_move'] else None
 
     # 当前回合
-    if state['last_move_color'] is None:
-        current_turn = 1
-    else:
-        current_turn = -state['last_move_color']
+    current_turn = get_current_turn(state)
 
-    # your_turn判断
-    your_turn = 1 if (my_color is not None and my_color == current_turn) else 0
-
-    return jsonify({
-        'your_turn': your_turn,
+    return {
         'game_info': {
             'game_type': '五子棋 (Gomoku)',
             'board_size': state['size'],
@@ -132,7 +173,7 @@ def get_gamestate():
             'game_status': 'active' if not state['game_over'] else 'inactive',
             'current_turn': current_turn
         },
-        'board': state['board'],
+        'board': bitboard.to_rows(board['bits'], state['size']),
         'board_legend': {
             '0': '空位',
             '1': '黑棋',
@@ -142,31 +183,166 @@ def get_gamestate():
             'current_turn': current_turn,
             'move_count': len(move_history),
             'last_move': last_move_data,
-            'move_history': move_history
+            'move_history': move_history,
+            'epoch': board['epoch']
         },
         'metadata': {
             'board_id': board_id,
             'created_at': board.get('created_at', datetime.now().isoformat() + 'Z'),
-            'last_updated': datetime.now().isoformat() + 'Z',
-            'version': '1.0'
+            'last_updated': board.get('updated_at', board.get('created_at')),
+            'version': '1.0',
+            'state_version': board['version']
         },
-        'my_color': my_color,
         'winner': state['winner'],
         'game_over': state['game_over'],
         'message': state['message']
-    })
+    }
+
+def normalize_after(board, after, epoch):
+    """客户端的epoch与棋盘不一致（期间发生过悔棋或重置）时，从第0步开始全量返回"""
+    if epoch != board['epoch'] or after > len(board['moves']):
+        return 0
+    return after
+
+def build_moves_delta(board_id, board, after):
+    """构建增量棋谱：只返回第after步之后的落子（不含观看者字段）"""
+    state = board['state']
+    moves = board['moves']
+    return {
+        'board_id': board_id,
+        'after': after,
+        'moves': [{'x': x, 'y': y, 'color': color} for x, y, color in moves[after:]],
+        'move_count': len(moves),
+        'epoch': board['epoch'],
+        'version': board['version'],
+        'current_turn': get_current_turn(state),
+        'last_move_color': state['last_move_color'],
+        'winner': state['winner'],
+        'game_over': state['game_over'],
+        'message': state['message']
+    }
+
+def cached_gamestate(board_id, board, version, my_color):
+    """完整gamestate的JSON字节串，同一版本下所有观看者共享一次序列化"""
+    return RESPONSE_CACHE.get(board_id, version, lambda: build_gamestate(board_id, board),
+                              variant='gamestate', viewer=viewer_fields(board, my_color))
+
+def cached_moves_delta(board_id, board, version, after, my_color):
+    """增量棋谱的JSON字节串，按起点after分别缓存"""
+    return RESPONSE_CACHE.get(board_id, version, lambda: build_moves_delta(board_id, board, after),
+                              variant=('moves', after), viewer=viewer_fields(board, my_color))
+
+@app.route('/api/gamestate')
+def get_gamestate():
+    board_id = request.args.get('board_id')
+    my_color = resolve_my_color(board_id)
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的棋盘id'}), 400
+    # 保证版本号与序列化出的内容一致
+    with STORE.reading(board_id):
+        board = get_board(board_id, create_if_missing=True)
+        version = board['version']
+        return conditional_response(f'{board_id}-{version}-{my_color}', version,
+                                    lambda: cached_gamestate(board_id, board, version, my_color))
+
+@app.route('/api/moves')
+def get_moves():
+    """增量棋谱：/api/moves?board_id=xxx&after=N[&epoch=E]"""
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的棋盘id'}), 400
+    try:
+        after = int(request.args.get('after', 0))
+        epoch = int(request.args['epoch']) if 'epoch' in request.args else None
+    except ValueError:
+        return jsonify({'error': '无效的after或epoch参数'}), 400
+    if after < 0:
+        return jsonify({'error': '无效的after或epoch参数'}), 400
+    my_color = resolve_my_color(board_id)
+    with STORE.reading(board_id):
+        board = get_board(board_id, create_if_missing=True)
+        version = board['version']
+        after = normalize_after(board, after, board['epoch'] if epoch is None else epoch)
+        return conditional_response(f'{board_id}-{version}-{my_color}', version,
+                                    lambda: cached_moves_delta(board_id, board, version, after, my_color))
+
+@app.route('/api/stream')
+def stream_gamestate():
+    """SSE推送：建立连接时推送一次完整gamestate，
+    之后仅在落子/悔棋/重置改变棋盘时推送增量棋谱(moves事件)。
+    同步模式下连接数达到STREAM_MAX_CLIENTS时返回503，客户端退回轮询；
+    异步模式下等待棋盘变化交给事件循环（产出StreamWait，见common/asgi.py），不占线程也不限连接数"""
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的棋盘id'}), 400
+    on_event_loop = request.environ.get(ASGI_ENVIRON_KEY, False)
+    if not on_event_loop and not STREAM_SLOTS.acquire(blocking=False):
+        return jsonify({'error': '推送连接已满，请改用轮询'}), 503
+    my_color = resolve_my_color(board_id)
+    changed = STORE.condition(board_id)
+    # 其他worker上的修改不会唤醒本进程的条件变量，共享存储时需定期检查版本号
+    wait_timeout = STREAM_POLL_INTERVAL if STORE.shared else STREAM_PING_INTERVAL
+
+    def generate():
+        sent_version = None
+        sent_count, sent_epoch = 0, None
+        deadline = time.time() + STREAM_MAX_AGE
+        last_write = time.time()
+        yield f'retry: {STREAM_RETRY_MS}\n\n'
+        while time.time() < deadline:
+            # 进程内存储时条件变量即棋盘锁，持有它读取棋盘保证一致
+            with changed:
+                # 每次取棋盘都会刷新活跃时间，有推送连接的棋盘不会被清理线程销毁
+                board = get_board(board_id)
+                if board['version'] == sent_version and not on_event_loop:
+                    changed.wait(wait_timeout)
+                    board = get_board(board_id)
+                version = board['version']
+                if version == sent_version:
+                    body = None
+                # 同一版本下所有推送连接共享序列化结果，只拼接各自的观看者字段
+                elif sent_version is None:
+                    event, body = 'gamestate', cached_gamestate(board_id, board, version, my_color)
+                else:
+                    after = normalize_after(board, sent_count, sent_epoch)
+                    event, body = 'moves', cached_moves_delta(board_id, board, version, after, my_color)
+                sent_version, sent_count, sent_epoch = version, len(board['moves']), board['epoch']
+            if body is not None:
+                last_write = time.time()
+                yield f'event: {event}\nid: {version}\ndata: {body.decode("utf-8")}\n\n'
+            # 共享存储下每秒醒来检查一次，保活注释仍按STREAM_PING_INTERVAL发送；
+            # 异步模式下没有变化说明已等满一个保活间隔
+            elif on_event_loop or not STORE.shared or time.time() - last_write >= STREAM_PING_INTERVAL:
+                last_write = time.time()
+                yield ': ping\n\n'
+            if on_event_loop:
+                yield StreamWait(LONG_POLL, board_id, version, STREAM_PING_INTERVAL)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    # 生成器不读取request和session（颜色已在上面解析），不需要stream_with_context保留请求上下文，
+    # 多条连接的生成器交替执行时也不会互相弹出对方的上下文
+    response = Response(generate(), mimetype='text/event-stream', headers=headers)
+    if not on_event_loop:
+        # 连接关闭（到期、客户端断开）时归还名额
+        response.call_on_close(STREAM_SLOTS.release)
+    return response
 
 @app.route('/api/select_color', methods=['POST'])
 def select_color():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id)
     data = request.get_json()
     color = data.get('color')
     if color not in [1, -1]:
         return jsonify({'error': '无效的颜色'}), 400
+    player_id = session.setdefault('player_id', secrets.token_hex(8))
     session[f'player_color_{board_id}'] = color
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        if seat_holder(board, color) != player_id:
+            take_seat(board, color, player_id)
+            notify_board_changed(board_id, board, ('seat', color, player_id))
     return jsonify({'message': f'颜色已选择: {"黑" if color == 1 else "白"}'})
 
 @app.route('/api/reset', methods=['POST'])
@@ -174,84 +350,253 @@ def handle_reset():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    with BOARDS_LOCK:
-        BOARDS[board_id] = create_new_board()
-    return jsonify(BOARDS[board_id]['state'])
+    created_at = datetime.now().isoformat() + 'Z'
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        reset_board(board, created_at)
+        notify_board_changed(board_id, board, ('reset', created_at))
+        return jsonify(state_view(board))
 
 @app.route('/api/undo', methods=['POST'])
 def handle_undo():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id)
     if f'player_color_{board_id}' not in session:
         return jsonify({'error': '请先选择你的颜色'}), 403
-    if not board['history']:
-        return jsonify({'error': '没有可悔棋的步骤'}), 400
-    if board['state'].get('last_move_color') != session.get(f'player_color_{board_id}'):
-        return jsonify({'error': '只能撤销自己下的最后一步棋'}), 403
-    board['state'] = board['history'].pop()
-    return jsonify(board['state'])
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        if not board['history']:
+            return jsonify({'error': '没有可悔棋的步骤'}), 400
+        if board['state'].get('last_move_color') != session.get(f'player_color_{board_id}'):
+            return jsonify({'error': '只能撤销自己下的最后一步棋'}), 403
+        undo_move(board)
+        notify_board_changed(board_id, board, ('undo',))
+        return jsonify(state_view(board))
 
 @app.route('/api/move', methods=['POST'])
 def make_move():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id)
     if f'player_color_{board_id}' not in session:
         return jsonify({'error': '请先选择你的颜色'}), 403
-    if board['state'].get('game_over', True):
-        return jsonify({'error': '游戏已经结束！'}), 400
     data = request.get_json()
     x, y = data.get('x'), data.get('y')
-    size = board['state']['size']
-    if not (isinstance(x, int) and isinstance(y, int) and 0 <= x < size and 0 <= y < size):
-        return jsonify({'error': '无效的落子点'}), 400
     my_color = session[f'player_color_{board_id}']
+    # 校验和落子在同一把棋盘锁内完成，避免并发请求同时通过轮次检查
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        error = check_move(board, x, y, my_color)
+        if error:
+            return jsonify({'error': error[0]}), error[1]
+        apply_move(board, x, y, my_color)
+        notify_board_changed(board_id, board, ('move', x, y, my_color))
+        return jsonify(state_view(board))
+
+@app.route('/api/moves/batch', methods=['POST'])
+def make_moves_batch():
+    """按顺序落一组棋（机器人、导入棋谱），请求体 {"moves": [{"x", "y", "color"?}, ...]}。
+    在一把棋盘锁内逐步按/api/move的规则校验，任一步不合法则整批不生效；
+    颜色只能是session中的颜色；带正确X-Replay-Token的回放请求可按每步的color替双方落子。只返回最终的state
+    """
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的棋盘id'}), 400
+    data = request.get_json(silent=True) or {}
+    moves = data.get('moves')
+    if not isinstance(moves, list) or not moves or len(moves) > BATCH_MAX_MOVES:
+        return jsonify({'error': f'moves需为1~{BATCH_MAX_MOVES}步的列表'}), 400
+    session_color = session.get(f'player_color_{board_id}')
+    replay = is_replay_request()
+    with STORE.lock(board_id):
+        # 在副本上逐步落子，全部合法后才替换原棋盘
+        board = copy.deepcopy(get_board(board_id))
+        ops = []
+        for index, move in enumerate(moves):
+            if not isinstance(move, dict):
+                return jsonify({'error': '无效的落子点', 'index': index}), 400
+            x, y = move.get('x'), move.get('y')
+            color = move.get('color', session_color) if replay else session_color
+            if color is None:
+                return jsonify({'error': '请先选择你的颜色', 'index': index}), 403
+            if not replay and move.get('color', color) != color:
+                return jsonify({'error': '只能使用自己选择的颜色落子', 'index': index}), 403
+            error = check_move(board, x, y, color)
+            if error:
+                return jsonify({'error': error[0], 'index': index}), error[1]
+            apply_move(board, x, y, color)
+            ops.append(('move', x, y, color))
+        notify_board_changed(board_id, board, ('batch', ops))
+        return jsonify(dict(state_view(board), applied=len(ops)))
+
+def is_replay_request():
+    """请求是否带有正确的回放令牌（见REPLAY_TOKEN）"""
+    token = request.headers.get('X-Replay-Token')
+    return bool(REPLAY_TOKEN) and token is not None and hmac.compare_digest(token.encode(), REPLAY_TOKEN.encode())
+
+def new_ai_pool():
+    # 以spawn方式启动子进程，不从多线程的worker中fork
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+def ai_pool(board_id):
+    """同一棋盘总是交给同一个AI子进程，返回(序号, 进程池)"""
+    with AI_POOLS_LOCK:
+        if not AI_POOLS:
+            AI_POOLS.extend(new_ai_pool() for _ in range(max(1, AI_PROCESSES)))
+        index = hash(board_id) % len(AI_POOLS)
+        return index, AI_POOLS[index]
+
+def replace_ai_pool(index, pool):
+    """子进程异常退出后进程池不可再用，换一个新的"""
+    with AI_POOLS_LOCK:
+        if AI_POOLS[index] is pool:
+            AI_POOLS[index] = new_ai_pool()
+    pool.shutdown(wait=False)
+
+@app.route('/api/ai_move', methods=['POST'])
+def make_ai_move():
+    """由服务器为轮到的一方落子（人机对战、机器人压测）。
+    请求方需已选择颜色，电脑只替请求方自己或无其他玩家执的一方落子（见seats），观战者和对手不能替玩家落子。
+    搜索在AI子进程中进行，期间不持有棋盘锁；搜索期间棋盘有变化时放弃这一步，返回409
+    """
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的棋盘id'}), 400
+    my_color = session.get(f'player_color_{board_id}')
+    if my_color is None:
+        return jsonify({'error': '请先选择你的颜色'}), 403
+    data = request.get_json(silent=True) or {}
+    time_limit = data.get('time_limit', AI_TIME_LIMIT)
+    if isinstance(time_limit, bool) or not isinstance(time_limit, (int, float)) or time_limit <= 0:
+        return jsonify({'error': '无效的思考时间'}), 400
+    time_limit = min(time_limit, AI_MAX_TIME_LIMIT)
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        if board['state'].get('game_over', True):
+            return jsonify({'error': '游戏已经结束！'}), 400
+        color = get_current_turn(board['state'])
+        if color != my_color and seat_holder(board, color) not in (None, session.get('player_id')):
+            return jsonify({'error': '对方由其他玩家执棋，电脑不能替其落子'}), 403
+        version = board['version']
+        bits = dict(board['bits'])
+        size = board['state']['size']
+    index, pool = ai_pool(board_id)
+    try:
+        result = pool.submit(ai.search_move, board_id, bits, size, color, time_limit).result(
+            timeout=time_limit + AI_RESULT_GRACE)
+    except BrokenProcessPool:
+        replace_ai_pool(index, pool)
+        return jsonify({'error': '电脑暂时无法落子，请稍后重试'}), 503
+    except FutureTimeoutError:
+        return jsonify({'error': '电脑暂时无法落子，请稍后重试'}), 503
+    x, y = result['x'], result['y']
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        if board['version'] != version:
+            return jsonify({'error': '棋盘已变化，请重试'}), 409
+        apply_move(board, x, y, color)
+        notify_board_changed(board_id, board, ('move', x, y, color))
+        return jsonify(dict(state_view(board), ai_move={'x': x, 'y': y, 'color': color, 'depth': result['depth']}))
+
+def seat_holder(board, color):
+    """执该颜色的玩家id，无人选择时为None（旧快照中的棋盘没有seats）"""
+    return board.get('seats', {}).get(color)
+
+def take_seat(board, color, player_id):
+    """玩家选择颜色，记为该颜色的执棋者"""
+    board.setdefault('seats', {})[color] = player_id
+
+def check_move(board, x, y, color):
+    """按落子规则校验，合法时返回None，否则返回(错误信息, 状态码)"""
+    state = board['state']
+    if state.get('game_over', True):
+        return '游戏已经结束！', 400
+    size = state['size']
+    if not (isinstance(x, int) and isinstance(y, int) and 0 <= x < size and 0 <= y < size):
+        return '无效的落子点', 400
+    if isinstance(color, bool) or color not in state['players']:
+        return '无效的颜色', 400
     # 轮流下
-    if board['state']['last_move_color'] is None:
-        if my_color != 1:
-            return jsonify({'error': '黑棋先行'}), 403
-    else:
-        if my_color == board['state']['last_move_color']:
-            return jsonify({'error': '请等待对方下棋'}), 403
+    if state['last_move_color'] is None:
+        if color != 1:
+            return '黑棋先行', 403
+    elif color == state['last_move_color']:
+        return '请等待对方下棋', 403
     # 不能重复落子
-    if board['state']['board'][y][x] != 0:
-        return jsonify({'error': '该位置已有棋子'}), 400
-    # 记录历史
-    board['history'].append(copy.deepcopy(board['state']))
-    if len(board['history']) > 20:
-        board['history'].pop(0)
+    if bitboard.occupied(board['bits'], size, x, y):
+        return '该位置已有棋子', 400
+    return None
+
+def apply_move(board, x, y, color):
+    """落子并判断胜负，调用前已校验过合法性"""
+    # 记录历史（只记录落子本身，悔棋时逆向恢复）
+    board['history'].append((x, y, color))
     # 落子
-    board['state']['board'][y][x] = my_color
-    board['state']['last_move'] = {'x': x, 'y': y, 'color': my_color}
-    board['state']['last_move_color'] = my_color
-    # 判断胜负
-    if check_win(board['state']['board'], x, y, my_color):
-        board['state']['winner'] = my_color
+    size = board['state']['size']
+    bitboard.place(board['bits'], size, x, y, color)
+    board['stones'] += 1
+    board['state']['last_move'] = {'x': x, 'y': y, 'color': color}
+    board['state']['last_move_color'] = color
+    board['moves'].append((x, y, color))
+    # 判断胜负：落子前棋盘上没有5连，有则必经过这一子
+    if bitboard.has_five(board['bits'][color], size):
+        board['state']['winner'] = color
+        board['state']['game_over'] = True
+        board['state']['message'] = f"游戏结束！胜者：{'黑棋' if color == 1 else '白棋'}"
+    elif board['stones'] == size * size:
         board['state']['game_over'] = True
-        board['state']['message'] = f"游戏结束！胜者：{'黑棋' if my_color == 1 else '白棋'}"
+        board['state']['message'] = '游戏结束，平局！'
+
+def reset_board(board, created_at):
+    """原地重置，epoch和版本号在原棋盘上继续递增"""
+    fresh = create_new_board()
+    board['state'] = fresh['state']
+    board['bits'] = fresh['bits']
+    board['stones'] = fresh['stones']
+    board['history'] = fresh['history']
+    board['moves'] = fresh['moves']
+    board['epoch'] += 1
+    board['created_at'] = created_at
+    board['updated_at'] = created_at
+
+def undo_move(board):
+    """撤销最后一步：清空该点并恢复上一步的落子信息，棋谱时间线编号(epoch)自增。
+    已结束的棋局不会再有新落子，所以撤销前的棋局一定未结束，提示语也只会是欢迎语。
+    """
+    state = board['state']
+    x, y, color = board['history'].pop()
+    board['moves'].pop()
+    bitboard.remove(board['bits'], state['size'], x, y, color)
+    board['stones'] -= 1
+    if board['moves']:
+        px, py, pcolor = board['moves'][-1]
+        state['last_move'] = {'x': px, 'y': py, 'color': pcolor}
+        state['last_move_color'] = pcolor
     else:
-        if all(all(cell != 0 for cell in row) for row in board['state']['board']):
-            board['state']['game_over'] = True
-            board['state']['message'] = '游戏结束，平局！'
-    return jsonify(board['state'])
-
-def check_win(board, x, y, color):
-    size = len(board)
-    directions = [ (1,0), (0,1), (1,1), (1,-1) ]
-    for dx, dy in directions:
-        count = 1
-        for dir in [1, -1]:
-            nx, ny = x, y
-            while True:
-                nx += dx * dir
-                ny += dy * dir
-                if 0 <= nx < size and 0 <= ny < size and board[ny][nx] == color:
-                    count += 1
-                else:
-                    break
-        if count >= 5:
-            return True
-    return False 
\ No newline at end of file
+        state['last_move'] = None
+        state['last_move_color'] = None
+    state['winner'] = None
+    state['game_over'] = False
+    state['message'] = WELCOME_MESSAGE
+    board['epoch'] += 1
+
+def replay_op(board, op):
+    """重放操作日志中的一条记录，修改与对应接口完全一致"""
+    kind = op[0]
+    if kind == 'move':
+        apply_move(board, *op[1:])
+    elif kind == 'undo':
+        undo_move(board)
+    elif kind == 'reset':
+        reset_board(board, op[1])
+    elif kind == 'seat':
+        take_seat(board, *op[1:])
+    elif kind == 'batch':
+        for move in op[1]:
+            replay_op(board, move)
+    else:
+        raise ValueError(f'未知的操作记录: {op!r}')
+
+# 异步服务模式的入口：gunicorn -k asgi app:asgi_app（见main.py的PLAYGROUND_SERVER_MODE）
+asgi_app = AsgiApp(app, LONG_POLL)
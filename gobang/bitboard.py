@@ -0,0 +1,61 @@
+"""
+五子棋位棋盘
+
+每种颜色的棋子存成一个Python整数，第y行第x列对应第 y*(size+1)+x 位。
+每行末尾多留一个恒为0的空位，横向、斜向移位时不会从上一行的末尾“接”到下一行的开头，
+因此同一个掩码在四个方向上都能直接用移位和按位与判断连子：
+    横 1、竖 size+1、正斜 size+2、反斜 size
+
+棋盘上的二维数组（0空 / 1黑 / -1白）不再保存，由to_rows按需导出给接口使用。
+"""
+
+COLORS = (1, -1)  # 1=黑，-1=白
+
+
+def empty():
+    """空棋盘：{颜色: 掩码}"""
+    return {color: 0 for color in COLORS}
+
+
+def bit(size, x, y):
+    return 1 << (y * (size + 1) + x)
+
+
+def occupied(bits, size, x, y):
+    mask = bit(size, x, y)
+    return any(bits[color] & mask for color in COLORS)
+
+
+def place(bits, size, x, y, color):
+    bits[color] |= bit(size, x, y)
+
+
+def remove(bits, size, x, y, color):
+    bits[color] &= ~bit(size, x, y)
+
+
+def has_five(mask, size):
+    """掩码中是否有任意方向连成5子。
+    m = mask & (mask >> s) 标出“本格和沿方向的下一格都有子”的格，
+    再与自身移2步、与原掩码移4步相与，剩下的每一位都是一条5连的起点。
+    """
+    stride = size + 1
+    for shift in (1, stride, stride + 1, stride - 1):
+        pairs = mask & (mask >> shift)
+        if pairs & (pairs >> 2 * shift) & (mask >> 4 * shift):
+            return True
+    return False
+
+
+def to_rows(bits, size):
+    """导出二维数组视图 board[y][x]"""
+    stride = size + 1
+    rows = [[0] * size for _ in range(size)]
+    for color in COLORS:
+        mask = bits[color]
+        while mask:
+            low = mask & -mask
+            y, x = divmod(low.bit_length() - 1, stride)
+            rows[y][x] = color
+            mask ^= low
+    return rows
@@ -5,11 +5,20 @@ const colorSelector = document.getElementById('color-selector');
 const resetButton = document.getElementById('reset-button');
 const undoButton = document.getElementById('undo-button');
 const helpButton = document.getElementById('help-button');
+const aiButton = document.getElementById('ai-button');
 
 let gameState = {};
 let myColor = null;
 let selectedPoint = null;
 let isFetching = false;
+let eventSource = null;
+let pollTimer = null;
+let streamTimer = null;
+let stateVersion = null;
+let moveCount = 0;
+let moveEpoch = null;
+let aiOpponent = false;
+let aiThinking = false;
 
 function getBoardId() {
     const url = new URL(window.location.href);
@@ -22,11 +31,13 @@ function getBoardId() {
     }
     return boardId;
 }
+// 挂在路径前缀下运行时（见game_host.py）由页面给出前缀，接口地址都以它开头
+const API_ROOT = window.API_ROOT || '';
 const BOARD_ID = getBoardId();
 if (!BOARD_ID) throw new Error('board_id未初始化');
 
 async function apiFetch(url, options={}) {
-    const u = new URL(url, window.location.origin);
+    const u = new URL(API_ROOT + url, window.location.origin);
     u.searchParams.set('board_id', BOARD_ID);
     return fetch(u.toString(), options);
 }
@@ -154,9 +165,32 @@ async function onPointClick(x, y) {
             alert('错误: ' + data.error);
         }
         await fetchGameState();
+        if (response.ok && aiOpponent) await requestAiMove();
     } catch (error) { console.error("请求失败:", error); }
 }
 
+// 电脑对手：轮到对方时由服务器落子
+async function requestAiMove() {
+    if (aiThinking || gameState.game_over || isMyTurn() || (myColor !== 1 && myColor !== -1)) return;
+    aiThinking = true;
+    statusBox.textContent = '电脑思考中...';
+    try {
+        const response = await apiFetch('/api/ai_move', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: '{}' });
+        if (!response.ok) {
+            const data = await response.json();
+            alert('错误: ' + data.error);
+        }
+        await fetchGameState();
+    } catch (error) { console.error("请求失败:", error); }
+    finally { aiThinking = false; }
+}
+
+aiButton.addEventListener('click', async () => {
+    aiOpponent = !aiOpponent;
+    aiButton.textContent = `电脑对手：${aiOpponent ? '开' : '关'}`;
+    if (aiOpponent) await requestAiMove();
+});
+
 async function selectMyColor(color) {
     try {
         const response = await apiFetch('/api/select_color', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ color }) });
@@ -165,6 +199,9 @@ async function selectMyColor(color) {
             alert('错误: ' + data.error);
         }
         myColor = color;
+        stateVersion = null;
+        // 推送连接绑定的是建立时的颜色，选色后需要重连
+        restartStream();
         await fetchGameState();
     } catch (error) { console.error("请求失败:", error); }
 }
@@ -221,30 +258,138 @@ helpButton.addEventListener('click', () => {
     document.body.appendChild(helpDiv);
 });
 
+function applyGameState(data) {
+    // 适配新结构
+    gameState = {};
+    gameState.size = data.game_info.board_size;
+    gameState.board = data.board;
+    gameState.board_legend = data.board_legend;
+    gameState.last_move_color = data.game_progress.last_move ? data.game_progress.last_move.color : null;
+    gameState.game_over = data.game_over;
+    gameState.winner = data.winner;
+    gameState.players = [1, -1];
+    gameState.message = data.message;
+    // 其它字段可按需补充
+    myColor = data.my_color;
+    stateVersion = data.metadata.state_version;
+    moveCount = data.game_progress.move_count;
+    moveEpoch = data.game_progress.epoch;
+    updateUI();
+}
+
+function applyMoves(data) {
+    // 期间发生过悔棋或重置时服务器从第0步开始全量返回，本地棋盘需清空后重放
+    if (data.after === 0) {
+        gameState.board = Array.from({length: gameState.size}, () => new Array(gameState.size).fill(0));
+    }
+    data.moves.forEach(m => { gameState.board[m.y][m.x] = m.color; });
+    moveCount = data.move_count;
+    moveEpoch = data.epoch;
+    stateVersion = data.version;
+    gameState.last_move_color = data.last_move_color;
+    gameState.game_over = data.game_over;
+    gameState.winner = data.winner;
+    gameState.message = data.message;
+    myColor = data.my_color;
+    updateUI();
+}
+
 async function fetchGameState() {
     if (isFetching) return;
     isFetching = true;
     try {
-        const response = await apiFetch('/api/gamestate');
-        if (response.ok) {
-            const data = await response.json();
-            // 适配新结构
-            gameState = {};
-            gameState.size = data.game_info.board_size;
-            gameState.board = data.board;
-            gameState.board_legend = data.board_legend;
-            gameState.last_move_color = data.game_progress.last_move ? data.game_progress.last_move.color : null;
-            gameState.game_over = data.game_over;
-            gameState.winner = data.winner;
-            gameState.players = [1, -1];
-            gameState.message = data.message;
-            // 其它字段可按需补充
-            myColor = data.my_color;
-            updateUI();
+        if (!gameState.board) {
+            const response = await apiFetch('/api/gamestate');
+            if (response.ok) applyGameState(await response.json());
+        } else {
+            // 只拉取本地棋谱之后的增量落子；带上已知版本号，棋盘未变化时服务器只返回简短的unchanged响应
+            let url = `/api/moves?after=${moveCount}&epoch=${moveEpoch}`;
+            if (stateVersion !== null) url += `&since_version=${stateVersion}`;
+            const response = await apiFetch(url);
+            if (response.ok) {
+                const data = await response.json();
+                if (!data.unchanged) applyMoves(data);
+            }
         }
     } catch (error) { console.error("请求失败:", error); }
     isFetching = false;
 }
 
-setInterval(fetchGameState, 2000);
-fetchGameState(); 
\ No newline at end of file
+// ========== 状态同步：优先SSE推送，轮询仅作兜底 ===========
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(fetchGameState, 2000);
+}
+
+function stopPolling() {
+    if (pollTimer) {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+}
+
+// 推送连接在这段时间内没有建立（服务器线程已满时请求会一直排队）就放弃，改用轮询
+const STREAM_CONNECT_TIMEOUT = 5000;
+// 推送被服务器拒绝或连接超时后，过这么久再尝试推送
+const STREAM_RETRY_DELAY = 60000;
+
+function clearStreamTimer() {
+    if (streamTimer) {
+        clearTimeout(streamTimer);
+        streamTimer = null;
+    }
+}
+
+function closeStream() {
+    clearStreamTimer();
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+}
+
+// 放弃推送，退回轮询，稍后再尝试推送
+function fallBackToPolling() {
+    closeStream();
+    startPolling();
+    streamTimer = setTimeout(startStream, STREAM_RETRY_DELAY);
+}
+
+function startStream() {
+    clearStreamTimer();
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    const u = new URL(API_ROOT + '/api/stream', window.location.origin);
+    u.searchParams.set('board_id', BOARD_ID);
+    const source = eventSource = new EventSource(u.toString());
+    source.addEventListener('gamestate', (event) => {
+        try { applyGameState(JSON.parse(event.data)); } catch (error) { console.error("推送解析失败:", error); }
+    });
+    source.addEventListener('moves', (event) => {
+        try { applyMoves(JSON.parse(event.data)); } catch (error) { console.error("推送解析失败:", error); }
+    });
+    streamTimer = setTimeout(fallBackToPolling, STREAM_CONNECT_TIMEOUT);
+    source.onopen = () => {
+        clearStreamTimer();
+        stopPolling();
+    };
+    source.onerror = () => {
+        if (source !== eventSource) return;
+        // 服务器拒绝（如推送连接已满返回503）时浏览器不会重连，由这里稍后重试；
+        // 否则浏览器会自动重连推送，断线期间先用轮询
+        if (source.readyState === EventSource.CLOSED) {
+            fallBackToPolling();
+        } else {
+            startPolling();
+        }
+    };
+}
+
+function restartStream() {
+    closeStream();
+    startStream();
+}
+
+startStream();
+fetchGameState();
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+测试五子棋的棋谱、悔棋、增量棋谱、条件GET和位棋盘
+"""
+
+from gobang import app as gobang_app
+from gobang import bitboard
+
+BOARD_ID = "Move1234"
+
+
+def new_players(board_id=BOARD_ID):
+    """创建黑白两个客户端并各自选好颜色"""
+    black = gobang_app.app.test_client()
+    white = gobang_app.app.test_client()
+    black.post(f"/api/reset?board_id={board_id}")
+    black.post(f"/api/select_color?board_id={board_id}", json={"color": 1})
+    white.post(f"/api/select_color?board_id={board_id}", json={"color": -1})
+    return black, white
+
+
+def test_undo_restores_previous_move():
+    black, white = new_players()
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 7, "y": 7})
+    white.post(f"/api/move?board_id={BOARD_ID}", json={"x": 8, "y": 8})
+
+    response = white.post(f"/api/undo?board_id={BOARD_ID}")
+    assert response.status_code == 200
+    state = response.get_json()
+    assert state["board"][8][8] == 0
+    assert state["last_move"] == {"x": 7, "y": 7, "color": 1}
+    assert state["last_move_color"] == 1
+
+    # 白棋撤销后轮到白棋，黑棋不能再悔白棋的棋
+    assert black.post(f"/api/undo?board_id={BOARD_ID}").status_code == 200
+    assert black.post(f"/api/undo?board_id={BOARD_ID}").status_code == 400
+
+
+def test_undo_limit_is_bounded():
+    black, white = new_players()
+    for i in range(gobang_app.UNDO_LIMIT + 5):
+        player = black if i % 2 == 0 else white
+        x, y = (i * 2) % 15, (i * 2) // 15 * 3
+        assert player.post(f"/api/move?board_id={BOARD_ID}", json={"x": x, "y": y}).status_code == 200
+    board = gobang_app.get_board(BOARD_ID)
+    assert len(board["history"]) == gobang_app.UNDO_LIMIT
+    assert len(board["moves"]) == gobang_app.UNDO_LIMIT + 5
+
+    data = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert data["game_progress"]["move_count"] == gobang_app.UNDO_LIMIT + 5
+
+
+def test_moves_delta_and_epoch():
+    black, white = new_players()
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 0, "y": 0})
+    white.post(f"/api/move?board_id={BOARD_ID}", json={"x": 1, "y": 0})
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 2, "y": 0})
+
+    epoch = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["game_progress"]["epoch"]
+    data = black.get(f"/api/moves?board_id={BOARD_ID}&after=2&epoch={epoch}").get_json()
+    assert data["after"] == 2
+    assert data["moves"] == [{"x": 2, "y": 0, "color": 1}]
+    assert data["move_count"] == 3
+
+    # 悔棋后epoch变化，服务器从第0步开始全量返回
+    black.post(f"/api/undo?board_id={BOARD_ID}")
+    data = black.get(f"/api/moves?board_id={BOARD_ID}&after=3&epoch={epoch}").get_json()
+    assert data["after"] == 0
+    assert len(data["moves"]) == 2
+    assert data["epoch"] == epoch + 1
+
+
+def test_conditional_gamestate():
+    black, _ = new_players()
+    response = black.get(f"/api/gamestate?board_id={BOARD_ID}")
+    etag = response.headers["ETag"]
+    version = response.get_json()["metadata"]["state_version"]
+
+    assert black.get(f"/api/gamestate?board_id={BOARD_ID}", headers={"If-None-Match": etag}).status_code == 304
+    data = black.get(f"/api/gamestate?board_id={BOARD_ID}&since_version={version}").get_json()
+    assert data == {"unchanged": True, "version": version}
+
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 7, "y": 7})
+    response = black.get(f"/api/gamestate?board_id={BOARD_ID}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["metadata"]["state_version"] > version
+
+
+def test_spectators_share_serialized_gamestate():
+    black, white = new_players()
+    spectator = gobang_app.app.test_client()
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 7, "y": 7})
+
+    calls = []
+    build = gobang_app.build_gamestate
+
+    def counting_build(*args):
+        calls.append(args)
+        return build(*args)
+
+    gobang_app.build_gamestate = counting_build
+    try:
+        views = [client.get(f"/api/gamestate?board_id={BOARD_ID}").get_json() for client in (black, white, spectator)]
+    finally:
+        gobang_app.build_gamestate = build
+    assert len(calls) == 1
+    assert [(v["my_color"], v["your_turn"]) for v in views] == [(1, 0), (-1, 1), (None, 0)]
+    assert views[0]["board"] == views[2]["board"]
+
+
+def test_stream_connections_are_capped(monkeypatch):
+    from threading import BoundedSemaphore
+    monkeypatch.setattr(gobang_app, "STREAM_SLOTS", BoundedSemaphore(2))
+    black, white = new_players()
+    streams = [client.get(f"/api/stream?board_id={BOARD_ID}", buffered=False) for client in (black, white)]
+    assert [s.status_code for s in streams] == [200, 200]
+    assert next(streams[0].response).startswith(b"retry:")
+    # 名额用完后返回503，浏览器改用轮询，落子等请求不受影响
+    assert black.get(f"/api/stream?board_id={BOARD_ID}").status_code == 503
+    assert black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 7, "y": 7}).status_code == 200
+    # 连接关闭后归还名额
+    streams[0].close()
+    stream = white.get(f"/api/stream?board_id={BOARD_ID}", buffered=False)
+    assert stream.status_code == 200
+    for response in (stream, streams[1]):
+        response.close()
+    assert gobang_app.STREAM_SLOTS.acquire(blocking=False) and gobang_app.STREAM_SLOTS.acquire(blocking=False)
+
+
+def test_concurrent_moves_on_one_board_are_serialized():
+    from concurrent.futures import ThreadPoolExecutor
+
+    black, white = new_players()
+    cookie = black.get_cookie("session").value
+    clients = []
+    for _ in range(16):
+        client = gobang_app.app.test_client()
+        client.set_cookie("session", cookie)
+        clients.append(client)
+
+    # 16个黑棋请求同时落在不同位置，轮次检查在棋盘锁内，只能有一个成功
+    def move(i):
+        return clients[i].post(f"/api/move?board_id={BOARD_ID}", json={"x": i % 15, "y": i // 15}).status_code
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        codes = list(pool.map(move, range(16)))
+    assert codes.count(200) == 1
+    board = gobang_app.get_board(BOARD_ID)
+    assert len(board["moves"]) == 1
+    assert board["stones"] == 1
+    assert sum(cell != 0 for row in gobang_app.state_view(board)["board"] for cell in row) == 1
+
+
+def test_sqlite_store_shares_boards_between_workers(tmp_path, monkeypatch):
+    from common.state_store import SQLiteStore
+
+    # 两个SQLiteStore实例指向同一文件，模拟两个gunicorn worker
+    path = str(tmp_path / "gobang.sqlite3")
+    workers = [SQLiteStore(path), SQLiteStore(path)]
+    monkeypatch.setattr(gobang_app, "STORE", workers[0])
+    black, white = new_players()
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 7, "y": 7})
+
+    monkeypatch.setattr(gobang_app, "STORE", workers[1])
+    assert white.post(f"/api/move?board_id={BOARD_ID}", json={"x": 8, "y": 8}).status_code == 200
+    assert black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 8, "y": 8}).status_code == 400
+
+    monkeypatch.setattr(gobang_app, "STORE", workers[0])
+    data = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert data["game_progress"]["move_count"] == 2
+    assert data["board"][8][8] == -1
+    assert data["your_turn"] == 1
+
+
+def test_recreated_board_never_reuses_versions(tmp_path, monkeypatch):
+    from common.state_store import MemoryStore, SQLiteStore
+
+    path = str(tmp_path / "gobang.sqlite3")
+    workers = [SQLiteStore(path), SQLiteStore(path)]
+    monkeypatch.setattr(gobang_app, "STORE", workers[0])
+    black, white = new_players()
+    black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 7, "y": 7})
+    old = black.get(f"/api/gamestate?board_id={BOARD_ID}")
+    version = old.get_json()["metadata"]["state_version"]
+
+    # 另一个worker删除棋盘，本worker的gamestate缓存里还留着旧棋盘这个版本的内容
+    workers[1].delete(BOARD_ID)
+    response = black.get(f"/api/gamestate?board_id={BOARD_ID}&since_version={version}",
+                         headers={"If-None-Match": old.headers["ETag"]})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["metadata"]["state_version"] > version
+    assert data["game_progress"]["move_count"] == 0
+    assert response.headers["ETag"] != old.headers["ETag"]
+
+    store = MemoryStore()
+    store.get("A", lambda: {"version": store.initial_version()})["version"] = 5
+    store.delete("A")
+    assert store.get("A", lambda: {"version": store.initial_version()})["version"] == 6
+
+
+def test_journal_store_recovers_boards_after_restart(tmp_path, monkeypatch):
+    from common.state_store import JournalStore
+
+    def restart():
+        # 新建存储实例模拟服务器重启，小快照间隔以覆盖“快照+日志”两种恢复路径
+        store = JournalStore(str(tmp_path), gobang_app.replay_op, snapshot_every=4)
+        monkeypatch.setattr(gobang_app, "STORE", store)
+        return store
+
+    restart()
+    black, white = new_players()
+    for i in range(7):
+        player = black if i % 2 == 0 else white
+        player.post(f"/api/move?board_id={BOARD_ID}", json={"x": i, "y": i % 3})
+    black.post(f"/api/undo?board_id={BOARD_ID}")
+    expected = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+
+    store = restart()
+    assert BOARD_ID not in store  # 启动时不加载，首次访问时才重放
+    recovered = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert recovered == expected
+    assert len(gobang_app.get_board(BOARD_ID)["history"]) == 6
+
+    # 追加日志时进程被杀，只写了半条记录：恢复时丢弃这半条
+    with open(tmp_path / f"{BOARD_ID}.log", "ab") as f:
+        f.write(b"\x00\x00\x01\x00partial")
+    restart()
+    assert black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json() == expected
+    assert black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 14, "y": 14}).status_code == 200
+    restart()
+    data = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert data["game_progress"]["move_count"] == expected["game_progress"]["move_count"] + 1
+
+
+def test_bitboard_five_in_a_row():
+    size = 15
+
+    def mask(*points):
+        bits = bitboard.empty()
+        for x, y in points:
+            bitboard.place(bits, size, x, y, 1)
+        return bits[1]
+
+    assert bitboard.has_five(mask(*[(x, 3) for x in range(10, 15)]), size)
+    assert bitboard.has_five(mask(*[(0, y) for y in range(10, 15)]), size)
+    assert bitboard.has_five(mask(*[(i, i) for i in range(10, 15)]), size)
+    assert bitboard.has_five(mask(*[(4 - i, 10 + i) for i in range(5)]), size)
+    assert not bitboard.has_five(mask(*[(x, 3) for x in range(4)]), size)
+    # 行尾和下一行行首的棋子在位序上相邻，但不构成连子
+    assert not bitboard.has_five(mask((12, 3), (13, 3), (14, 3), (0, 4), (1, 4)), size)
+    assert not bitboard.has_five(mask((14, 0), (0, 2), (1, 3), (2, 4), (3, 5)), size)
+    assert not bitboard.has_five(mask((0, 0), (14, 2), (13, 3), (12, 4), (11, 5)), size)
+
+
+def test_full_board_is_a_draw():
+    black, white = new_players()
+    board = gobang_app.get_board(BOARD_ID)
+    # 每两列换一次颜色、每行错开两列的排布，任何方向都不会出现5连
+    cells = [(x, y) for y in range(15) for x in range(15)]
+    colors = {(x, y): 1 if (x + 2 * y) // 2 % 2 == 0 else -1 for x, y in cells}
+    for x, y in cells[:-1]:
+        bitboard.place(board["bits"], 15, x, y, colors[x, y])
+    board["stones"] = len(cells) - 1
+    assert not any(bitboard.has_five(board["bits"][color], 15) for color in bitboard.COLORS)
+    gobang_app.apply_move(board, 14, 14, colors[14, 14])
+    assert board["state"]["game_over"]
+    assert board["state"]["winner"] is None
+    assert gobang_app.state_view(board)["board"][14][14] == colors[14, 14]
+
+
+def test_ai_move_completes_five_and_blocks():
+    black, white = new_players()
+    for x in range(4):
+        black.post(f"/api/move?board_id={BOARD_ID}", json={"x": 3 + x, "y": 7})
+        if x < 3:
+            white.post(f"/api/move?board_id={BOARD_ID}", json={"x": 3 + x, "y": 0})
+    # 轮到白棋：黑棋已有活四，白棋只能挡一头
+    response = white.post(f"/api/ai_move?board_id={BOARD_ID}", json={"time_limit": 0.2})
+    assert response.status_code == 200
+    move = response.get_json()["ai_move"]
+    assert (move["x"], move["y"], move["color"]) in {(2, 7, -1), (7, 7, -1)}
+    # 轮到黑棋：电脑从另一头连成五子
+    data = black.post(f"/api/ai_move?board_id={BOARD_ID}", json={"time_limit": 0.2}).get_json()
+    assert data["winner"] == 1 and data["game_over"]
+    assert black.post(f"/api/ai_move?board_id={BOARD_ID}").status_code == 400
+    assert black.post(f"/api/ai_move?board_id={BOARD_ID}", json={"time_limit": "fast"}).status_code == 400
+
+
+def test_ai_move_only_plays_for_unheld_sides():
+    black, white = new_players()
+    spectator = gobang_app.app.test_client()
+    # 观战者没有选择颜色；轮到黑棋时白棋玩家也不能让电脑替黑棋落子
+    assert spectator.post(f"/api/ai_move?board_id={BOARD_ID}").status_code == 403
+    response = white.post(f"/api/ai_move?board_id={BOARD_ID}")
+    assert response.status_code == 403 and "其他玩家" in response.get_json()["error"]
+    assert gobang_app.get_board(BOARD_ID)["stones"] == 0
+
+    # 人机对战：只有黑棋玩家，白棋无人执，电脑可以替白棋落子
+    solo = gobang_app.app.test_client()
+    solo.post("/api/reset?board_id=Solo1234")
+    solo.post("/api/select_color?board_id=Solo1234", json={"color": 1})
+    assert solo.post("/api/move?board_id=Solo1234", json={"x": 7, "y": 7}).status_code == 200
+    response = solo.post("/api/ai_move?board_id=Solo1234", json={"time_limit": 0.2})
+    assert response.status_code == 200 and response.get_json()["ai_move"]["color"] == -1
+
+
+def test_batch_moves_apply_atomically(monkeypatch):
+    black, _ = new_players()
+    version = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["metadata"]["state_version"]
+    moves = [{"x": i, "y": 0, "color": 1 if i % 2 == 0 else -1} for i in range(6)]
+    # 没有回放令牌时只能用session中的颜色，不能替对方落子
+    response = black.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves})
+    assert response.status_code == 403 and response.get_json()["index"] == 1
+    monkeypatch.setattr(gobang_app, "REPLAY_TOKEN", "replay-secret")
+    response = black.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves},
+                          headers={"X-Replay-Token": "wrong"})
+    assert response.status_code == 403
+    replay = {"X-Replay-Token": "replay-secret"}
+    # 第4步落在已有棋子上：整批都不生效
+    bad = moves[:3] + [{"x": 0, "y": 0, "color": -1}]
+    response = black.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": bad}, headers=replay)
+    assert response.status_code == 400
+    assert response.get_json()["index"] == 3
+    data = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert data["metadata"]["state_version"] == version
+    assert data["game_progress"]["move_count"] == 0
+
+    response = black.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves}, headers=replay)
+    assert response.status_code == 200
+    state = response.get_json()
+    assert state["applied"] == 6
+    assert state["board"][0][5] == -1
+    data = black.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert data["metadata"]["state_version"] == version + 1
+    assert data["game_progress"]["move_count"] == 6
+
+    # 未指定color时使用session中的颜色（黑），而此时轮到黑棋
+    assert black.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": [{"x": 9, "y": 9}]}).status_code == 200
+    response = black.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": [{"x": 9, "y": 10}]})
+    assert response.status_code == 403 and response.get_json()["index"] == 0
+
+
+def test_memory_store_expires_only_due_boards_and_evicts_lru():
+    from common.state_store import MemoryStore
+
+    deleted = []
+    store = MemoryStore(max_boards=3, on_delete=deleted.append)
+    for i, board_id in enumerate(["A", "B", "C"]):
+        store.get(board_id, lambda i=i: {"last_active": 100 + i, "online": 0})
+    assert store.oldest_active() == 100
+
+    # A在期间被访问过：堆中的旧条目出堆时按新时间重新入堆，不会被删除
+    store.get("A")["last_active"] = 200
+    store.get("C")["online"] = 1
+    assert store.delete_expired(150) == ["B"]
+    assert "A" in store and "C" in store
+    assert deleted == ["B"]
+
+    # 达到上限时淘汰最久未访问的棋盘；C有人在线，过期检查时已推迟到下一周期，排在后面
+    store.get("D", lambda: {"last_active": 300, "online": 0})
+    store.get("E", lambda: {"last_active": 301, "online": 0})
+    assert len(store) == 3
+    assert deleted == ["B", "A"]
+    store.get("F", lambda: {"last_active": 302, "online": 0})
+    assert deleted == ["B", "A", "D"]
+
+
+def test_journal_store_spills_idle_boards_over_memory_budget(tmp_path, monkeypatch):
+    import time
+
+    from common.state_store import JournalStore
+
+    # 预算只够一个棋盘：每次写入后其余棋盘都被换出到磁盘
+    store = JournalStore(str(tmp_path), gobang_app.replay_op, snapshot_every=4, memory_budget=1, retention=3600)
+    monkeypatch.setattr(gobang_app, "STORE", store)
+    board_ids = [f"Spill{i:03d}" for i in range(5)]
+    players = {board_id: new_players(board_id) for board_id in board_ids}
+    for i in range(6):
+        for board_id, (black, white) in players.items():
+            player = black if i % 2 == 0 else white
+            assert player.post(f"/api/move?board_id={board_id}", json={"x": i, "y": 0}).status_code == 200
+            assert len(store) == 1
+    for board_id, (black, white) in players.items():
+        data = black.get(f"/api/gamestate?board_id={board_id}").get_json()
+        assert data["game_progress"]["move_count"] == 6
+        assert len(store) == 1
+    assert 0 < store.memory_used() < 10000
+
+    # 过期只换出，文件保留
+    last = board_ids[-1]
+    assert store.delete_expired(time.time() + 1) == [last]
+    assert len(store) == 0 and store.memory_used() == 0
+    assert (tmp_path / f"{last}.snapshot").exists()
+
+    # 重启后扫描目录登记磁盘上的棋盘，超过retention的删除文件
+    store = JournalStore(str(tmp_path), gobang_app.replay_op, retention=0)
+    time.sleep(0.01)
+    assert sorted(store.delete_expired(time.time())) == board_ids
+    assert not list(tmp_path.iterdir())
+
+
+async def asgi_request(asgi_app, method, path, body=b"", headers=(), disconnect=None, messages=None):
+    """直接调用asgi_app发送一个请求。disconnect为asyncio.Event时请求体之后等它被设置才告知客户端断开，
+    用于保持推送连接；收到的消息追加到messages"""
+    scope = {'type': 'http', 'method': method, 'path': path.split('?')[0], 'root_path': '',
+             'query_string': path.partition('?')[2].encode(),
+             'headers': list(headers) + [(b'content-length', str(len(body)).encode())],
+             'http_version': '1.1', 'scheme': 'http'}
+    messages = [] if messages is None else messages
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        if disconnect is not None:
+            await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    return messages
+
+
+def test_async_streams_do_not_hold_threads():
+    import asyncio
+    import json
+    from common.asgi import AsgiApp
+    asgi_app = AsgiApp(gobang_app.app, gobang_app.LONG_POLL, threads=2)
+    new_players()
+
+    def events(messages):
+        return b"".join(m.get("body", b"") for m in messages[1:]).decode().count("event: ")
+
+    async def main():
+        # 推送连接数多于线程数，空闲连接都停在事件循环里
+        disconnect = asyncio.Event()
+        streams = [[] for _ in range(6)]
+        tasks = [asyncio.ensure_future(asgi_request(asgi_app, "GET", f"/api/stream?board_id={BOARD_ID}",
+                                                    disconnect=disconnect, messages=m)) for m in streams]
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if all(events(m) == 1 for m in streams):
+                break
+        assert all(events(m) == 1 for m in streams)
+        assert gobang_app.LONG_POLL.waiting() == 6
+
+        messages = await asyncio.wait_for(asgi_request(
+            asgi_app, "POST", f"/api/select_color?board_id={BOARD_ID}", json.dumps({"color": 1}).encode(),
+            [(b"content-type", b"application/json")]), 5)
+        cookie = dict(messages[0]["headers"])[b"set-cookie"].split(b";")[0]
+        messages = await asyncio.wait_for(asgi_request(
+            asgi_app, "POST", f"/api/move?board_id={BOARD_ID}", json.dumps({"x": 7, "y": 7}).encode(),
+            [(b"content-type", b"application/json"), (b"cookie", cookie)]), 5)
+        assert messages[0]["status"] == 200
+        # 落子唤醒所有推送连接，各收到一条moves事件
+        for _ in range(100):
+            await asyncio.sleep(0.05)
+            if all(events(m) == 2 for m in streams):
+                break
+        assert all(b"event: moves" in m[-1]["body"] for m in streams)
+
+        disconnect.set()
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        assert gobang_app.LONG_POLL.waiting() == 0
+
+    asyncio.run(main())
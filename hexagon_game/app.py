@@ -1,21 +1,45 @@
 # app.py
 
 import os
+import sys
 import copy
+import hmac
 import string
 import random
 import time
+from collections import deque
+from functools import lru_cache
+from types import MappingProxyType
 from flask import Flask, render_template, jsonify, request, session
-from threading import Lock, Thread
+
+# 将项目根目录加入模块搜索路径，以便引用公共模块common
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from common.asgi import AsgiApp, LongPoll
+from common.expiry import start_expiry_thread
+from common.response_cache import ResponseCache, conditional_response
+from common.state_store import create_store, secret_key
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+app.secret_key = secret_key()  # 多个worker需共享同一密钥，见PLAYGROUND_SECRET_KEY
+RESPONSE_CACHE = ResponseCache(app.json.dumps)
 
-# 多棋盘全局变量
-BOARDS = {}
-BOARDS_LOCK = Lock()
-CLEANUP_INTERVAL = 60  # 秒
+# 多棋盘存储：默认进程内存储，设置PLAYGROUND_STATE_STORE=sqlite后可多worker共享，
+# 设置为journal时落盘，重启后按需重放（replay_op定义在后面）
+STORE = create_store('hexagon_game', replay=lambda board, op: replay_op(board, op), on_delete=RESPONSE_CACHE.invalidate)
+# 异步模式下的长轮询：/api/gamestate?since_version=V&wait=秒 在棋盘变化前不占线程（见common/asgi.py）
+LONG_POLL = LongPoll(STORE)
 BOARD_EXPIRE = 120     # 超过2分钟无人访问自动销毁
+MIN_RADIUS = 3         # 可选棋盘半径范围
+MAX_RADIUS = 10
+DEFAULT_RADIUS = 3
+UNDO_LIMIT = 20        # 最多可连续悔棋的步数
+WELCOME_MESSAGE = "欢迎来到共享棋盘！请选择一个颜色开始游戏。"
+BATCH_MAX_MOVES = 1000 # /api/moves/batch单次最多画的线数
+# 回放对局时批量请求需要替各方画线：请求头X-Replay-Token与此相同时，每条线可用color指定颜色；
+# 未设置时批量画线和/api/move一样只能使用session中的颜色
+REPLAY_TOKEN = os.environ.get('PLAYGROUND_REPLAY_TOKEN')
 
 # 棋盘id格式
 def gen_board_id():
@@ -28,24 +52,29 @@ def _get_serializable_state(state):
     state_copy = state.copy()
     state_copy.pop('segments', None)
     state_copy.pop('drawn_lines', None)
+    state_copy.pop('captured', None)
     return state_copy
 
-def _convert_to_standard_gamestate(state, board_id, my_color=None):
-    """将内部状态转换为标准的gamestate格式"""
-    if not state:
-        return {}
-    
+def _viewer_fields(board, my_color):
+    """与观看者相关的字段，在共享的序列化结果之后单独拼接"""
     # 计算当前轮到谁
     your_turn = 0
-    if my_color and state.get('last_move_color') != my_color:
+    if my_color and board['state'].get('last_move_color') != my_color:
         your_turn = 1
+    return {"your_turn": your_turn, "my_color": my_color}
+
+def _convert_to_standard_gamestate(board, board_id, include_legal_lines=False):
+    """将内部状态转换为标准的gamestate格式（不含your_turn、my_color），
+    include_legal_lines为True时附带剩余合法线条列表"""
+    state = board['state']
+    if not state:
+        return {}
     
-    # 构建棋盘矩阵（简化版本，实际游戏中需要更复杂的转换）
-    board_size = 7  # 六边形棋盘的大小
-    board = [[0 for _ in range(board_size)] for _ in range(board_size)]
-    
-    # 将线条和三角形信息映射到棋盘矩阵
-    # 这里简化处理，实际需要根据六边形坐标系统进行转换
+    geometry = get_geometry(state['radius'])
+    remaining_line_count = len(geometry['lines']) - len(state['drawn_lines'])
+
+    # 棋盘矩阵由落子时增量维护，投影方式见project_to_matrix
+    board_size = geometry['matrix_size']
     
     # 构建移动历史
     move_history = []
@@ -79,7 +108,6 @@ def _convert_to_standard_gamestate(state, board_id, my_color=None):
     
     # 构建标准格式的gamestate，同时保留原有的六边形游戏特定数据
     standard_state = {
-        "your_turn": your_turn,
         "game_info": {
             "game_type": "六边形连线游戏",
             "board_size": board_size,
@@ -88,8 +116,9 @@ def _convert_to_standard_gamestate(state, board_id, my_color=None):
             "game_status": "active" if not state.get('game_over', False) else "inactive",
             "current_turn": 1 if not state.get('last_move_color') else -1
         },
-        "board": board,
+        "board": board['matrix'],
         "board_legend": {
+            "-1": "棋盘外",
             "0": "空位",
             "1": "已连线",
             "2": "红色三角形",
@@ -102,15 +131,17 @@ def _convert_to_standard_gamestate(state, board_id, my_color=None):
             "current_turn": 1 if not state.get('last_move_color') else -1,
             "move_count": move_count,
             "last_move": last_move,
-            "move_history": move_history
+            "move_history": move_history,
+            "remaining_line_count": remaining_line_count
         },
         "metadata": {
             "board_id": board_id,
-            "created_at": "2024-06-01T12:00:00Z",  # 实际应该从board创建时间获取
-            "last_updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-            "version": "1.0"
+            "created_at": board['created_at'],
+            "last_updated": board['updated_at'],
+            "version": "1.0",
+            "state_version": board['version']
         },
-        "my_color": my_color,
+        "radius": state['radius'],
         "players": state.get('players', []),
         "scores": state.get('scores', {}),
         "line_counts": state.get('line_counts', {}),
@@ -118,79 +149,194 @@ def _convert_to_standard_gamestate(state, board_id, my_color=None):
         "game_over": state.get('game_over', False),
         "message": state.get('message', ''),
         # 保留六边形游戏特定的数据结构以保持兼容性
-        "points": state.get('points', []),
+        "points": list(geometry['points']),
         "lines": state.get('lines', []),
         "captured_triangles": state.get('captured_triangles', [])
     }
+    if include_legal_lines:
+        # 剩余可下的线条（以两个端点表示），供客户端和机器人使用
+        standard_state["legal_lines"] = [list(key) for key in geometry['lines'] if key not in state['drawn_lines']]
     
     return standard_state
 
+def get_gamestate_blob(board, board_id, my_color=None, include_legal_lines=False):
+    """序列化后的标准gamestate（JSON字节串）。
+    同一版本下所有观看者共享一次序列化，只拼接各自的your_turn和my_color。
+    """
+    return RESPONSE_CACHE.get(
+        board_id, board['version'],
+        lambda: _convert_to_standard_gamestate(board, board_id, include_legal_lines),
+        variant=include_legal_lines, viewer=_viewer_fields(board, my_color))
+
+def gamestate_response(board, board_id, my_color=None):
+    return app.response_class(get_gamestate_blob(board, board_id, my_color), mimetype='application/json')
+
+def project_to_matrix(state):
+    """将点、线条和三角形归属投影到矩阵（按三倍坐标展开）：
+    - 点(q, r)位于第3*(r+R)行、第3*(q+R)列
+    - 相邻两点之间的两个格子表示这条边
+    - 三角形三个顶点的重心格子表示这个三角形
+    - 其余格子为棋盘外(-1)
+    用于撤销、重置后整体重建，落子时由make_move增量更新。
+    """
+    geometry = get_geometry(state['radius'])
+    matrix = [list(row) for row in geometry['empty_matrix']]
+    for line in state['lines']:
+        mark_line_in_matrix(matrix, geometry, line['points'])
+    owner_codes = {color: 2 + idx for idx, color in enumerate(state['players'])}
+    for tri in state['captured_triangles']:
+        row, col = geometry['triangle_cells'][geometry['triangle_index'][tuple(sorted(map(tuple, tri['points'])))]]
+        matrix[row][col] = owner_codes[tri['color']]
+    return matrix
+
+def mark_line_in_matrix(matrix, geometry, line_points):
+    """在矩阵中标记一条线经过的点和边"""
+    for point in line_points:
+        row, col = geometry['point_cells'][tuple(point)]
+        matrix[row][col] = 1
+    for i in range(len(line_points) - 1):
+        for row, col in geometry['segment_cells'][frozenset([tuple(line_points[i]), tuple(line_points[i+1])])]:
+            matrix[row][col] = 1
+
 AXIAL_DIRECTIONS = [(1, 0), (0, 1), (-1, 1), (-1, 0), (0, -1), (1, -1)]
 def axial_add(p1, p2): return (p1[0] + p2[0], p1[1] + p2[1])
 
-def get_line_points(p1, p2):
-    distance = (abs(p1[0] - p2[0]) + abs(p1[1] - p2[1]) + abs(p1[0] + p1[1] - p2[0] - p2[1])) / 2
-    if distance != 3: return None
-    direction_q, direction_r = (p2[0] - p1[0]) / 3, (p2[1] - p1[1]) / 3
-    is_straight_line = any(abs(d[0] - direction_q) < 1e-9 and abs(d[1] - direction_r) < 1e-9 for d in AXIAL_DIRECTIONS)
-    if not is_straight_line: return None
-    p_mid1, p_mid2 = (p1[0] + direction_q, p1[1] + direction_r), (p1[0] + 2 * direction_q, p1[1] + 2 * direction_r)
-    if not (p_mid1[0].is_integer() and p_mid1[1].is_integer()): return None
-    return [p1, (int(p_mid1[0]), int(p_mid1[1])), (int(p_mid2[0]), int(p_mid2[1])), p2]
-
-def create_new_board():
-    points, all_triangles = set(), []
-    radius = 3
+def get_line_points(p1, p2, radius=DEFAULT_RADIUS):
+    """查表判断p1-p2是否为棋盘上长度为4的直线，合法时返回从p1到p2的4个点，否则返回None"""
+    try:
+        line = get_geometry(radius)['lines'].get(canonical_line(p1, p2))
+    except TypeError:
+        return None
+    if line is None: return None
+    return list(line) if line[0] == p1 else list(reversed(line))
+
+def canonical_line(p1, p2):
+    """线条的规范键：两个端点排序后的元组"""
+    return tuple(sorted([p1, p2]))
+
+def parse_radius(value):
+    """解析棋盘半径参数，缺省时为DEFAULT_RADIUS，非法时返回None"""
+    if value is None:
+        return DEFAULT_RADIUS
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if MIN_RADIUS <= value <= MAX_RADIUS else None
+
+@lru_cache(maxsize=None)
+def get_geometry(radius):
+    """按半径计算棋盘几何，进程内只计算一次，所有棋盘只读共享（棋盘状态中只保存radius）：
+    - points: 所有点
+    - triangles: 所有小三角形（每个为排序后的3个点）
+    - triangle_segments: 每个三角形的3条边
+    - segment_triangles: 线段 -> 以该线段为边的三角形下标（最多2个）
+    - lines: 规范端点对 -> 长度为4的合法直线上的4个点，落子校验只需一次查表
+    - matrix_size / empty_matrix / point_cells / segment_cells / triangle_cells / triangle_index:
+      标准gamestate中棋盘矩阵的投影坐标，见project_to_matrix
+    """
+    points = set()
     for q in range(-radius, radius + 1):
         for r in range(-radius, radius + 1):
             if abs(q + r) <= radius: points.add((q, r))
+    triangles = set()
     for point in points:
         for d1, d2 in [(AXIAL_DIRECTIONS[0], AXIAL_DIRECTIONS[1]), (AXIAL_DIRECTIONS[0], AXIAL_DIRECTIONS[5])]:
             p1, p2, p3 = point, axial_add(point, d1), axial_add(point, d2)
-            if p2 in points and p3 in points: all_triangles.append(frozenset([p1, p2, p3]))
+            if p2 in points and p3 in points: triangles.add(tuple(sorted((p1, p2, p3))))
+    triangles = tuple(sorted(triangles))
+    triangle_segments = tuple(
+        (frozenset((a, b)), frozenset((b, c)), frozenset((c, a))) for a, b, c in triangles
+    )
+    segment_triangles = {}
+    for idx, segments in enumerate(triangle_segments):
+        for segment in segments:
+            segment_triangles.setdefault(segment, []).append(idx)
+    lines = {}
+    for point in points:
+        # 只取3个方向，另外3个方向是同一条线的反向
+        for d in AXIAL_DIRECTIONS[:3]:
+            line = tuple((point[0] + d[0] * i, point[1] + d[1] * i) for i in range(4))
+            if line[-1] in points:
+                key = canonical_line(line[0], line[-1])
+                lines[key] = line if line[0] == key[0] else line[::-1]
+    # 矩阵投影：三倍坐标下，点、边（两格）和三角形重心都落在整数格上
+    matrix_size = 6 * radius + 1
+    point_cells = {(q, r): (3 * (r + radius), 3 * (q + radius)) for q, r in points}
+    segment_cells = {}
+    for segment in segment_triangles:
+        (r0, c0), (r1, c1) = (point_cells[p] for p in segment)
+        segment_cells[segment] = tuple((r0 + (r1 - r0) * k // 3, c0 + (c1 - c0) * k // 3) for k in (1, 2))
+    triangle_cells = tuple(
+        (sum(point_cells[p][0] for p in tri) // 3, sum(point_cells[p][1] for p in tri) // 3) for tri in triangles
+    )
+    empty_matrix = [[-1] * matrix_size for _ in range(matrix_size)]
+    for cells in [point_cells.values(), triangle_cells] + list(segment_cells.values()):
+        for row, col in cells:
+            empty_matrix[row][col] = 0
+    return MappingProxyType({
+        'radius': radius,
+        'points': tuple(sorted(points)),
+        'triangles': triangles,
+        'triangle_segments': triangle_segments,
+        'segment_triangles': MappingProxyType({segment: tuple(ids) for segment, ids in segment_triangles.items()}),
+        'lines': MappingProxyType(lines),
+        'matrix_size': matrix_size,
+        'empty_matrix': tuple(tuple(row) for row in empty_matrix),
+        'point_cells': MappingProxyType(point_cells),
+        'segment_cells': MappingProxyType(segment_cells),
+        'triangle_cells': triangle_cells,
+        'triangle_index': MappingProxyType({tri: idx for idx, tri in enumerate(triangles)})
+    })
+
+def create_new_board(radius=DEFAULT_RADIUS):
     colors = ['#d9534f', '#428bca', '#5cb85c', '#f0ad4e', '#6e409e']
     state = {
         'players': colors,
-        'points': list(points),
+        'radius': radius,  # 棋盘几何通过get_geometry(radius)引用，不随棋盘和历史复制
         'lines': [],
         'drawn_lines': set(),
         'segments': set(),
-        'all_possible_triangles': [list(t) for t in set(all_triangles)],
         'captured_triangles': [],
+        'captured': set(),  # 已被占领的三角形下标
         'scores': {color: 0 for color in colors},
         'line_counts': {color: 0 for color in colors},
         'last_move_color': None,
         'game_over': False,
-        'message': "欢迎来到共享棋盘！请选择一个颜色开始游戏。"
+        'message': WELCOME_MESSAGE
     }
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     return {
         'state': state,
-        'history': [],
+        # 可悔棋的最近几条线，每条只记撤销所需的差异（见apply_line），超出上限自动丢弃最早的
+        'history': deque(maxlen=UNDO_LIMIT),
+        'matrix': project_to_matrix(state),        # 标准gamestate中的棋盘矩阵，随落子增量更新
         'online': 0,
-        'last_active': time.time()
+        'last_active': time.time(),
+        'created_at': now,
+        'updated_at': now,
+        'version': STORE.initial_version()  # 棋盘每次变化自增，用于条件GET；删除后新建不会重复旧棋盘的版本号
     }
 
-def get_board(board_id, create_if_missing=True):
-    with BOARDS_LOCK:
-        if board_id not in BOARDS:
-            if not create_if_missing:
-                return None
-            BOARDS[board_id] = create_new_board()
-        board = BOARDS[board_id]
-        board['last_active'] = time.time()
-        return board
+def get_board(board_id, create_if_missing=True, radius=DEFAULT_RADIUS):
+    """取棋盘并刷新活跃时间。使用共享存储时返回的是副本，修改需经notify_board_changed写回"""
+    board = STORE.get(board_id, (lambda: create_new_board(radius)) if create_if_missing else None)
+    if board is not None:
+        STORE.touch(board_id, board)
+    return board
 
-def cleanup_boards():
-    while True:
-        time.sleep(CLEANUP_INTERVAL)
-        now = time.time()
-        with BOARDS_LOCK:
-            expired = [bid for bid, b in BOARDS.items() if b['online'] <= 0 and now - b['last_active'] > BOARD_EXPIRE]
-            for bid in expired:
-                del BOARDS[bid]
+def notify_board_changed(board_id, board, op=None):
+    """棋盘状态发生变化：版本号自增并写回存储，作废已缓存的序列化gamestate，唤醒等待它的长轮询。
+    op为本次修改的操作记录，供操作日志重放（见replay_op）；整盘替换时为None。调用方需持有该棋盘的锁
+    """
+    board['version'] += 1
+    board['updated_at'] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    STORE.put(board_id, board, op)
+    RESPONSE_CACHE.invalidate(board_id)
+    LONG_POLL.notify(board_id)
 
-# 启动后台清理线程
-Thread(target=cleanup_boards, daemon=True).start()
+# 后台清理无人访问的棋盘，被删除的棋盘经on_delete作废已缓存的gamestate
+start_expiry_thread(STORE, BOARD_EXPIRE)
 
 @app.route('/')
 def index():
@@ -205,12 +351,22 @@ def get_gamestate():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id, create_if_missing=True)
+    radius = parse_radius(request.args.get('radius'))
+    if radius is None:
+        return jsonify({'error': f'棋盘半径需为{MIN_RADIUS}~{MAX_RADIUS}'}), 400
     my_color = session.get(f'player_color_{board_id}', None)
+    include_legal_lines = request.args.get('legal_lines') == '1'
+    # 附带合法线条的视图单独计版本：ETag和since_version都加后缀-L，不会与普通gamestate混淆
+    variant = '-L' if include_legal_lines else ''
     
-    # 返回标准格式的gamestate
-    standard_gamestate = _convert_to_standard_gamestate(board['state'], board_id, my_color)
-    return jsonify(standard_gamestate)
+    # 返回标准格式的gamestate，未变化时走条件GET；保证版本号与内容一致
+    with STORE.reading(board_id):
+        # radius仅在首次创建棋盘时生效
+        board = get_board(board_id, create_if_missing=True, radius=radius)
+        version = board['version']
+        return conditional_response(
+            f'{board_id}-{version}-{my_color}{variant}', version,
+            lambda: get_gamestate_blob(board, board_id, my_color, include_legal_lines), variant)
 
 @app.route('/api/select_color', methods=['POST'])
 def select_color():
@@ -230,73 +386,197 @@ def handle_reset():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    with BOARDS_LOCK:
-        BOARDS[board_id] = create_new_board()
-    my_color = session.get(f'player_color_{board_id}', None)
-    return jsonify(_convert_to_standard_gamestate(BOARDS[board_id]['state'], board_id, my_color))
+    radius = request.args.get('radius')
+    # 等待该棋盘上进行中的落子完成后再替换
+    with STORE.lock(board_id):
+        old_board = STORE.get(board_id)
+        # 未指定半径时沿用原棋盘的半径
+        if radius is None and old_board:
+            radius = old_board['state']['radius']
+        radius = parse_radius(radius)
+        if radius is None:
+            return jsonify({'error': f'棋盘半径需为{MIN_RADIUS}~{MAX_RADIUS}'}), 400
+        board = create_new_board(radius)
+        # 版本号跨重置保持单调递增，避免客户端误判为未变化
+        if old_board:
+            board['version'] = old_board['version']
+        notify_board_changed(board_id, board)
+        my_color = session.get(f'player_color_{board_id}', None)
+        return gamestate_response(board, board_id, my_color)
 
 @app.route('/api/undo', methods=['POST'])
 def handle_undo():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id)
     if f'player_color_{board_id}' not in session:
         return jsonify({'error': '请先选择你的颜色'}), 403
-    if not board['history']:
-        return jsonify({'error': '没有可悔棋的步骤'}), 400
-    if board['state'].get('last_move_color') != session.get(f'player_color_{board_id}'):
-        return jsonify({'error': '只能撤销自己下的最后一步棋'}), 403
-    board['state'] = board['history'].pop()
-    my_color = session.get(f'player_color_{board_id}', None)
-    return jsonify(_convert_to_standard_gamestate(board['state'], board_id, my_color))
+    with STORE.lock(board_id):
+        # 持锁后再取棋盘，拿到的总是最近一次重置后的棋盘对象
+        board = get_board(board_id)
+        if not board['history']:
+            return jsonify({'error': '没有可悔棋的步骤'}), 400
+        if board['state'].get('last_move_color') != session.get(f'player_color_{board_id}'):
+            return jsonify({'error': '只能撤销自己下的最后一步棋'}), 403
+        undo_line(board)
+        notify_board_changed(board_id, board, ('undo',))
+        my_color = session.get(f'player_color_{board_id}', None)
+        return gamestate_response(board, board_id, my_color)
 
 @app.route('/api/move', methods=['POST'])
 def make_move():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id)
     if f'player_color_{board_id}' not in session:
         return jsonify({'error': '在放置线条前，请先选择一个颜色。'}), 403
-    if board['state'].get('game_over', True):
-        return jsonify({'error': '游戏已经结束！'}), 400
-    board['history'].append(copy.deepcopy(board['state']))
-    if len(board['history']) > 20:
-        board['history'].pop(0)
-    data = request.get_json()
-    p1 = tuple(data['p1'])
-    p2 = tuple(data['p2'])
-    line_points = get_line_points(p1, p2)
+    # 校验和落子在同一把棋盘锁内完成，避免并发请求同时通过检查
+    with STORE.lock(board_id):
+        board = get_board(board_id)
+        if board['state'].get('game_over', True):
+            return jsonify({'error': '游戏已经结束！'}), 400
+        data = request.get_json()
+        p1 = tuple(data['p1'])
+        p2 = tuple(data['p2'])
+        line_points, error = check_line(board, p1, p2)
+        if error:
+            return jsonify({'error': error}), 400
+        current_player_color = session[f'player_color_{board_id}']
+        apply_line(board, p1, p2, line_points, current_player_color)
+        notify_board_changed(board_id, board, ('move', p1, p2, current_player_color))
+        my_color = session.get(f'player_color_{board_id}', None)
+        return gamestate_response(board, board_id, my_color)
+
+@app.route('/api/moves/batch', methods=['POST'])
+def make_moves_batch():
+    """按顺序画一组线（机器人、导入对局），请求体 {"moves": [{"p1", "p2", "color"?}, ...]}。
+    在一把棋盘锁内逐条按/api/move的规则校验，任一条不合法则整批不生效；
+    颜色只能是session中的颜色；带正确X-Replay-Token的回放请求可按每条线的color替各方画线。只返回最终的gamestate
+    """
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的棋盘id'}), 400
+    data = request.get_json(silent=True) or {}
+    moves = data.get('moves')
+    if not isinstance(moves, list) or not moves or len(moves) > BATCH_MAX_MOVES:
+        return jsonify({'error': f'moves需为1~{BATCH_MAX_MOVES}条线的列表'}), 400
+    session_color = session.get(f'player_color_{board_id}')
+    replay = is_replay_request()
+    with STORE.lock(board_id):
+        # 在副本上逐条画线，全部合法后才替换原棋盘
+        board = copy.deepcopy(get_board(board_id))
+        ops = []
+        for index, move in enumerate(moves):
+            if not isinstance(move, dict) or not isinstance(move.get('p1'), list) or not isinstance(move.get('p2'), list):
+                return jsonify({'error': '无效的移动。请选择形成长度为4的直线的两点。', 'index': index}), 400
+            color = move.get('color', session_color) if replay else session_color
+            if color is None:
+                return jsonify({'error': '在放置线条前，请先选择一个颜色。', 'index': index}), 403
+            if not replay and move.get('color', color) != color:
+                return jsonify({'error': '只能使用自己选择的颜色画线', 'index': index}), 403
+            if color not in board['state']['players']:
+                return jsonify({'error': '无效的颜色', 'index': index}), 400
+            if board['state'].get('game_over', True):
+                return jsonify({'error': '游戏已经结束！', 'index': index}), 400
+            p1, p2 = tuple(move['p1']), tuple(move['p2'])
+            line_points, error = check_line(board, p1, p2)
+            if error:
+                return jsonify({'error': error, 'index': index}), 400
+            apply_line(board, p1, p2, line_points, color)
+            ops.append(('move', p1, p2, color))
+        notify_board_changed(board_id, board, ('batch', ops))
+        return gamestate_response(board, board_id, session_color)
+
+def is_replay_request():
+    """请求是否带有正确的回放令牌（见REPLAY_TOKEN）"""
+    token = request.headers.get('X-Replay-Token')
+    return bool(REPLAY_TOKEN) and token is not None and hmac.compare_digest(token.encode(), REPLAY_TOKEN.encode())
+
+def check_line(board, p1, p2):
+    """按画线规则校验，返回(线上的4个点, None)或(None, 错误信息)"""
+    line_points = get_line_points(p1, p2, board['state']['radius'])
     if not line_points:
-        board['history'].pop()
-        return jsonify({'error': '无效的移动。请选择形成长度为4的直线的两点。'}), 400
-    canonical_line = tuple(sorted([p1, p2]))
-    if canonical_line in board['state']['drawn_lines']:
-        board['history'].pop()
-        return jsonify({'error': '无效的移动。这条线已经存在。'}), 400
-    current_player_color = session[f'player_color_{board_id}']
-    board['state']['drawn_lines'].add(canonical_line)
-    board['state']['lines'].append({'points': line_points, 'color': current_player_color})
-    board['state']['line_counts'][current_player_color] += 1
-    board['state']['last_move_color'] = current_player_color
+        return None, '无效的移动。请选择形成长度为4的直线的两点。'
+    if canonical_line(p1, p2) in board['state']['drawn_lines']:
+        return None, '无效的移动。这条线已经存在。'
+    return line_points, None
+
+def apply_line(board, p1, p2, line_points, color):
+    """画线并结算被围成的三角形，调用前已校验过合法性。
+    悔棋记录只保存这一步的差异：(线条键, 颜色, 新增线段的位掩码, 占领的三角形下标, 上一步的颜色)
+    """
+    state = board['state']
+    key = canonical_line(p1, p2)
+    state['drawn_lines'].add(key)
+    state['lines'].append({'points': line_points, 'color': color})
+    state['line_counts'][color] += 1
+    previous_color = state['last_move_color']
+    state['last_move_color'] = color
+    # 只检查与新线段相邻的三角形（每条线段最多2个）
+    geometry = get_geometry(state['radius'])
+    new_segments = [frozenset([line_points[i], line_points[i+1]]) for i in range(len(line_points) - 1)]
+    # 与已有的线重叠的线段不是这一步新增的，悔棋时不能去掉
+    added = 0
+    for i, segment in enumerate(new_segments):
+        if segment not in state['segments']:
+            added |= 1 << i
+    state['segments'].update(new_segments)
+    mark_line_in_matrix(board['matrix'], geometry, line_points)
+    owner_code = 2 + state['players'].index(color)
+    captured = []
+    for segment in new_segments:
+        for idx in geometry['segment_triangles'].get(segment, ()):
+            if idx in state['captured']:
+                continue
+            if all(s in state['segments'] for s in geometry['triangle_segments'][idx]):
+                state['captured_triangles'].append({'points': list(geometry['triangles'][idx]), 'color': color})
+                state['scores'][color] += 1
+                state['captured'].add(idx)
+                captured.append(idx)
+                row, col = geometry['triangle_cells'][idx]
+                board['matrix'][row][col] = owner_code
+    if len(state['captured']) == len(geometry['triangles']):
+        state['game_over'] = True
+        state['message'] = "游戏结束！所有三角形已被填充。"
+    board['history'].append((key, color, added, tuple(captured), previous_color))
+
+def undo_line(board):
+    """撤销最后一条线：按悔棋记录逆向恢复，再由状态重建棋盘矩阵（线条交叉处的点和边不能直接清除）。
+    已结束的棋局不会再有新的线，所以撤销后棋局一定未结束，提示语也只会是欢迎语。
+    """
+    state = board['state']
+    key, color, added, captured, previous_color = board['history'].pop()
+    state['drawn_lines'].discard(key)
+    line_points = state['lines'].pop()['points']
+    state['line_counts'][color] -= 1
+    state['last_move_color'] = previous_color
     for i in range(len(line_points) - 1):
-        board['state']['segments'].add(frozenset([line_points[i], line_points[i+1]]))
-    captured_points_sets = {frozenset(t['points']) for t in board['state']['captured_triangles']}
-    for tri_points in board['state']['all_possible_triangles']:
-        tri_set = frozenset(tri_points)
-        if tri_set not in captured_points_sets:
-            p1_tri, p2_tri, p3_tri = tri_points[0], tri_points[1], tri_points[2]
-            s1, s2, s3 = frozenset([p1_tri, p2_tri]), frozenset([p2_tri, p3_tri]), frozenset([p3_tri, p1_tri])
-            if s1 in board['state']['segments'] and s2 in board['state']['segments'] and s3 in board['state']['segments']:
-                board['state']['captured_triangles'].append({'points': tri_points, 'color': current_player_color})
-                board['state']['scores'][current_player_color] += 1
-                captured_points_sets.add(tri_set)
-    if len(board['state']['captured_triangles']) == len(board['state']['all_possible_triangles']):
-        board['state']['game_over'] = True
-        board['state']['message'] = "游戏结束！所有三角形已被填充。"
-    my_color = session.get(f'player_color_{board_id}', None)
-    return jsonify(_convert_to_standard_gamestate(board['state'], board_id, my_color))
+        if added >> i & 1:
+            state['segments'].discard(frozenset([line_points[i], line_points[i+1]]))
+    # 这一步占领的三角形都追加在末尾
+    if captured:
+        del state['captured_triangles'][-len(captured):]
+        state['captured'].difference_update(captured)
+        state['scores'][color] -= len(captured)
+    state['game_over'] = False
+    state['message'] = WELCOME_MESSAGE
+    board['matrix'] = project_to_matrix(state)
+
+def replay_op(board, op):
+    """重放操作日志中的一条记录，修改与对应接口完全一致"""
+    kind = op[0]
+    if kind == 'move':
+        _, p1, p2, color = op
+        apply_line(board, p1, p2, get_line_points(p1, p2, board['state']['radius']), color)
+    elif kind == 'undo':
+        undo_line(board)
+    elif kind == 'online':
+        board['online'] = op[1]
+    elif kind == 'batch':
+        for move in op[1]:
+            replay_op(board, move)
+    else:
+        raise ValueError(f'未知的操作记录: {op!r}')
 
 @app.route('/api/heartbeat', methods=['POST'])
 def heartbeat():
@@ -304,14 +584,19 @@ def heartbeat():
     action = request.args.get('action', 'inc')  # inc: 页面激活/打开，dec: 页面关闭
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的棋盘id'}), 400
-    board = get_board(board_id)
-    with BOARDS_LOCK:
+    with STORE.lock(board_id):
+        board = get_board(board_id)
         if action == 'inc':
             board['online'] += 1
         elif action == 'dec':
             board['online'] = max(0, board['online'] - 1)
         board['last_active'] = time.time()
-    return jsonify({'online': board['online']})
+        # 在线人数不影响gamestate，只写回存储，不改变版本号
+        STORE.put(board_id, board, ('online', board['online']))
+        return jsonify({'online': board['online']})
+
+# 异步服务模式的入口：gunicorn -k asgi app:asgi_app（见main.py的PLAYGROUND_SERVER_MODE）
+asgi_app = AsgiApp(app, LONG_POLL)
 
 if __name__ == '__main__':
     app.run(debug=True, host='::', port=35101)
\ No newline at end of file
@@ -8,7 +8,9 @@ const followColorSelector = document.getElementById('follow-color-selector');
 const resetButton = document.getElementById('reset-button');
 // 【新功能】 获取悔棋按钮的引用
 const undoButton = document.getElementById('undo-button');
+const radiusSelect = document.getElementById('radius-select');
 
+const MIN_RADIUS = 3, MAX_RADIUS = 10;
 const POINT_RADIUS_RATIO = 0.2;
 const TOUCH_RADIUS_RATIO = 0.6;
 
@@ -16,6 +18,7 @@ let gameState = {};
 let myColor = null;
 let followColor = null;
 let selectedPoints = [], isFetching = false;
+let stateVersion = null;
 
 let turnTimerInterval = null;
 let turnStartTime = null;
@@ -33,6 +36,8 @@ function getBoardId() {
     }
     return boardId;
 }
+// 挂在路径前缀下运行时（见game_host.py）由页面给出前缀，接口地址都以它开头
+const API_ROOT = window.API_ROOT || '';
 const BOARD_ID = getBoardId();
 if (!BOARD_ID) throw new Error('board_id未初始化');
 
@@ -42,7 +47,7 @@ function boardLocalKey(key) {
 
 async function apiFetch(url, options={}) {
     // 自动拼接board_id
-    const u = new URL(url, window.location.origin);
+    const u = new URL(API_ROOT + url, window.location.origin);
     u.searchParams.set('board_id', BOARD_ID);
     return fetch(u.toString(), options);
 }
@@ -137,6 +142,8 @@ function updateUI() {
         }
     }
     
+    if (gameState.radius && document.activeElement !== radiusSelect) radiusSelect.value = gameState.radius;
+
     // 【新功能】 控制悔棋按钮的可用状态
     const canUndo = myColor && gameState.last_move_color === myColor;
     undoButton.disabled = !canUndo;
@@ -201,6 +208,7 @@ async function selectMyColor(color) {
     sessionStorage.setItem(boardLocalKey('myColor'), color);
     await apiFetch('/api/select_color', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ color }) });
     myColor = color;
+    stateVersion = null;
     await fetchGameState();
 }
 async function selectFollowColor(color) {
@@ -226,8 +234,12 @@ async function handleUndo() {
 async function fetchGameState() { 
     if (isFetching) return; isFetching = true; 
     try { 
-        const response = await apiFetch('/api/gamestate'); 
+        // 带上已知版本号，棋盘未变化时服务器只返回简短的unchanged响应
+        const url = stateVersion === null ? '/api/gamestate' : `/api/gamestate?since_version=${stateVersion}`;
+        const response = await apiFetch(url); 
         const data = await response.json();
+        if (data.unchanged) { updateUI(); return; }
+        stateVersion = data.metadata ? data.metadata.state_version : null;
         
         // 直接使用标准格式，同时保持向后兼容
         const boardChanged = JSON.stringify(gameState) !== JSON.stringify(data);
@@ -277,7 +289,13 @@ async function init() {
         myColor = null;
         followColor = null;
     }
-    resetButton.addEventListener('click', async () => { if(confirm("确定要重置整个棋盘吗？所有人的进度都将丢失！")) { await apiFetch('/api/reset', { method: 'POST' }); await fetchGameState(); } });
+    for (let r = MIN_RADIUS; r <= MAX_RADIUS; r++) {
+        const option = document.createElement('option');
+        option.value = r;
+        option.textContent = r;
+        radiusSelect.appendChild(option);
+    }
+    resetButton.addEventListener('click', async () => { if(confirm("确定要重置整个棋盘吗？所有人的进度都将丢失！")) { await apiFetch(`/api/reset?radius=${radiusSelect.value}`, { method: 'POST' }); await fetchGameState(); } });
     // 【新功能】 为悔棋按钮绑定事件
     undoButton.addEventListener('click', handleUndo);
 
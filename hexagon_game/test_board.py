@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+测试六边形游戏的三角形结算、共享几何、悔棋、棋盘半径、棋盘矩阵和批量画线
+"""
+
+import copy
+import random
+
+from hexagon_game import app as hexagon_app
+
+BOARD_ID = "Hex12345"
+RED, BLUE = "#d9534f", "#428bca"
+
+
+def new_player(color=RED, radius=None, board_id=BOARD_ID):
+    """重置棋盘并选好颜色，返回客户端"""
+    client = hexagon_app.app.test_client()
+    query = f"board_id={board_id}" + (f"&radius={radius}" if radius else "")
+    client.post(f"/api/reset?{query}")
+    client.post(f"/api/select_color?board_id={board_id}", json={"color": color})
+    return client
+
+
+def draw(client, line, board_id=BOARD_ID):
+    p1, p2 = line
+    return client.post(f"/api/move?board_id={board_id}", json={"p1": list(p1), "p2": list(p2)})
+
+
+def legal_lines(client, board_id=BOARD_ID):
+    state = client.get(f"/api/gamestate?board_id={board_id}&legal_lines=1").get_json()
+    return [tuple(map(tuple, line)) for line in state["legal_lines"]]
+
+
+def test_random_fill_captures_every_triangle():
+    client = new_player(radius=4)
+    lines = legal_lines(client)
+    random.Random(4).shuffle(lines)
+    state = None
+    for line in lines:
+        if state and state["game_over"]:
+            break
+        response = draw(client, line)
+        assert response.status_code == 200
+        state = response.get_json()
+    geometry = hexagon_app.get_geometry(4)
+    assert len(geometry["triangles"]) == 96
+    assert state["game_over"] and state["scores"][RED] == 96
+    captured = {tuple(sorted(map(tuple, tri["points"]))) for tri in state["captured_triangles"]}
+    assert captured == set(geometry["triangles"])
+    # 每个三角形只结算一次
+    assert len(state["captured_triangles"]) == 96
+    assert draw(client, lines[-1]).status_code == 400
+
+
+def test_boards_share_geometry_and_undo_restores_state():
+    client = new_player(radius=3)
+    other = new_player(radius=3, board_id="Hex67890")
+    board = hexagon_app.get_board(BOARD_ID)
+    # 棋盘只保存半径，几何按半径共享，不随棋盘和历史复制
+    assert board["state"]["radius"] == 3 and "points" not in board["state"]
+    assert hexagon_app.get_geometry(3) is hexagon_app.get_geometry(hexagon_app.get_board("Hex67890")["state"]["radius"])
+    first, second = legal_lines(client)[:2]
+    before = draw(client, first).get_json()
+    assert draw(client, second).status_code == 200
+    board = hexagon_app.get_board(BOARD_ID)
+    assert len(board["history"]) == 2 and "points" not in board["history"][-1]
+
+    response = client.post(f"/api/undo?board_id={BOARD_ID}")
+    assert response.status_code == 200
+    state = response.get_json()
+    assert state["lines"] == before["lines"] and state["line_counts"] == before["line_counts"]
+    assert draw(client, second).status_code == 200
+    # 其他颜色不能撤销这一步
+    other.post(f"/api/select_color?board_id={BOARD_ID}", json={"color": BLUE})
+    assert other.post(f"/api/undo?board_id={BOARD_ID}").status_code == 403
+
+
+def test_undo_reverses_each_line_exactly():
+    client = new_player(radius=3)
+    lines = legal_lines(client)
+    random.Random(15).shuffle(lines)
+    undone_captures = 0
+    for turn, line in enumerate(lines):
+        before = copy.deepcopy(hexagon_app.get_board(BOARD_ID)["state"])
+        state = draw(client, line).get_json()
+        if turn % 3 == 0:
+            undone_captures += len(state["captured_triangles"]) - len(before["captured_triangles"])
+            assert client.post(f"/api/undo?board_id={BOARD_ID}").status_code == 200
+            # 悔棋记录只保存差异，逆向恢复后与画线前完全相同
+            assert hexagon_app.get_board(BOARD_ID)["state"] == before
+            state = draw(client, line).get_json()
+        if state["game_over"]:
+            break
+    assert state["game_over"] and undone_captures > 0
+    board = hexagon_app.get_board(BOARD_ID)
+    assert len(board["history"]) == hexagon_app.UNDO_LIMIT
+    assert all(isinstance(entry, tuple) for entry in board["history"])
+    # 终局也可以悔棋，撤销后棋局恢复进行中
+    assert client.post(f"/api/undo?board_id={BOARD_ID}").get_json()["game_over"] is False
+
+
+def test_radius_is_validated_and_lines_are_looked_up():
+    client = new_player(radius=3)
+    for radius in ("2", "11", "abc"):
+        response = client.get(f"/api/gamestate?board_id=Hex00000&radius={radius}")
+        assert response.status_code == 400 and "棋盘半径" in response.get_json()["error"]
+        assert client.post(f"/api/reset?board_id={BOARD_ID}&radius={radius}").status_code == 400
+    assert client.post(f"/api/reset?board_id={BOARD_ID}&radius=10").status_code == 200
+    state = client.get(f"/api/gamestate?board_id={BOARD_ID}&legal_lines=1").get_json()
+    assert state["radius"] == 10 and len(state["legal_lines"]) == len(hexagon_app.get_geometry(10)["lines"])
+    # 查表校验：长度不是4、不在一条直线上或超出棋盘的线都不合法
+    assert hexagon_app.get_line_points((0, 0), (3, 0), 3) == [(0, 0), (1, 0), (2, 0), (3, 0)]
+    assert hexagon_app.get_line_points((3, 0), (0, 0), 3) == [(3, 0), (2, 0), (1, 0), (0, 0)]
+    for p1, p2 in [((0, 0), (2, 0)), ((0, 0), (2, 1)), ((1, 0), (4, 0)), ((0, 0), ("a", 0))]:
+        assert hexagon_app.get_line_points(p1, p2, 3) is None
+    assert draw(client, ((0, 0), (2, 1))).status_code == 400
+
+
+def test_matrix_is_maintained_incrementally():
+    red = new_player(radius=3)
+    blue = hexagon_app.app.test_client()
+    blue.post(f"/api/select_color?board_id={BOARD_ID}", json={"color": BLUE})
+    lines = legal_lines(red)
+    random.Random(8).shuffle(lines)
+    for turn, line in enumerate(lines[:60]):
+        player = red if turn % 2 == 0 else blue
+        state = draw(player, line).get_json()
+        board = hexagon_app.get_board(BOARD_ID)
+        assert board["matrix"] == hexagon_app.project_to_matrix(board["state"])
+        assert state["board"] == board["matrix"]
+        if turn % 7 == 6:
+            state = player.post(f"/api/undo?board_id={BOARD_ID}").get_json()
+            board = hexagon_app.get_board(BOARD_ID)
+            assert board["matrix"] == hexagon_app.project_to_matrix(board["state"])
+            assert state["board"] == board["matrix"]
+    # 被占领的三角形按所属颜色投影到重心格子
+    geometry = hexagon_app.get_geometry(3)
+    codes = {RED: 2, BLUE: 3}
+    assert state["captured_triangles"]
+    for tri in state["captured_triangles"]:
+        row, col = geometry["triangle_cells"][geometry["triangle_index"][tuple(sorted(map(tuple, tri["points"])))]]
+        assert state["board"][row][col] == codes[tri["color"]]
+    assert len(state["board"]) == geometry["matrix_size"] == 19
+
+
+def test_legal_lines_view_has_its_own_version_tag():
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = new_player(radius=3)
+    plain = client.get(f"/api/gamestate?board_id={BOARD_ID}")
+    version = plain.get_json()["metadata"]["state_version"]
+    # 普通轮询之后在同一版本下请求合法线条，不能得到304或unchanged
+    response = client.get(f"/api/gamestate?board_id={BOARD_ID}&legal_lines=1&since_version={version}",
+                          headers={"If-None-Match": plain.headers["ETag"]})
+    assert response.status_code == 200 and response.get_json()["legal_lines"]
+    assert response.headers["ETag"] != plain.headers["ETag"]
+    response = client.get(f"/api/gamestate?board_id={BOARD_ID}&legal_lines=1&since_version={version}-L")
+    assert response.get_json() == {"unchanged": True, "version": version}
+    # 反过来拿合法线条视图的版本号请求普通gamestate，也返回完整内容
+    assert "unchanged" not in client.get(f"/api/gamestate?board_id={BOARD_ID}&since_version={version}-L").get_json()
+
+    # 长轮询只比较版本号部分，带-L后缀时同样等到棋盘变化或超时
+    async def park():
+        started = asyncio.get_running_loop().time()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            await hexagon_app.LONG_POLL.park(BOARD_ID, f"{version}-L", 0.2, executor)
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(park()) >= 0.2
+
+
+def test_batch_uses_session_color_unless_replaying(monkeypatch):
+    client = new_player(radius=3)
+    lines = legal_lines(client)[:3]
+    moves = [{"p1": list(p1), "p2": list(p2)} for p1, p2 in lines]
+    moves[1]["color"] = BLUE
+    response = client.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves})
+    assert response.status_code == 403 and response.get_json()["index"] == 1
+    moves[1]["color"] = RED
+    state = client.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves}).get_json()
+    assert state["line_counts"][RED] == 3
+
+    # 带正确的回放令牌时可以替其他颜色画线
+    monkeypatch.setattr(hexagon_app, "REPLAY_TOKEN", "replay-secret")
+    line = legal_lines(client)[0]
+    moves = [{"p1": list(line[0]), "p2": list(line[1]), "color": BLUE}]
+    response = client.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves},
+                           headers={"X-Replay-Token": "wrong"})
+    assert response.status_code == 403
+    response = client.post(f"/api/moves/batch?board_id={BOARD_ID}", json={"moves": moves},
+                           headers={"X-Replay-Token": "replay-secret"})
+    assert response.status_code == 200 and response.get_json()["line_counts"][BLUE] == 1
+
+
+def test_spilled_board_size_does_not_grow_with_history(tmp_path, monkeypatch):
+    import pickle
+
+    from common.state_store import JournalStore
+
+    # 每次修改都写快照，快照即换出时磁盘上的完整棋盘；预算只够一个棋盘，访问另一个棋盘时这个棋盘被换出
+    store = JournalStore(str(tmp_path), hexagon_app.replay_op, snapshot_every=1, memory_budget=1, retention=3600)
+    monkeypatch.setattr(hexagon_app, "STORE", store)
+    client = new_player(radius=3)
+    lines = legal_lines(client)
+    random.Random(17).shuffle(lines)
+    sizes = []
+    for count in (5, 60):
+        for line in lines[:count]:
+            draw(client, line)
+        del lines[:count]
+        board = hexagon_app.get_board(BOARD_ID)
+        without_history = len(pickle.dumps(dict(board, history=None), pickle.HIGHEST_PROTOCOL))
+        new_player(board_id="Other123")
+        assert BOARD_ID not in store
+        sizes.append((tmp_path / f"{BOARD_ID}.snapshot").stat().st_size - without_history)
+    # 快照只比状态本身多出最多UNDO_LIMIT条悔棋记录，每条几十字节
+    assert 0 < sizes[0] < sizes[1] < hexagon_app.UNDO_LIMIT * 100
+    # 从磁盘恢复后悔棋记录仍在，可以悔棋
+    board = hexagon_app.get_board(BOARD_ID)
+    assert BOARD_ID in store and len(board["history"]) == hexagon_app.UNDO_LIMIT
+    assert client.post(f"/api/undo?board_id={BOARD_ID}").status_code == 200
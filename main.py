@@ -3,16 +3,14 @@
 
 import os
 import sys
+import atexit
 import json
-import subprocess
 import threading
 import time
-import signal
-from flask import Flask, render_template, jsonify, request, redirect, url_for
+from flask import Flask, render_template, jsonify, request, redirect, url_for, Response, stream_with_context
 from flask_cors import CORS
-import requests
-import psutil
-import copy
+
+from supervisor import Supervisor
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -26,7 +24,6 @@ GAMES = {
         'port': 35101,
         'path': 'hexagon_game/app.py',
         'status': 'stopped',
-        'process': None,
         'url': 'http://124.221.145.212:35101'
     },
     'gobang': {
@@ -35,145 +32,171 @@ GAMES = {
         'port': 35102,
         'path': 'gobang/app.py',
         'status': 'stopped',
-        'process': None,
         'url': 'http://124.221.145.212:35102'
+    },
+    'siege': {
+        'name': '围城棋',
+        'description': '移动后在身边筑墙，把对手围进更小的区域',
+        'port': 35103,
+        'path': 'siege/app.py',
+        'status': 'stopped',
+        'url': 'http://124.221.145.212:35103'
     }
 }
 
+# 游戏的部署方式：separate为每个游戏各启动一个gunicorn服务器（各占一个端口）；
+# single为所有游戏按路径前缀挂在同一个服务器下（见game_host.py），共用进程、端口和静态文件服务
+GAME_HOST_MODE = os.environ.get('PLAYGROUND_GAME_HOST', 'separate')
+GAME_HOST = {
+    'port': 35110,
+    'status': 'stopped',
+    'url': 'http://124.221.145.212:35110'
+}
+if GAME_HOST_MODE == 'single':
+    for _game_id, _game in GAMES.items():
+        _game['url'] = f"{GAME_HOST['url']}/{_game_id}/"
+
+# 游戏服务器使用多线程worker，SSE推送等长连接不会独占整个进程
+GAME_SERVER_THREADS = 64
+# 每个游戏服务器的worker进程数；大于1时棋盘状态改存SQLite，由各worker共享
+GAME_SERVER_WORKERS = int(os.environ.get('PLAYGROUND_GAME_WORKERS', '1'))
+# 游戏服务器的运行方式：sync为gthread多线程worker；asgi为gunicorn的asyncio worker，
+# 请求仍由Flask路由处理，长轮询/api/gamestate?wait=和SSE推送在事件循环中等待，空闲连接不占线程（见common/asgi.py）
+GAME_SERVER_MODE = os.environ.get('PLAYGROUND_SERVER_MODE', 'sync')
+# asgi模式下每个worker同时保持的连接数上限
+GAME_SERVER_CONNECTIONS = int(os.environ.get('PLAYGROUND_GAME_CONNECTIONS', '10000'))
+# 各worker共享的session密钥，保证玩家身份在不同worker之间有效
+GAME_SECRET_KEY = os.environ.get('PLAYGROUND_SECRET_KEY') or os.urandom(24).hex()
+
+def game_server_env():
+    """游戏服务器进程的环境变量"""
+    env = dict(os.environ)
+    env['PLAYGROUND_SECRET_KEY'] = GAME_SECRET_KEY
+    # 同步模式下每条SSE推送连接占一个线程，最多用去四分之一的线程，其余留给落子等请求
+    env.setdefault('PLAYGROUND_STREAM_CLIENTS', str(GAME_SERVER_THREADS // 4))
+    if GAME_SERVER_WORKERS > 1:
+        # 进程内存储无法在worker之间共享
+        env.setdefault('PLAYGROUND_STATE_STORE', 'sqlite')
+    else:
+        # 单worker时棋盘在内存中，同时写快照和操作日志，重启游戏服务器后对局不丢失
+        env.setdefault('PLAYGROUND_STATE_STORE', 'journal')
+    return env
+
+def gunicorn_command(port, module):
+    """启动gunicorn的命令行，module为WSGI应用所在的模块（异步模式下取其中的asgi_app）"""
+    cmd = [
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'0.0.0.0:{port}',
+        '--workers', str(GAME_SERVER_WORKERS),
+        '--timeout', '120',
+        '--access-logfile', '-',
+        '--error-logfile', '-',
+    ]
+    if GAME_SERVER_MODE == 'asgi':
+        cmd += ['--worker-class', 'asgi', '--worker-connections', str(GAME_SERVER_CONNECTIONS), f'{module}:asgi_app']
+    else:
+        cmd += ['--worker-class', 'gthread', '--threads', str(GAME_SERVER_THREADS), f'{module}:app']
+    return cmd
+
+# 推送给主页的状态流
+STATUS_PING_INTERVAL = 15  # 秒，SSE保活注释的发送间隔
+STATUS_STREAM_MAX_AGE = 300  # 秒，单条SSE连接的最长存活时间，到期后浏览器自动重连
+STATUS_CHANGED = threading.Condition()
+STATUS_VERSION = 0  # 游戏状态每次变化自增
+HOSTED = set()      # 单进程多游戏模式下已启动的游戏
+HOSTED_LOCK = threading.Lock()  # HOSTED由请求线程和监管器的事件循环线程同时访问
+
+def publish_status():
+    """游戏状态已变化，唤醒主页的推送连接"""
+    global STATUS_VERSION
+    with STATUS_CHANGED:
+        STATUS_VERSION += 1
+        STATUS_CHANGED.notify_all()
+
+def set_game_status(game_id, status):
+    GAMES[game_id]['status'] = status
+    publish_status()
+
+def server_status_changed(name, status):
+    """监管器的回调（在其事件循环中调用）：服务器状态变化同步到对应的游戏"""
+    if name == 'game_host':
+        with HOSTED_LOCK:
+            GAME_HOST['status'] = status
+            for game_id in HOSTED:
+                GAMES[game_id]['status'] = status
+        publish_status()
+    else:
+        set_game_status(name, status)
+
+SUPERVISOR = Supervisor(on_change=server_status_changed)
+
+def register_servers():
+    """向监管器登记游戏服务器：每个游戏一个，单进程多游戏模式下只有共用的game_host"""
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    env = game_server_env()
+    if GAME_HOST_MODE == 'single':
+        port = GAME_HOST['port']
+        SUPERVISOR.add('game_host', gunicorn_command(port, 'game_host'), root_dir, env,
+                       f'http://127.0.0.1:{port}/health')
+        return
+    for game_id, game in GAMES.items():
+        # 在游戏目录中运行
+        SUPERVISOR.add(game_id, gunicorn_command(game['port'], 'app'), os.path.join(root_dir, game_id), env,
+                       f"http://127.0.0.1:{game['port']}/health")
+
+register_servers()
+# 主页服务器退出时（包括在gunicorn下运行时）停止所有游戏服务器
+atexit.register(lambda: cleanup_on_exit())
+
 def start_game_server(game_id):
-    """启动游戏服务器"""
+    """启动游戏服务器，立即返回，启动进度经状态推送通知主页；
+    单进程多游戏模式下启动（或复用）共用的服务器
+    """
     game = GAMES[game_id]
-    if game['status'] == 'running':
+    if game['status'] in ('running', 'starting'):
         return False, "游戏服务器已在运行"
-    
-    try:
-        # 启动游戏服务器
-        cmd = [
-            sys.executable, '-m', 'gunicorn',
-            '--bind', f'0.0.0.0:{game["port"]}',
-            '--workers', '1',
-            '--timeout', '120',
-            '--access-logfile', '-',
-            '--error-logfile', '-',
-            'app:app'
-        ]
-        
-        # 切换到游戏目录
-        game_dir = os.path.join(os.path.dirname(__file__), game_id)
-        process = subprocess.Popen(
-            cmd,
-            cwd=game_dir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            preexec_fn=os.setsid if hasattr(os, 'setsid') else None
-        )
-        
-        # 实时打印子进程日志
-        def stream_output(pipe, prefix):
-            for line in iter(pipe.readline, b''):
-                print(f"[{prefix}] {line.decode().rstrip()}")
-        threading.Thread(target=stream_output, args=(process.stdout, f"{game_id}-stdout"), daemon=True).start()
-        threading.Thread(target=stream_output, args=(process.stderr, f"{game_id}-stderr"), daemon=True).start()
-
-        game['process'] = process
-        game['status'] = 'starting'
-        
-        # 等待服务器启动
-        def wait_for_server():
-            time.sleep(3)  # 给服务器一些启动时间
-            try:
-                response = requests.get(f"{game['url']}/health", timeout=5)
-                if response.status_code == 200:
-                    game['status'] = 'running'
-                else:
-                    game['status'] = 'error'
-            except:
-                game['status'] = 'error'
-        
-        threading.Thread(target=wait_for_server, daemon=True).start()
-        return True, "游戏服务器启动中"
-        
-    except Exception as e:
-        game['status'] = 'error'
-        return False, f"启动失败: {str(e)}"
+    if GAME_HOST_MODE == 'single':
+        with HOSTED_LOCK:
+            HOSTED.add(game_id)
+            if GAME_HOST['status'] in ('running', 'starting'):
+                set_game_status(game_id, GAME_HOST['status'])
+                return True, "游戏服务器启动中"
+            set_game_status(game_id, 'starting')
+            SUPERVISOR.start('game_host')
+    else:
+        set_game_status(game_id, 'starting')
+        SUPERVISOR.start(game_id)
+    return True, "游戏服务器启动中"
 
 def stop_game_server(game_id):
-    """停止游戏服务器"""
-    game = GAMES[game_id]
-    
-    try:
-        # 方法1: 如果有process对象，尝试终止它
-        if game['process']:
-            try:
-                # 终止进程组
-                if hasattr(os, 'killpg'):
-                    os.killpg(os.getpgid(game['process'].pid), signal.SIGTERM)
-                else:
-                    game['process'].terminate()
-                
-                # 等待进程结束
-                try:
-                    game['process'].wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    game['process'].kill()
-            except:
-                pass  # 忽略错误，继续尝试其他方法
-        
-        # 方法2: 查找并杀死占用端口的进程
-        port = game['port']
-        try:
-            # 使用lsof查找占用端口的进程
-            result = subprocess.run(
-                ['lsof', '-ti', f':{port}'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            if result.returncode == 0 and result.stdout.strip():
-                pids = result.stdout.strip().split('\n')
-                for pid in pids:
-                    if pid.strip():
-                        try:
-                            # 发送SIGTERM信号
-                            os.kill(int(pid), signal.SIGTERM)
-                            time.sleep(1)
-                            
-                            # 检查进程是否还在运行，如果还在就强制杀死
-                            try:
-                                os.kill(int(pid), 0)  # 检查进程是否存在
-                                os.kill(int(pid), signal.SIGKILL)  # 强制杀死
-                            except OSError:
-                                pass  # 进程已经不存在了
-                        except (ValueError, OSError):
-                            pass  # 忽略错误
-        except:
-            pass  # 忽略lsof命令的错误
-        
-        # 清理状态
-        game['process'] = None
-        game['status'] = 'stopped'
+    """停止游戏服务器，立即返回；单进程多游戏模式下所有游戏都停止后才停止共用的服务器"""
+    if GAME_HOST_MODE == 'single':
+        with HOSTED_LOCK:
+            HOSTED.discard(game_id)
+            set_game_status(game_id, 'stopped')
+            if not HOSTED:
+                SUPERVISOR.stop('game_host')
         return True, "游戏服务器已停止"
-        
-    except Exception as e:
-        return False, f"停止失败: {str(e)}"
+    if GAMES[game_id]['status'] == 'stopped':
+        return True, "游戏服务器已停止"
+    set_game_status(game_id, 'stopping')
+    SUPERVISOR.stop(game_id)
+    return True, "游戏服务器停止中"
 
-def check_game_status():
-    """检查所有游戏状态"""
-    for game_id, game in GAMES.items():
-        if game['status'] == 'running':
-            try:
-                response = requests.get(f"{game['url']}/health", timeout=3)
-                if response.status_code != 200:
-                    game['status'] = 'error'
-            except:
-                game['status'] = 'error'
+def restart_game_server(game_id):
+    """重启游戏服务器，立即返回；单进程多游戏模式下重启共用的服务器（所有游戏一起重启）"""
+    if GAME_HOST_MODE == 'single':
+        with HOSTED_LOCK:
+            HOSTED.add(game_id)
+            set_game_status(game_id, 'starting')
+            SUPERVISOR.restart('game_host')
+    else:
+        set_game_status(game_id, 'starting')
+        SUPERVISOR.restart(game_id)
+    return True, "游戏重启中"
 
 def get_games_for_api():
-    games_copy = {}
-    for k, v in GAMES.items():
-        games_copy[k] = {key: value for key, value in v.items() if key != 'process'}
-    return games_copy
+    return {k: dict(v) for k, v in GAMES.items()}
 
 @app.route('/')
 def index():
@@ -183,9 +206,28 @@ def index():
 @app.route('/api/games')
 def get_games():
     """获取游戏列表"""
-    check_game_status()
     return jsonify(get_games_for_api())
 
+@app.route('/api/games/stream')
+def stream_games():
+    """SSE推送：建立连接时推送一次全部游戏的状态，之后每次状态变化时推送"""
+    def generate():
+        sent_version = None
+        deadline = time.time() + STATUS_STREAM_MAX_AGE
+        while time.time() < deadline:
+            with STATUS_CHANGED:
+                if STATUS_VERSION == sent_version:
+                    STATUS_CHANGED.wait(STATUS_PING_INTERVAL)
+                version = STATUS_VERSION
+            if version == sent_version:
+                yield ': ping\n\n'
+                continue
+            sent_version = version
+            yield f'data: {json.dumps(get_games_for_api(), ensure_ascii=False)}\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
 @app.route('/api/games/<game_id>/start', methods=['POST'])
 def start_game(game_id):
     """启动游戏"""
@@ -216,14 +258,9 @@ def restart_game(game_id):
     if game_id not in GAMES:
         return jsonify({'error': '游戏不存在'}), 404
     
-    # 先停止
-    stop_game_server(game_id)
-    time.sleep(1)
-    
-    # 再启动
-    success, message = start_game_server(game_id)
+    success, message = restart_game_server(game_id)
     if success:
-        return jsonify({'message': '游戏重启中', 'status': GAMES[game_id]['status']})
+        return jsonify({'message': message, 'status': GAMES[game_id]['status']})
     else:
         return jsonify({'error': message}), 400
 
@@ -268,13 +305,8 @@ def stop_all_games():
 
 def cleanup_on_exit():
     """退出时清理所有进程"""
-    for game_id in GAMES:
-        stop_game_server(game_id)
+    SUPERVISOR.shutdown()
 
 if __name__ == '__main__':
-    # 注册退出处理
-    import atexit
-    atexit.register(cleanup_on_exit)
-    
     # 启动主页服务器
     app.run(debug=True, host='0.0.0.0', port=35100)
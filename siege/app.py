@@ -1,55 +1,165 @@
 from flask import Flask, jsonify, request, session
-import threading
+import os
+import sys
 import time
 import random
 import string
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
 from flask import render_template
 
+# 将项目根目录加入模块搜索路径，以便引用公共模块common
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from common.asgi import AsgiApp, LongPoll
+from common.expiry import start_expiry_thread
+from common.response_cache import ResponseCache, conditional_response
+from common.state_store import create_store
+from siege import bot
+from siege.rules import (STEP_TO_BIT, WALL_BITS, block_edge, neighbor_offsets, new_blocked, reachable_targets,
+                         wall_slots)
+
 app = Flask(__name__)
 app.secret_key = 'siege-secret-key'
+RESPONSE_CACHE = ResponseCache(app.json.dumps)
 
 # 游戏数据结构
-GAMES = {}
-GAMES_LOCK = threading.Lock()
-BOARD_SIZE = 5
-MAX_PLAYERS = 5
-COLORS = [1, 2, 3, 4, 5]  # 五种颜色
-START_POSITIONS = {
-    2: [(0,0), (4,4)],
-    3: [(0,0), (4,0), (2,4)],
-    4: [(0,0), (4,0), (0,4), (4,4)],
-    5: [(0,0), (4,0), (0,4), (4,4), (2,2)]
-}
+# 默认进程内存储，设置PLAYGROUND_STATE_STORE=sqlite后可多worker共享，
+# 设置为journal时落盘，重启后按需重放（replay_op定义在后面）
+ROOM_EXPIRE = 120  # 超过2分钟无人访问的房间自动销毁
+MAX_ROOMS = 1000   # 房间数上限，超出时淘汰最久未访问的房间
+STORE = create_store('siege', replay=lambda game, op: replay_op(game, op),
+                     max_boards=MAX_ROOMS, on_delete=RESPONSE_CACHE.invalidate)
+# 异步模式下的长轮询：/api/gamestate?since_version=V&wait=秒 在房间变化前不占线程（见common/asgi.py）
+LONG_POLL = LongPoll(STORE)
+DEFAULT_BOARD_SIZE = 5
+MIN_BOARD_SIZE = 5
+MAX_BOARD_SIZE = 25  # 房间重置时可选 MIN_BOARD_SIZE~MAX_BOARD_SIZE 的边长
+MAX_PLAYERS = 9
+COLORS = list(range(1, MAX_PLAYERS + 1))  # 每人一种颜色
+BOT_PROCESSES = int(os.environ.get('PLAYGROUND_AI_PROCESSES', os.cpu_count() or 1))  # 机器人搜索子进程数
+BOT_TIME_LIMIT = 1.0     # 秒，机器人每回合的思考时间
+BOT_RESULT_GRACE = 5.0   # 秒，超过思考时间这么久仍未返回结果则放弃本回合，下次轮询gamestate时重新安排
+BOT_POOLS = []           # 每个子进程一个单进程池，同一房间固定交给同一个子进程以复用估值缓存
+BOT_PENDING = set()      # 已安排了机器人回合、尚未走完的房间
+BOT_LOCK = Lock()        # 保护BOT_POOLS和BOT_PENDING
+BOT_THREADS = ThreadPoolExecutor(max_workers=2, thread_name_prefix='siege-bot')  # 等待搜索结果并落子，不占用请求线程
 
 def gen_board_id():
     return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
 
-def create_new_game():
+def create_new_game(size=DEFAULT_BOARD_SIZE):
     return {
+        'size': size,
         'players': [],  # [{id, color, start_pos, online}]
         'status': 'waiting',  # waiting/playing/finished
         'current_turn': 0,
         'move_history': [],
         'winner': None,
-        'board': [[0 for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)],
-        'walls': set(),  # {(x, y, direction)}
+        'board': [[0 for _ in range(size)] for _ in range(size)],
+        'walls': [],  # [[x, y, direction, color_idx]]，按筑墙顺序，供前端绘制
+        'blocked': new_blocked(size),  # 边掩码，走子和判定都查它
+        'occupant': [-1] * (size * size),  # 每格上玩家的序号，空格为-1；开始和移动时更新
+        'region': [0] * (size * size),  # 每格所在连通区域的编号（只看墙，不看玩家）
+        'region_sizes': [size * size],  # 区域编号 -> 格子数
         'created_at': time.time(),
-        'message': '等待玩家加入...'
+        'last_active': time.time(),
+        'message': '等待玩家加入...',
+        'version': STORE.initial_version()  # 房间每次变化自增，用于条件GET；删除后新建不会重复旧房间的版本号
     }
 
+def start_positions(size, n):
+    """n名玩家的初始位置：先占四角，单数时加中心，其余放在各边中点，尽量分散"""
+    m, c = size - 1, size // 2
+    if n <= 3:
+        return [(0, 0), (m, 0), (c, m)][:n] if n == 3 else [(0, 0), (m, m)][:n]
+    positions = [(0, 0), (m, 0), (0, m), (m, m)]
+    extra = n - 4
+    if extra % 2:
+        positions.append((c, c))
+    return positions + [(c, 0), (c, m), (0, c), (m, c)][:extra - extra % 2]
+
+def add_wall(game, x, y, direction, color_idx):
+    """在(x, y)的direction一侧筑墙，两侧格子的掩码同时更新"""
+    game['walls'].append([x, y, direction, color_idx])
+    a, b = block_edge(game['blocked'], game['size'], x, y, direction)
+    split_region(game, a, b)
+
+def split_region(game, a, b):
+    """a、b两格之间刚筑了墙，判断原区域是否被分成两块。
+    墙只增不减，区域只会分裂：从两侧交替各扩展一格，相遇说明仍连通；
+    某一侧先扩展完，它就是分出去的较小一块，给它一个新编号。代价与较小一侧的格子数成正比
+    """
+    region, blocked = game['region'], game['blocked']
+    label = region[a]
+    if region[b] != label:
+        return
+    seen = ({a}, {b})
+    queues = (deque([a]), deque([b]))
+    while True:
+        for side in (0, 1):
+            queue, mine, other = queues[side], seen[side], seen[1 - side]
+            if not queue:
+                new_label = len(game['region_sizes'])
+                game['region_sizes'].append(len(mine))
+                game['region_sizes'][label] -= len(mine)
+                for i in mine:
+                    region[i] = new_label
+                return
+            i = queue.popleft()
+            for offset, bit in neighbor_offsets(game['size']):
+                if blocked[i] & bit:
+                    continue
+                j = i + offset
+                if j in other:
+                    return
+                if j not in mine:
+                    mine.add(j)
+                    queue.append(j)
+
+def player_regions(game):
+    """各玩家所在区域的编号，未落位的玩家为None"""
+    size = game['size']
+    return [game['region'][p['pos'][1] * size + p['pos'][0]] if p.get('pos') else None
+            for p in game['players']]
+
 def get_game(board_id, create_if_missing=True):
-    with GAMES_LOCK:
-        if board_id not in GAMES and create_if_missing:
-            GAMES[board_id] = create_new_game()
-        return GAMES.get(board_id)
+    """取房间并刷新活跃时间。使用共享存储时返回的是副本，修改需经notify_game_changed写回"""
+    game = STORE.get(board_id, create_new_game if create_if_missing else None)
+    if game is not None:
+        STORE.touch(board_id, game)
+    return game
+
+def notify_game_changed(board_id, game, op=None):
+    """房间状态发生变化：版本号自增并写回存储，作废已缓存的序列化gamestate，唤醒等待它的长轮询。
+    op为本次修改的操作记录，供操作日志重放（见replay_op）；整局替换时为None。调用方需持有该房间的锁
+    """
+    game['version'] += 1
+    STORE.put(board_id, game, op)
+    RESPONSE_CACHE.invalidate(board_id)
+    LONG_POLL.notify(board_id)
+    if bot_turn_due(game):
+        schedule_bot_turn(board_id)
+
+# 后台清理无人访问的房间，被删除的房间经on_delete作废已缓存的gamestate
+start_expiry_thread(STORE, ROOM_EXPIRE)
 
 # 辅助函数
 
+def on_board(size, x, y):
+    # 坐标来自请求的JSON，必须是整数（true/false和1.0都不算）且在棋盘内，之后才能用来算下标
+    return all(type(v) is int for v in (x, y)) and 0 <= x < size and 0 <= y < size
+
 def is_valid_move(game, player_idx, start, target):
     # 检查目标是否在棋盘内
     x0, y0 = start
     x1, y1 = target
-    if not (0 <= x1 < BOARD_SIZE and 0 <= y1 < BOARD_SIZE):
+    size = game['size']
+    if not on_board(size, x1, y1):
         return False, '目标超出棋盘范围'
     # 不能原地不动
     if (x0, y0) == (x1, y1):
@@ -72,40 +182,40 @@ def is_valid_move(game, player_idx, start, target):
         if is_blocked(game, cx, cy, nx, ny):
             return False, '路径被墙体阻挡'
         # 检查其他玩家
-        for idx, p in enumerate(game['players']):
-            if idx != player_idx and p.get('pos') == (nx, ny):
-                return False, '路径被其他玩家阻挡'
+        if game['occupant'][ny * size + nx] not in (-1, player_idx):
+            return False, '路径被其他玩家阻挡'
         cx, cy = nx, ny
     return True, ''
 
 def is_blocked(game, x0, y0, x1, y1):
-    # 判断(x0,y0)-(x1,y1)之间是否有墙
-    if abs(x0-x1)+abs(y0-y1) != 1:
+    # 判断(x0,y0)-(x1,y1)之间是否有墙（棋盘边缘也算墙）
+    bit = STEP_TO_BIT.get((x1 - x0, y1 - y0))
+    if bit is None:
         return True  # 只允许相邻
-    if x0 == x1:
-        if y1 > y0:
-            return ((x0, y0, 'down') in game['walls']) or ((x1, y1, 'up') in game['walls'])
-        else:
-            return ((x0, y0, 'up') in game['walls']) or ((x1, y1, 'down') in game['walls'])
-    else:
-        if x1 > x0:
-            return ((x0, y0, 'right') in game['walls']) or ((x1, y1, 'left') in game['walls'])
-        else:
-            return ((x0, y0, 'left') in game['walls']) or ((x1, y1, 'right') in game['walls'])
+    return bool(game['blocked'][y0 * game['size'] + x0] & bit)
 
-def is_valid_wall(game, pos, direction):
+def is_valid_wall(game, player_pos, pos, direction):
+    # 墙只能筑在玩家所在格子（player_pos）的四周
+    # 先判断类型：客户端传来的列表、字典不可哈希，直接查WALL_BITS会抛TypeError
+    if not isinstance(direction, str) or direction not in WALL_BITS:
+        return False, '无效的墙体方向'
     x, y = pos
+    size = game['size']
+    if not on_board(size, x, y):
+        return False, '墙体位置超出棋盘范围'
+    if (x, y) != tuple(player_pos):
+        return False, '只能在自己所在格子的四周筑墙'
     # 检查墙体是否越界
     if direction == 'up' and y == 0:
         return False, '不能在棋盘外放置墙体'
-    if direction == 'down' and y == BOARD_SIZE-1:
+    if direction == 'down' and y == size-1:
         return False, '不能在棋盘外放置墙体'
     if direction == 'left' and x == 0:
         return False, '不能在棋盘外放置墙体'
-    if direction == 'right' and x == BOARD_SIZE-1:
+    if direction == 'right' and x == size-1:
         return False, '不能在棋盘外放置墙体'
-    # 检查是否已存在
-    if (x, y, direction) in game['walls']:
+    # 检查是否已存在（包括从另一侧筑的同一面墙）
+    if game['blocked'][y * size + x] & WALL_BITS[direction]:
         return False, '该位置已有墙体'
     return True, ''
 
@@ -114,52 +224,17 @@ def is_player_trapped(game, player_idx):
     pos = game['players'][player_idx].get('pos')
     if not pos:
         return False
-    x, y = pos
-    for dx, dy in [(-1,0),(1,0),(0,-1),(0,1)]:
-        nx, ny = x+dx, y+dy
-        if 0 <= nx < BOARD_SIZE and 0 <= ny < BOARD_SIZE:
-            if not is_blocked(game, x, y, nx, ny):
-                occupied = False
-                for idx, p in enumerate(game['players']):
-                    if idx != player_idx and p.get('pos') == (nx, ny):
-                        occupied = True
-                        break
-                if not occupied:
-                    return False
+    i = pos[1] * game['size'] + pos[0]
+    blocked, occupant = game['blocked'][i], game['occupant']
+    for offset, bit in neighbor_offsets(game['size']):
+        if not blocked & bit and occupant[i + offset] in (-1, player_idx):
+            return False
     return True
 
 def all_players_isolated(game):
-    # 判断所有玩家是否被分割在不同区域
-    # 用BFS分区，统计每个玩家所在区域
-    from collections import deque
-    board = [[-1 for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
-    for idx, p in enumerate(game['players']):
-        if p.get('pos'):
-            board[p['pos'][1]][p['pos'][0]] = idx
-    visited = set()
-    groups = []
-    for idx, p in enumerate(game['players']):
-        if not p.get('pos'):
-            continue
-        if p['pos'] in visited:
-            continue
-        q = deque([p['pos']])
-        group = set([idx])
-        visited.add(p['pos'])
-        while q:
-            x, y = q.popleft()
-            for dx, dy in [(-1,0),(1,0),(0,-1),(0,1)]:
-                nx, ny = x+dx, y+dy
-                if 0 <= nx < BOARD_SIZE and 0 <= ny < BOARD_SIZE:
-                    if is_blocked(game, x, y, nx, ny):
-                        continue
-                    if board[ny][nx] != -1 and (nx, ny) not in visited:
-                        group.add(board[ny][nx])
-                        q.append((nx, ny))
-                        visited.add((nx, ny))
-        groups.append(group)
-    # 如果每个玩家都在不同group，则隔绝
-    return len(groups) == len(game['players'])
+    # 判断所有玩家是否被分割在不同区域：区域编号随筑墙增量维护，这里只需比较各玩家所在格的编号
+    regions = [r for r in player_regions(game) if r is not None]
+    return len(set(regions)) == len(regions)
 
 @app.route('/health')
 def health():
@@ -170,141 +245,283 @@ def api_gamestate():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的房间id'}), 400
-    game = get_game(board_id, create_if_missing=False)
-    if not game:
-        return jsonify({'error': '房间不存在'}), 404
     # 返回主要游戏状态
-    # 墙体带颜色
-    walls = [list(w) for w in game['walls']]
-    return jsonify({
-        'players': game['players'],
-        'status': game['status'],
-        'current_turn': game['current_turn'],
-        'move_history': game['move_history'],
-        'winner': game['winner'],
-        'board': game['board'],
-        'walls': walls,
-        'message': game['message'],
-        'board_id': board_id
-    })
+    def build():
+        # 墙体带颜色
+        walls = game['walls']
+        return {
+            'players': game['players'],
+            'size': game['size'],
+            'status': game['status'],
+            'current_turn': game['current_turn'],
+            'move_history': game['move_history'],
+            'winner': game['winner'],
+            'board': game['board'],
+            'walls': walls,
+            'message': game['message'],
+            'board_id': board_id,
+            'version': game['version']
+        }
+    # 同一版本下所有客户端共享一次序列化；保证版本号与内容一致
+    with STORE.reading(board_id):
+        game = get_game(board_id, create_if_missing=False)
+        if not game:
+            return jsonify({'error': '房间不存在'}), 404
+        # 服务器重启或其他worker改动后，由轮询补上轮到机器人的回合
+        if bot_turn_due(game):
+            schedule_bot_turn(board_id)
+        version = game['version']
+        return conditional_response(f'{board_id}-{version}', version,
+                                    lambda: RESPONSE_CACHE.get(board_id, version, build))
+
+@app.route('/api/legal_actions')
+def api_legal_actions():
+    """当前玩家本回合的全部合法动作：可移动到的落点（直线1~3格）和当前位置四周可筑的墙。
+    每个版本只计算一次，所有客户端共享；your_turn表示请求者是否就是当前玩家
+    """
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的房间id'}), 400
+    with STORE.reading(board_id):
+        game = get_game(board_id, create_if_missing=False)
+        if not game:
+            return jsonify({'error': '房间不存在'}), 404
+        version = game['version']
+        player_id = session.get(f'player_id_{board_id}')
+        your_turn = (game['status'] == 'playing' and player_id is not None
+                     and game['players'][game['current_turn']]['id'] == player_id)
+        return conditional_response(f'{board_id}-{version}-actions-{int(your_turn)}', version,
+                                    lambda: RESPONSE_CACHE.get(board_id, version, lambda: legal_actions(game),
+                                                               variant='legal_actions',
+                                                               viewer={'your_turn': your_turn}))
 
 @app.route('/api/join', methods=['POST'])
 def api_join():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的房间id'}), 400
-    game = get_game(board_id)
-    if game['status'] != 'waiting':
-        return jsonify({'error': '游戏已开始，无法加入'}), 403
-    if len(game['players']) >= MAX_PLAYERS:
-        return jsonify({'error': '房间已满'}), 403
-    # 分配颜色
-    used_colors = {p['color'] for p in game['players']}
-    available_colors = [c for c in COLORS if c not in used_colors]
-    if not available_colors:
-        return jsonify({'error': '无可用颜色'}), 403
-    color = available_colors[0]
-    player_id = session.get(f'player_id_{board_id}')
-    if not player_id:
-        player_id = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
-        session[f'player_id_{board_id}'] = player_id
-    # 检查是否已加入
-    for p in game['players']:
-        if p['id'] == player_id:
-            return jsonify({'message': '已加入', 'color': p['color'], 'player_id': player_id})
-    game['players'].append({'id': player_id, 'color': color, 'online': True, 'start_pos': None})
-    return jsonify({'message': '加入成功', 'color': color, 'player_id': player_id})
+    # 持锁后再取房间，校验和修改在同一把锁内完成
+    with STORE.lock(board_id):
+        game = get_game(board_id)
+        if game['status'] != 'waiting':
+            return jsonify({'error': '游戏已开始，无法加入'}), 403
+        if len(game['players']) >= MAX_PLAYERS:
+            return jsonify({'error': '房间已满'}), 403
+        # 分配颜色
+        color = next_color(game)
+        if color is None:
+            return jsonify({'error': '无可用颜色'}), 403
+        player_id = session.get(f'player_id_{board_id}')
+        if not player_id:
+            player_id = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+            session[f'player_id_{board_id}'] = player_id
+        # 检查是否已加入
+        for p in game['players']:
+            if p['id'] == player_id:
+                return jsonify({'message': '已加入', 'color': p['color'], 'player_id': player_id})
+        apply_join(game, player_id, color)
+        notify_game_changed(board_id, game, ('join', player_id, color))
+        return jsonify({'message': '加入成功', 'color': color, 'player_id': player_id})
+
+@app.route('/api/add_bot', methods=['POST'])
+def api_add_bot():
+    """加入一个由服务器控制的机器人玩家，轮到它时在后台自动移动并筑墙"""
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的房间id'}), 400
+    with STORE.lock(board_id):
+        game = get_game(board_id)
+        if game['status'] != 'waiting':
+            return jsonify({'error': '游戏已开始，无法加入'}), 403
+        if len(game['players']) >= MAX_PLAYERS:
+            return jsonify({'error': '房间已满'}), 403
+        color = next_color(game)
+        if color is None:
+            return jsonify({'error': '无可用颜色'}), 403
+        player_id = 'bot-' + ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+        apply_join(game, player_id, color, True)
+        notify_game_changed(board_id, game, ('join', player_id, color, True))
+        return jsonify({'message': '机器人已加入', 'color': color, 'player_id': player_id})
 
 @app.route('/api/start_game', methods=['POST'])
 def api_start_game():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的房间id'}), 400
-    game = get_game(board_id)
-    if game['status'] != 'waiting':
-        return jsonify({'error': '游戏已开始'}), 400
-    n = len(game['players'])
-    if n < 1 or n > 5:
-        return jsonify({'error': '玩家人数需为1~5人'}), 400
-    # 分配初始位置
-    for idx, p in enumerate(game['players']):
-        p['start_pos'] = START_POSITIONS[n][idx]
-        p['pos'] = p['start_pos']
-    game['status'] = 'playing'
-    game['current_turn'] = 0
-    game['message'] = '游戏开始！轮到玩家1行动。'
-    return jsonify({'message': '游戏已开始', 'players': game['players']})
+    with STORE.lock(board_id):
+        game = get_game(board_id)
+        if game['status'] != 'waiting':
+            return jsonify({'error': '游戏已开始'}), 400
+        n = len(game['players'])
+        if n < 1 or n > MAX_PLAYERS:
+            return jsonify({'error': f'玩家人数需为1~{MAX_PLAYERS}人'}), 400
+        apply_start(game)
+        notify_game_changed(board_id, game, ('start',))
+        return jsonify({'message': '游戏已开始', 'players': game['players']})
 
 @app.route('/api/move', methods=['POST'])
 def api_move():
     board_id = request.args.get('board_id')
     if not board_id or not board_id.isalnum() or len(board_id) != 8:
         return jsonify({'error': '无效的房间id'}), 400
-    game = get_game(board_id)
+    with STORE.lock(board_id):
+        game = get_game(board_id)
+        if game['status'] != 'playing':
+            return jsonify({'error': '游戏未在进行中'}), 400
+        player_id = session.get(f'player_id_{board_id}')
+        if not player_id:
+            return jsonify({'error': '未识别玩家身份'}), 403
+        # 检查是否轮到该玩家
+        if game['players'][game['current_turn']]['id'] != player_id:
+            return jsonify({'error': '未轮到你行动'}), 403
+        data = request.get_json()
+        target = data.get('target')  # [x, y]
+        if not (isinstance(target, list) and len(target) == 2):
+            return jsonify({'error': '无效的目标位置'}), 400
+        if has_moved(game):
+            return jsonify({'error': '本回合已移动，请筑墙'}), 400
+        player_idx = game['current_turn']
+        player = game['players'][player_idx]
+        start = player.get('pos') or player.get('start_pos')
+        valid, msg = is_valid_move(game, player_idx, start, tuple(target))
+        if not valid:
+            return jsonify({'error': msg}), 400
+        apply_move(game, tuple(target))
+        notify_game_changed(board_id, game, ('move', tuple(target)))
+        return jsonify({'message': '移动成功，请筑墙', 'next': 'build'})
+
+@app.route('/api/build', methods=['POST'])
+def api_build():
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的房间id'}), 400
+    with STORE.lock(board_id):
+        game = get_game(board_id)
+        if game['status'] != 'playing':
+            return jsonify({'error': '游戏未在进行中'}), 400
+        player_id = session.get(f'player_id_{board_id}')
+        if not player_id:
+            return jsonify({'error': '未识别玩家身份'}), 403
+        # 检查是否轮到该玩家
+        if game['players'][game['current_turn']]['id'] != player_id:
+            return jsonify({'error': '未轮到你行动'}), 403
+        data = request.get_json()
+        wall = data.get('wall')  # [x, y, direction]
+        if not (isinstance(wall, list) and len(wall) == 3):
+            return jsonify({'error': '无效的墙体参数'}), 400
+        pos = tuple(wall[:2])
+        direction = wall[2]
+        valid, msg = is_valid_wall(game, game['players'][game['current_turn']]['pos'], pos, direction)
+        if not valid:
+            return jsonify({'error': msg}), 400
+        apply_build(game, pos, direction)
+        notify_game_changed(board_id, game, ('build', pos, direction))
+        return jsonify({'message': '筑墙成功', 'next': 'move'})
+
+@app.route('/api/reset', methods=['POST'])
+def api_reset():
+    board_id = request.args.get('board_id')
+    if not board_id or not board_id.isalnum() or len(board_id) != 8:
+        return jsonify({'error': '无效的房间id'}), 400
+    # 可选 {"size": N} 指定新棋盘的边长，不指定时沿用原房间的边长
+    size = (request.get_json(silent=True) or {}).get('size')
+    if size is not None and not (isinstance(size, int) and MIN_BOARD_SIZE <= size <= MAX_BOARD_SIZE):
+        return jsonify({'error': f'棋盘边长需为{MIN_BOARD_SIZE}~{MAX_BOARD_SIZE}'}), 400
+    # 等待该房间内进行中的操作完成后再替换
+    with STORE.lock(board_id):
+        old_game = STORE.get(board_id)
+        if size is None:
+            size = old_game['size'] if old_game else DEFAULT_BOARD_SIZE
+        game = create_new_game(size)
+        # 版本号跨重置保持单调递增，避免客户端误判为未变化
+        if old_game:
+            game['version'] = old_game['version']
+        notify_game_changed(board_id, game)
+    return jsonify({'message': '房间已重置'})
+
+def has_moved(game):
+    """当前玩家本回合是否已经移动过（每回合先移动一次再筑墙，被困时可直接筑墙）"""
+    history = game['move_history']
+    if not history or history[-1]['type'] != 'move':
+        return False
+    return history[-1]['player'] == game['players'][game['current_turn']]['id']
+
+def legal_actions(game):
+    """当前玩家的合法动作，游戏未在进行中时为空"""
     if game['status'] != 'playing':
-        return jsonify({'error': '游戏未在进行中'}), 400
-    player_id = session.get(f'player_id_{board_id}')
-    if not player_id:
-        return jsonify({'error': '未识别玩家身份'}), 403
-    # 检查是否轮到该玩家
-    if game['players'][game['current_turn']]['id'] != player_id:
-        return jsonify({'error': '未轮到你行动'}), 403
-    data = request.get_json()
-    target = data.get('target')  # [x, y]
-    if not (isinstance(target, list) and len(target) == 2):
-        return jsonify({'error': '无效的目标位置'}), 400
+        return {'version': game['version'], 'player': None, 'moved': False, 'targets': [], 'walls': []}
+    idx = game['current_turn']
+    pos = game['players'][idx]['pos']
+    size, blocked = game['size'], game['blocked']
+    moved = has_moved(game)
+    targets = [] if moved else reachable_targets(size, blocked, game['occupant'], pos, idx)
+    return {
+        'version': game['version'],
+        'player': idx,
+        'moved': moved,
+        'targets': [list(t) for t in targets],
+        'walls': [[pos[0], pos[1], d] for d in wall_slots(size, blocked, pos)],
+    }
+
+def next_color(game):
+    """第一个还没人用的颜色，没有时返回None"""
+    used_colors = {p['color'] for p in game['players']}
+    return next((c for c in COLORS if c not in used_colors), None)
+
+def apply_join(game, player_id, color, is_bot=False):
+    """玩家加入房间，调用前已校验过合法性"""
+    game['players'].append({'id': player_id, 'color': color, 'online': True, 'start_pos': None, 'bot': is_bot})
+
+def apply_start(game):
+    """开始游戏：按人数分配初始位置"""
+    size = game['size']
+    positions = start_positions(size, len(game['players']))
+    for idx, p in enumerate(game['players']):
+        p['start_pos'] = positions[idx]
+        p['pos'] = p['start_pos']
+        game['occupant'][p['pos'][1] * size + p['pos'][0]] = idx
+    game['status'] = 'playing'
+    game['current_turn'] = 0
+    game['message'] = '游戏开始！轮到玩家1行动。'
+
+def apply_move(game, target):
+    """当前玩家移动到target，调用前已校验过合法性"""
     player_idx = game['current_turn']
     player = game['players'][player_idx]
     start = player.get('pos') or player.get('start_pos')
-    valid, msg = is_valid_move(game, player_idx, start, tuple(target))
-    if not valid:
-        return jsonify({'error': msg}), 400
     # 记录历史
-    game['move_history'].append({'type': 'move', 'player': player_id, 'from': start, 'to': tuple(target)})
-    player['pos'] = tuple(target)
+    game['move_history'].append({'type': 'move', 'player': player['id'], 'from': start, 'to': target})
+    size = game['size']
+    game['occupant'][start[1] * size + start[0]] = -1
+    game['occupant'][target[1] * size + target[0]] = player_idx
+    player['pos'] = target
     # 检查是否被困
     if is_player_trapped(game, player_idx):
         player['trapped'] = True
     else:
         player['trapped'] = False
     game['message'] = f"玩家{player_idx+1}已移动，等待筑墙..."
-    return jsonify({'message': '移动成功，请筑墙', 'next': 'build'})
 
-@app.route('/api/build', methods=['POST'])
-def api_build():
-    board_id = request.args.get('board_id')
-    if not board_id or not board_id.isalnum() or len(board_id) != 8:
-        return jsonify({'error': '无效的房间id'}), 400
-    game = get_game(board_id)
-    if game['status'] != 'playing':
-        return jsonify({'error': '游戏未在进行中'}), 400
-    player_id = session.get(f'player_id_{board_id}')
-    if not player_id:
-        return jsonify({'error': '未识别玩家身份'}), 403
-    # 检查是否轮到该玩家
-    if game['players'][game['current_turn']]['id'] != player_id:
-        return jsonify({'error': '未轮到你行动'}), 403
-    data = request.get_json()
-    wall = data.get('wall')  # [x, y, direction]
-    if not (isinstance(wall, list) and len(wall) == 3):
-        return jsonify({'error': '无效的墙体参数'}), 400
-    pos = tuple(wall[:2])
-    direction = wall[2]
-    valid, msg = is_valid_wall(game, pos, direction)
-    if not valid:
-        return jsonify({'error': msg}), 400
+def apply_build(game, pos, direction):
+    """当前玩家筑墙，判断是否结束并切换回合，调用前已校验过合法性"""
+    player_id = game['players'][game['current_turn']]['id']
     # 记录历史
     game['move_history'].append({'type': 'build', 'player': player_id, 'wall': (pos, direction)})
     color_idx = game['players'][game['current_turn']]['color'] - 1
-    game['walls'].add((pos[0], pos[1], direction, color_idx))
-    # 检查是否封死所有人（简单判定：所有玩家都被困）
-    all_trapped = all(is_player_trapped(game, idx) for idx in range(len(game['players'])))
-    if all_trapped or all_players_isolated(game):
+    add_wall(game, pos[0], pos[1], direction, color_idx)
+    # 检查是否结束：所有玩家被分割在不同区域，或所有玩家都被困
+    isolated = all_players_isolated(game)
+    if isolated or all(is_player_trapped(game, idx) for idx in range(len(game['players']))):
         game['status'] = 'finished'
-        # 计分：每人可达区域格子数
+        # 计分：每人可达区域格子数。各自隔绝时就是所在区域的大小（不计自身）；
+        # 仅因全员被困而结束时区域里还有别人，仍按绕开其他玩家的BFS计算
+        regions = player_regions(game)
         scores = []
         for idx, p in enumerate(game['players']):
-            scores.append((idx, count_accessible_cells(game, p.get('pos'))))
+            if isolated:
+                scores.append((idx, game['region_sizes'][regions[idx]] - 1))
+            else:
+                scores.append((idx, count_accessible_cells(game, p.get('pos'))))
         max_score = max(s[1] for s in scores)
         winners = [s[0] for s in scores if s[1] == max_score]
         if len(winners) == 1:
@@ -321,44 +538,137 @@ def api_build():
                 game['message'] = f"游戏结束，平分，玩家{winners[0]+1}获胜！"
     else:
         # 切换回合
-        game['current_turn'] = (game['current_turn'] + 1) % len(game['players'])
+        game['current_turn'] = next_turn(game)
         game['message'] = f"玩家{game['current_turn']+1}行动"
-    return jsonify({'message': '筑墙成功', 'next': 'move'})
 
-@app.route('/api/reset', methods=['POST'])
-def api_reset():
-    board_id = request.args.get('board_id')
-    if not board_id or not board_id.isalnum() or len(board_id) != 8:
-        return jsonify({'error': '无效的房间id'}), 400
-    with GAMES_LOCK:
-        GAMES[board_id] = create_new_game()
-    return jsonify({'message': '房间已重置'})
+def next_turn(game):
+    """下一位行动的玩家：四面都是墙的玩家既不能移动也无处筑墙，跳过。
+    游戏未结束时总有其他玩家还能筑墙（否则各自都被围在单格里，已经全员隔绝）"""
+    size, blocked, players = game['size'], game['blocked'], game['players']
+    idx = game['current_turn']
+    for _ in range(len(players)):
+        idx = (idx + 1) % len(players)
+        if wall_slots(size, blocked, players[idx]['pos']):
+            break
+    return idx
+
+def replay_op(game, op):
+    """重放操作日志中的一条记录，修改与对应接口完全一致"""
+    kind = op[0]
+    if kind == 'join':
+        apply_join(game, *op[1:])
+    elif kind == 'start':
+        apply_start(game)
+    elif kind == 'move':
+        apply_move(game, op[1])
+    elif kind == 'build':
+        apply_build(game, op[1], op[2])
+    else:
+        raise ValueError(f'未知的操作记录: {op!r}')
 
 def count_accessible_cells(game, start):
     # 统计从start出发可达的空格数量
-    from collections import deque
-    visited = set()
-    q = deque([start])
+    size = game['size']
+    blocked, occupant = game['blocked'], game['occupant']
+    first = start[1] * size + start[0]
+    visited = {first}
+    q = deque([first])
     while q:
-        x, y = q.popleft()
-        if (x, y) in visited:
-            continue
-        visited.add((x, y))
-        for dx, dy in [(-1,0),(1,0),(0,-1),(0,1)]:
-            nx, ny = x+dx, y+dy
-            if 0 <= nx < BOARD_SIZE and 0 <= ny < BOARD_SIZE:
-                if is_blocked(game, x, y, nx, ny):
-                    continue
-                occupied = False
-                for p in game['players']:
-                    if p.get('pos') == (nx, ny):
-                        occupied = True
-                        break
-                if not occupied:
-                    q.append((nx, ny))
+        i = q.popleft()
+        for offset, bit in neighbor_offsets(size):
+            j = i + offset
+            if not blocked[i] & bit and occupant[j] == -1 and j not in visited:
+                visited.add(j)
+                q.append(j)
     return len(visited) - 1  # 不计自身
+def bot_turn_due(game):
+    return game['status'] == 'playing' and game['players'][game['current_turn']].get('bot', False)
+
+def new_bot_pool():
+    # 以spawn方式启动子进程，不从多线程的worker中fork
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+
+def bot_pool(board_id):
+    """同一房间总是交给同一个子进程，返回(序号, 进程池)"""
+    with BOT_LOCK:
+        if not BOT_POOLS:
+            BOT_POOLS.extend(new_bot_pool() for _ in range(max(1, BOT_PROCESSES)))
+        index = hash(board_id) % len(BOT_POOLS)
+        return index, BOT_POOLS[index]
+
+def replace_bot_pool(index, pool):
+    """子进程异常退出后进程池不可再用，换一个新的"""
+    with BOT_LOCK:
+        if BOT_POOLS[index] is pool:
+            BOT_POOLS[index] = new_bot_pool()
+    pool.shutdown(wait=False)
+
+def schedule_bot_turn(board_id):
+    """安排后台线程替轮到的机器人走一回合，同一房间同时只安排一次"""
+    with BOT_LOCK:
+        if board_id in BOT_PENDING:
+            return
+        BOT_PENDING.add(board_id)
+    BOT_THREADS.submit(run_bot_turn, board_id)
+
+def run_bot_turn(board_id):
+    try:
+        played = play_bot_turn(board_id)
+    finally:
+        with BOT_LOCK:
+            BOT_PENDING.discard(board_id)
+    # 下一位仍是机器人时接着走；没走成（如搜索超时）则等下次轮询gamestate再安排，避免空转
+    if played:
+        with STORE.reading(board_id):
+            game = STORE.get(board_id)
+            due = game is not None and bot_turn_due(game)
+        if due:
+            schedule_bot_turn(board_id)
+
+def play_bot_turn(board_id):
+    """快照局面后交给子进程搜索，期间不持有房间锁；搜索期间房间有变化（如被重置）时放弃。返回是否走了这一回合"""
+    with STORE.lock(board_id):
+        game = STORE.get(board_id)
+        if game is None or not bot_turn_due(game):
+            return False
+        version = game['version']
+        me = game['current_turn']
+        position = (game['size'], game['blocked'][:], game['occupant'][:], [p['pos'] for p in game['players']], me)
+    index, pool = bot_pool(board_id)
+    try:
+        action = pool.submit(bot.choose_action, *position, BOT_TIME_LIMIT).result(
+            timeout=BOT_TIME_LIMIT + BOT_RESULT_GRACE)
+    except BrokenProcessPool:
+        replace_bot_pool(index, pool)
+        return False
+    except FutureTimeoutError:
+        return False
+    with STORE.lock(board_id):
+        game = STORE.get(board_id)
+        if game is None or game['version'] != version:
+            return False
+        # 移动和筑墙都对照当前局面校验通过后再一起执行，不会只走半个回合
+        position = game['players'][me]['pos']
+        target = tuple(action['target']) if action['target'] is not None else None
+        if target is not None and (has_moved(game) or not is_valid_move(game, me, position, target)[0]):
+            return False
+        if action['wall'] is None:
+            return False
+        pos, direction = tuple(action['wall'][:2]), action['wall'][2]
+        if not is_valid_wall(game, target or position, pos, direction)[0]:
+            return False
+        if target is not None:
+            apply_move(game, target)
+            notify_game_changed(board_id, game, ('move', target))
+        apply_build(game, pos, direction)
+        notify_game_changed(board_id, game, ('build', pos, direction))
+        return True
+
 @app.route('/')
 def index():
     return render_template('index.html')
+# 异步服务模式的入口：gunicorn -k asgi app:asgi_app（见main.py的PLAYGROUND_SERVER_MODE）
+asgi_app = AsgiApp(app, LONG_POLL)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=35103, debug=True)
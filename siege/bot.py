@@ -0,0 +1,164 @@
+"""
+围城棋机器人：枚举“移动+筑墙”的组合动作，按领地估值选择
+
+choose_action在机器人子进程中运行（见app.py的bot_pool），不占用处理请求的线程，也不争抢其GIL。
+同一房间总是交给同一个子进程，估值缓存按墙体和各玩家位置做键，后续回合里重复出现的局面直接命中。
+
+估值（领地）：以所有玩家为起点同时做BFS（只受墙阻挡），每格归最先到达的玩家，同时到达的不计。
+被墙隔开的区域只有区域内的玩家能到达，因此封闭区域的大小自然计入领地，与终局计分一致。
+动作的分值 = 自己的领地 - 其他玩家中最大的领地。
+
+搜索分两层：先对全部动作做一层估值；时间允许时再对排名靠前的动作考虑下一位玩家的最佳应对，
+按应对后的局面重新估值（只要有一个动作完成了第二层，就只在完成第二层的动作中比较）。
+"""
+
+import time
+from collections import OrderedDict, deque
+
+from siege import rules
+
+EVAL_CACHE_MAX = 200000  # 估值缓存的条目上限，超出后淘汰最久未用的
+REFINE_WIDTH = 24        # 第二层最多展开多少个第一层排名靠前的动作
+TIME_CHECK_ACTIONS = 16  # 每估值多少个动作检查一次是否超时
+
+_EVAL_CACHE = OrderedDict()  # (size, 墙体, 各玩家位置) -> 各玩家领地
+
+
+class _Timeout(Exception):
+    pass
+
+
+def territory(size, blocked, positions):
+    """各玩家的领地格子数（多源BFS，同时到达的格子不计），结果按局面缓存"""
+    key = (size, tuple(blocked), tuple(positions))
+    cached = _EVAL_CACHE.get(key)
+    if cached is not None:
+        _EVAL_CACHE.move_to_end(key)
+        return cached
+    owner = [-1] * (size * size)  # 归属的玩家序号，-2为同时到达
+    dist = [-1] * (size * size)
+    queue = deque()
+    for idx, (x, y) in enumerate(positions):
+        i = y * size + x
+        owner[i], dist[i] = idx, 0
+        queue.append(i)
+    offsets = rules.neighbor_offsets(size)
+    while queue:
+        i = queue.popleft()
+        who, d = owner[i], dist[i] + 1
+        cell = blocked[i]
+        for offset, bit in offsets:
+            if cell & bit:
+                continue
+            j = i + offset
+            if dist[j] == -1:
+                dist[j], owner[j] = d, who
+                queue.append(j)
+            elif dist[j] == d and owner[j] != who:
+                owner[j] = -2
+    counts = [0] * len(positions)
+    for who in owner:
+        if who >= 0:
+            counts[who] += 1
+    result = tuple(counts)
+    _EVAL_CACHE[key] = result
+    if len(_EVAL_CACHE) > EVAL_CACHE_MAX:
+        _EVAL_CACHE.popitem(last=False)
+    return result
+
+
+def score_for(counts, me):
+    best_other = max((c for idx, c in enumerate(counts) if idx != me), default=0)
+    return counts[me] - best_other
+
+
+class Search:
+    def __init__(self, size, blocked, occupant, positions, deadline):
+        self.size = size
+        self.blocked = blocked
+        self.occupant = occupant
+        self.positions = positions
+        self.deadline = deadline
+        self.evaluated = 0
+
+    def check_time(self):
+        self.evaluated += 1
+        if self.evaluated % TIME_CHECK_ACTIONS == 0 and time.perf_counter() > self.deadline:
+            raise _Timeout()
+
+    def actions(self, blocked, occupant, positions, player):
+        """player的全部(落点, 墙)组合：无处可走时原地筑墙；墙只能筑在落点四周"""
+        pos = positions[player]
+        targets = rules.reachable_targets(self.size, blocked, occupant, pos, player) or [pos]
+        return [(target, direction) for target in targets
+                for direction in rules.wall_slots(self.size, blocked, target)]
+
+    def play(self, blocked, occupant, positions, player, action):
+        """返回执行动作后的(墙体, 占位, 位置)，不修改传入的局面"""
+        size = self.size
+        (x, y), direction = action
+        blocked = blocked[:]
+        rules.block_edge(blocked, size, x, y, direction)
+        occupant = occupant[:]
+        old_x, old_y = positions[player]
+        occupant[old_y * size + old_x] = -1
+        occupant[y * size + x] = player
+        positions = positions[:]
+        positions[player] = (x, y)
+        return blocked, occupant, positions
+
+    def reply_score(self, blocked, occupant, positions, me, opponent):
+        """opponent按自己的估值选最佳应对后，me的分值"""
+        best = None
+        for action in self.actions(blocked, occupant, positions, opponent):
+            self.check_time()
+            after_blocked, _, after_positions = self.play(blocked, occupant, positions, opponent, action)
+            counts = territory(self.size, after_blocked, after_positions)
+            theirs = score_for(counts, opponent)
+            if best is None or theirs > best[0]:
+                best = (theirs, score_for(counts, me))
+        return best[1] if best else None
+
+    def root(self, me):
+        """返回(动作, 分值, 完成的层数)，没有任何动作时返回(None, 0, 0)"""
+        scored = []
+        try:
+            for action in self.actions(self.blocked, self.occupant, self.positions, me):
+                self.check_time()
+                blocked, _, positions = self.play(self.blocked, self.occupant, self.positions, me, action)
+                scored.append((score_for(territory(self.size, blocked, positions), me), action))
+        except _Timeout:
+            pass
+        if not scored:
+            return None, 0, 0
+        scored.sort(key=lambda s: s[0], reverse=True)
+        opponent = (me + 1) % len(self.positions)
+        refined = []
+        if opponent != me:
+            try:
+                for _, action in scored[:REFINE_WIDTH]:
+                    after = self.play(self.blocked, self.occupant, self.positions, me, action)
+                    score = self.reply_score(*after, me, opponent)
+                    if score is not None:
+                        refined.append((score, action))
+            except _Timeout:
+                pass
+        if refined:
+            refined.sort(key=lambda s: s[0], reverse=True)
+            return refined[0][1], refined[0][0], 2
+        return scored[0][1], scored[0][0], 1
+
+
+def choose_action(size, blocked, occupant, positions, me, time_limit):
+    """为第me名玩家选一个动作，返回 {'target', 'wall', 'score', 'depth', 'evaluated'}；
+    target为None表示原地不动，wall为None表示四面都是墙（这样的玩家会被跳过，不会轮到）
+    """
+    positions = [tuple(p) for p in positions]
+    search = Search(size, list(blocked), list(occupant), positions, time.perf_counter() + time_limit)
+    action, score, depth = search.root(me)
+    if action is None:
+        return {'target': None, 'wall': None, 'score': 0, 'depth': 0, 'evaluated': search.evaluated}
+    (x, y), direction = action
+    target = None if (x, y) == positions[me] else [x, y]
+    return {'target': target, 'wall': [x, y, direction], 'score': score, 'depth': depth,
+            'evaluated': search.evaluated}
@@ -0,0 +1,64 @@
+"""
+围城棋的棋盘规则：边掩码、可达落点和可筑墙位置
+
+app.py校验请求、bot.py在子进程中搜索都用这里的函数，二者对合法性的判断一致。
+墙体按格存成边掩码：blocked[y*size+x]的4位分别表示该格上下左右是否不可通过。
+一面墙同时记在两侧的格子上，棋盘边缘在新建房间时就标为不可通过，判断相邻两格是否连通只需一次按位与。
+"""
+
+from functools import lru_cache
+
+WALL_BITS = {'up': 1, 'down': 2, 'left': 4, 'right': 8}
+OPPOSITE = {'up': 'down', 'down': 'up', 'left': 'right', 'right': 'left'}
+STEPS = {'up': (0, -1), 'down': (0, 1), 'left': (-1, 0), 'right': (1, 0)}
+STEP_BITS = [(dx, dy, WALL_BITS[d]) for d, (dx, dy) in STEPS.items()]
+STEP_TO_BIT = {(dx, dy): bit for dx, dy, bit in STEP_BITS}
+MAX_STEPS = 3  # 每次直线移动1~3格
+
+
+def new_blocked(size):
+    """只有棋盘边缘不可通过的边掩码"""
+    blocked = [0] * (size * size)
+    for i in range(size):
+        blocked[i] |= WALL_BITS['up']
+        blocked[(size - 1) * size + i] |= WALL_BITS['down']
+        blocked[i * size] |= WALL_BITS['left']
+        blocked[i * size + size - 1] |= WALL_BITS['right']
+    return blocked
+
+
+@lru_cache(maxsize=None)
+def neighbor_offsets(size):
+    """边长为size时四个方向在一维下标上的偏移 [(偏移, 边掩码位)]"""
+    return [(dy * size + dx, bit) for dx, dy, bit in STEP_BITS]
+
+
+def block_edge(blocked, size, x, y, direction):
+    """在(x, y)的direction一侧筑墙，返回墙两侧格子的一维下标"""
+    dx, dy = STEPS[direction]
+    a, b = y * size + x, (y + dy) * size + x + dx
+    blocked[a] |= WALL_BITS[direction]
+    blocked[b] |= WALL_BITS[OPPOSITE[direction]]
+    return a, b
+
+
+def reachable_targets(size, blocked, occupant, pos, player_idx):
+    """从pos沿直线走1~3格能到达的落点，不能穿墙，也不能穿过或停在其他玩家所在的格子"""
+    targets = []
+    x, y = pos
+    for dx, dy, bit in STEP_BITS:
+        i = y * size + x
+        for step in range(1, MAX_STEPS + 1):
+            if blocked[i] & bit:
+                break
+            i += dy * size + dx
+            if occupant[i] not in (-1, player_idx):
+                break
+            targets.append((x + dx * step, y + dy * step))
+    return targets
+
+
+def wall_slots(size, blocked, pos):
+    """pos四周还能筑墙的方向（已有墙和棋盘边缘除外）"""
+    cell = blocked[pos[1] * size + pos[0]]
+    return [direction for direction, bit in WALL_BITS.items() if not cell & bit]
@@ -1,30 +1,24 @@
-const BOARD_SIZE = 5;
-const COLORS = ['#222', '#e74c3c', '#3498db', '#27ae60', '#f1c40f'];
+let BOARD_SIZE = 5;  // 以gamestate中的size为准
+const COLORS = ['#222', '#e74c3c', '#3498db', '#27ae60', '#f1c40f', '#8e44ad', '#e67e22', '#16a085', '#7f8c8d'];
 
 const board = document.getElementById('game-board');
 const statusBox = document.getElementById('status-box');
 const playersList = document.getElementById('players-list');
 const joinBtn = document.getElementById('join-btn');
 const startBtn = document.getElementById('start-btn');
+const botBtn = document.getElementById('bot-btn');
 const moveBtn = document.getElementById('move-btn');
 const buildBtn = document.getElementById('build-btn');
 const resetBtn = document.getElementById('reset-btn');
+const sizeSelect = document.getElementById('size-select');
 const helpBtn = document.getElementById('help-btn');
 
 let gameState = {};
 let myPlayerId = null;
 let myColorIdx = null;
 let myIdx = null;
-let selectedMove = null;
-let selectedWall = null;
-let movePath = null; // [{x, y}]
-let moveCount = 0;
-
-function resetMoveState() {
-    movePath = null;
-    moveCount = 0;
-    window._siege_moved = null;
-}
+let stateVersion = null;
+let legalActions = null;  // 轮到自己时从服务器取的合法动作，version与gameState一致时才使用
 
 function getBoardId() {
     const url = new URL(window.location.href);
@@ -37,11 +31,13 @@ function getBoardId() {
     }
     return boardId;
 }
+// 挂在路径前缀下运行时（见game_host.py）由页面给出前缀，接口地址都以它开头
+const API_ROOT = window.API_ROOT || '';
 const BOARD_ID = getBoardId();
 if (!BOARD_ID) throw new Error('board_id未初始化');
 
 async function apiFetch(url, options={}) {
-    const u = new URL(url, window.location.origin);
+    const u = new URL(API_ROOT + url, window.location.origin);
     u.searchParams.set('board_id', BOARD_ID);
     return fetch(u.toString(), options);
 }
@@ -51,7 +47,7 @@ function renderPlayers() {
     playersList.innerHTML = '<b>玩家列表</b><br>';
     gameState.players.forEach((p, idx) => {
         const color = COLORS[(p.color-1)%COLORS.length];
-        const me = (myPlayerId && p.id === myPlayerId) ? '（你）' : '';
+        const me = (myPlayerId && p.id === myPlayerId) ? '（你）' : (p.bot ? '（机器人）' : '');
         playersList.innerHTML += `<div style="margin:4px 0;"><span style="display:inline-block;width:16px;height:16px;border-radius:50%;background:${color};margin-right:6px;"></span>玩家${idx+1}${me}</div>`;
     });
 }
@@ -134,57 +130,28 @@ function renderBoard() {
             board.appendChild(wallLine);
         });
     }
-    // 交互逻辑
-    if (gameState.status === 'playing' && myIdx === gameState.current_turn) {
+    // 交互逻辑：只高亮服务器给出的合法动作（/api/legal_actions），不在本地重复判断墙体和占位
+    if (legalActions && legalActions.your_turn && legalActions.version === gameState.version) {
         const me = gameState.players[myIdx];
-        let curPos = me.pos || me.start_pos;
-        let path = movePath || [curPos];
-        let steps = path.length - 1;
-        // 1. 可继续移动点
-        if (steps < 3) {
-            for (let dir of [[0,1],[0,-1],[1,0],[-1,0]]) {
-                const [dx, dy] = dir;
-                const last = path[path.length-1];
-                const tx = last[0]+dx, ty = last[1]+dy;
-                if (tx < 0 || tx >= BOARD_SIZE || ty < 0 || ty >= BOARD_SIZE) continue;
-                // 检查是否已在路径中（不允许回头）
-                if (path.some(([px,py])=>px===tx&&py===ty)) continue;
-                // 检查是否有其他玩家
-                let occupied = false;
-                gameState.players.forEach((p, idx) => {
-                    if (idx !== myIdx && p.pos && p.pos[0]===tx && p.pos[1]===ty) occupied = true;
-                });
-                if (occupied) continue;
-                // 检查墙体
-                if (isBlocked(gameState, last[0], last[1], tx, ty)) continue;
-                // 可移动点
-                const moveCircle = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
-                moveCircle.setAttribute('cx', margin + tx*cellSize + cellSize/2);
-                moveCircle.setAttribute('cy', margin + ty*cellSize + cellSize/2);
-                moveCircle.setAttribute('r', 12);
-                moveCircle.setAttribute('fill', '#fff');
-                moveCircle.setAttribute('opacity', 0.01);
-                moveCircle.style.cursor = 'pointer';
-                moveCircle.addEventListener('mouseenter', ()=>{moveCircle.setAttribute('opacity',0.25);});
-                moveCircle.addEventListener('mouseleave', ()=>{moveCircle.setAttribute('opacity',0.01);});
-                moveCircle.addEventListener('click', async ()=>{
-                    await onMove([tx, ty]);
-                });
-                board.appendChild(moveCircle);
-            }
-        }
-        // 2. 可筑墙边
-        if (steps >= 1) {
-            const last = path[path.length-1];
-            const dirs = [
-                {dir:'up',    x:last[0], y:last[1]},
-                {dir:'down',  x:last[0], y:last[1]},
-                {dir:'left',  x:last[0], y:last[1]},
-                {dir:'right', x:last[0], y:last[1]}
-            ];
-            dirs.forEach(({dir, x, y}) => {
-                if ((dir==='up'&&y===0)||(dir==='down'&&y===BOARD_SIZE-1)||(dir==='left'&&x===0)||(dir==='right'&&x===BOARD_SIZE-1)) return;
-                if (gameState.walls.some(w => w[0]===x && w[1]===y && w[2]===dir)) return;
+        // 1. 可移动到的落点（直线1~3格）
+        legalActions.targets.forEach(([tx, ty]) => {
+            const moveCircle = document.createElementNS('http://www.w3.org/2000/svg', 'circle');
+            moveCircle.setAttribute('cx', margin + tx*cellSize + cellSize/2);
+            moveCircle.setAttribute('cy', margin + ty*cellSize + cellSize/2);
+            moveCircle.setAttribute('r', 12);
+            moveCircle.setAttribute('fill', COLORS[me.color-1]);
+            moveCircle.setAttribute('opacity', 0.18);
+            moveCircle.style.cursor = 'pointer';
+            moveCircle.addEventListener('mouseenter', ()=>{moveCircle.setAttribute('opacity',0.5);});
+            moveCircle.addEventListener('mouseleave', ()=>{moveCircle.setAttribute('opacity',0.18);});
+            moveCircle.addEventListener('click', async ()=>{
+                await onMove([tx, ty]);
+            });
+            board.appendChild(moveCircle);
+        });
+        // 2. 可筑墙边：移动后（或无处可走时）才能筑墙
+        if (legalActions.moved || legalActions.targets.length === 0) {
+            legalActions.walls.forEach(([x, y, dir]) => {
                 const wallLine = document.createElementNS('http://www.w3.org/2000/svg', 'line');
                 if (dir==='up'||dir==='down') {
                     wallLine.setAttribute('x1', margin+x*cellSize);
@@ -213,30 +180,17 @@ function renderBoard() {
     }
 }
 
-function isBlocked(gameState, x0, y0, x1, y1) {
-    if (Math.abs(x0-x1)+Math.abs(y0-y1) !== 1) return true;
-    for (const w of gameState.walls) {
-        if (x0 === x1) {
-            if (y1 > y0 && ((w[0]===x0&&w[1]===y0&&w[2]==='down')||(w[0]===x1&&w[1]===y1&&w[2]==='up'))) return true;
-            if (y1 < y0 && ((w[0]===x0&&w[1]===y0&&w[2]==='up')||(w[0]===x1&&w[1]===y1&&w[2]==='down'))) return true;
-        } else if (y0 === y1) {
-            if (x1 > x0 && ((w[0]===x0&&w[1]===y0&&w[2]==='right')||(w[0]===x1&&w[1]===y1&&w[2]==='left'))) return true;
-            if (x1 < x0 && ((w[0]===x0&&w[1]===y0&&w[2]==='left')||(w[0]===x1&&w[1]===y1&&w[2]==='right'))) return true;
-        }
-    }
-    return false;
-}
-
 function updateUI() {
     renderPlayers();
     renderBoard();
     // 状态栏
-    if (gameState.status === 'playing' && myIdx === gameState.current_turn) {
-        let steps = movePath ? movePath.length-1 : 0;
-        if (steps < 3) {
-            statusBox.textContent = `已移动${steps}步，请移动并筑墙`;
+    if (legalActions && legalActions.your_turn && legalActions.version === gameState.version) {
+        if (legalActions.moved) {
+            statusBox.textContent = '已移动，请在落点四周筑墙';
+        } else if (legalActions.targets.length === 0) {
+            statusBox.textContent = '无处可走，请直接筑墙';
         } else {
-            statusBox.textContent = `已移动3步，请筑墙`;
+            statusBox.textContent = '请点击高亮的格子移动（直线1~3格）';
         }
     } else {
         statusBox.textContent = gameState.message || '';
@@ -244,6 +198,7 @@ function updateUI() {
     // 按钮状态
     // joinBtn.disabled = !!myPlayerId; // 移除joinBtn相关逻辑
     startBtn.disabled = !myPlayerId || gameState.status !== 'waiting';
+    botBtn.disabled = gameState.status !== 'waiting';
     // moveBtn.disabled = true; // 移除moveBtn相关逻辑
     // buildBtn.disabled = true; // 移除buildBtn相关逻辑
     // if (gameState.status === 'playing' && myIdx === gameState.current_turn) {
@@ -256,10 +211,23 @@ function updateUI() {
 
 async function fetchGameState() {
     try {
-        const response = await apiFetch('/api/gamestate');
+        // 带上已知版本号，房间未变化时服务器只返回简短的unchanged响应
+        const url = stateVersion === null ? '/api/gamestate' : `/api/gamestate?since_version=${stateVersion}`;
+        const response = await apiFetch(url);
         if (response.ok) {
             const data = await response.json();
+            if (data.unchanged) {
+                await fetchLegalActions();
+                updateUI();
+                return;
+            }
             gameState = data;
+            stateVersion = data.version;
+            if (data.size && data.size !== BOARD_SIZE) {
+                // 房间被别人以其他大小重置：同步下拉框，平时不覆盖用户的选择
+                BOARD_SIZE = data.size;
+                sizeSelect.value = String(BOARD_SIZE);
+            }
             // 识别自己
             myPlayerId = localStorage.getItem('siege_player_id_'+BOARD_ID) || null;
             myIdx = null;
@@ -276,6 +244,8 @@ async function fetchGameState() {
                 if (resp2.ok) {
                     const data2 = await resp2.json();
                     gameState = data2;
+                    stateVersion = data2.version;
+                    BOARD_SIZE = data2.size || BOARD_SIZE;
                     myPlayerId = localStorage.getItem('siege_player_id_'+BOARD_ID) || null;
                     myIdx = null;
                     if (gameState.players) {
@@ -285,11 +255,23 @@ async function fetchGameState() {
                     }
                 }
             }
+            await fetchLegalActions();
             updateUI();
         }
     } catch (e) { console.error(e); }
 }
 
+async function fetchLegalActions() {
+    // 只在轮到自己时取，同一版本只取一次
+    if (gameState.status !== 'playing' || myIdx !== gameState.current_turn) {
+        legalActions = null;
+        return;
+    }
+    if (legalActions && legalActions.version === gameState.version) return;
+    const response = await apiFetch('/api/legal_actions');
+    if (response.ok) legalActions = await response.json();
+}
+
 async function autoJoin() {
     const response = await apiFetch('/api/join', {method:'POST'});
     const data = await response.json();
@@ -310,8 +292,16 @@ startBtn.onclick = async () => {
     await fetchGameState();
 };
 
+botBtn.onclick = async () => {
+    const response = await apiFetch('/api/add_bot', {method:'POST'});
+    const data = await response.json();
+    if (data.error) alert('添加机器人失败：'+data.error);
+    await fetchGameState();
+};
+
 resetBtn.onclick = async () => {
-    await apiFetch('/api/reset', {method:'POST'});
+    const size = parseInt(sizeSelect.value, 10);
+    await apiFetch('/api/reset', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({size})});
     localStorage.removeItem('siege_player_id_'+BOARD_ID);
     myPlayerId = null;
     await autoJoin();
@@ -320,25 +310,16 @@ resetBtn.onclick = async () => {
 
 async function onMove(target) {
     if (!myPlayerId || myIdx !== gameState.current_turn) return;
-    if (!movePath) movePath = [gameState.players[myIdx].pos || gameState.players[myIdx].start_pos];
-    // 只允许一步
-    if (movePath.length > 0 && (Math.abs(target[0]-movePath[movePath.length-1][0]) + Math.abs(target[1]-movePath[movePath.length-1][1]) !== 1)) return;
-    movePath.push(target);
     const response = await apiFetch('/api/move', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({target})});
     const data = await response.json();
     if (data.error) {
         alert('移动失败：'+data.error);
-        resetMoveState();
-        await fetchGameState();
-        return;
     }
-    // 不自动进入筑墙，允许继续移动
     await fetchGameState();
 }
 
 async function onBuild(wall) {
     if (!myPlayerId || myIdx !== gameState.current_turn) return;
-    resetMoveState();
     const response = await apiFetch('/api/build', {method:'POST', headers:{'Content-Type':'application/json'}, body:JSON.stringify({wall})});
     const data = await response.json();
     if (data.error) {
@@ -358,7 +339,7 @@ helpBtn.onclick = () => {
         <h2 style="text-align:center;margin-top:0;font-size:1.3em;">围城棋玩法说明</h2>
         <div style="max-height:60vh;overflow:auto;">
           <ol style="padding-left:1.2em;">
-            <li>2~5人游戏，每人分配不同颜色和固定初始点。</li>
+            <li>1~9人游戏，每人分配不同颜色和固定初始点（先占四角，再占中心和各边中点）。</li>
             <li>每回合分两步：<b>移动</b>（直线1~3格，不能穿墙/越子/原地不动），<b>筑墙</b>（在落点四周放一堵墙）。</li>
             <li>墙体不能重复、不能封死所有玩家最后一条出路。</li>
             <li>当所有玩家被完全隔绝或无法行动时，游戏结束。</li>
@@ -366,9 +347,9 @@ helpBtn.onclick = () => {
           </ol>
           <div style="margin:12px 0 0 0;">操作说明：</div>
           <ul style="line-height:1.7;font-size:1em;">
-            <li>点击“加入房间”后等待其他玩家，房主可点击“开始游戏”。</li>
-            <li>轮到你时，点击棋盘高亮点进行移动，随后输入墙体方向（up/down/left/right）筑墙。</li>
-            <li>点击“重置”可重新开始。</li>
+            <li>点击“加入房间”后等待其他玩家，房主可点击“开始游戏”；人数不够时可点击“添加机器人”补位。</li>
+            <li>轮到你时，点击棋盘上高亮的格子移动，再点击落点四周高亮的边筑墙。</li>
+            <li>点击“重置”可重新开始，重置前可选择棋盘大小（5×5~25×25）。</li>
           </ul>
         </div>
       </div>
@@ -376,7 +357,5 @@ helpBtn.onclick = () => {
     document.body.appendChild(helpDiv);
 };
 
-// 页面切换/回合切换时重置movePath
-window.addEventListener('DOMContentLoaded', () => { resetMoveState(); });
-setInterval(()=>{ resetMoveState(); fetchGameState(); }, 2000);
+setInterval(fetchGameState, 2000);
 fetchGameState(); 
\ No newline at end of file
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+测试围城棋的墙体、区域划分、合法动作、长轮询、棋盘大小和机器人
+"""
+
+import asyncio
+import json
+import time
+
+from siege import app as siege_app
+from siege import bot, rules
+
+BOARD_ID = "Siege123"
+
+
+def new_room(players=2, size=None, board_id=BOARD_ID):
+    """重置房间、加入players名玩家并开始游戏，返回各玩家的客户端"""
+    clients = [siege_app.app.test_client() for _ in range(players)]
+    clients[0].post(f"/api/reset?board_id={board_id}", json={"size": size} if size else None)
+    for client in clients:
+        client.post(f"/api/join?board_id={board_id}")
+    clients[0].post(f"/api/start_game?board_id={board_id}")
+    return clients
+
+
+def move(client, target, board_id=BOARD_ID):
+    return client.post(f"/api/move?board_id={board_id}", json={"target": target})
+
+
+def build(client, wall, board_id=BOARD_ID):
+    return client.post(f"/api/build?board_id={board_id}", json={"wall": wall})
+
+
+def test_walls_block_movement_from_both_sides():
+    first, second, third = new_room(players=3)
+    assert move(first, [2, 0]).status_code == 200
+    assert build(first, [2, 0, "right"]).status_code == 200
+    assert move(second, [3, 0]).status_code == 200
+    # 同一面墙从另一侧再筑一次
+    response = build(second, [3, 0, "left"])
+    assert response.status_code == 400 and response.get_json()["error"] == "该位置已有墙体"
+    assert build(second, [3, 0, "diagonal"]).status_code == 400
+    assert build(second, [3, 0, ["down"]]).status_code == 400
+    assert build(second, [3, 0, {"down": 1}]).status_code == 400
+    assert build(second, [3.0, 0, "down"]).status_code == 400
+    assert build(second, [3, 0, "up"]).status_code == 400
+    # 只能在自己所在格子的四周筑墙
+    response = build(second, [0, 4, "up"])
+    assert response.status_code == 400 and response.get_json()["error"] == "只能在自己所在格子的四周筑墙"
+    assert build(second, [3, 0, "down"]).status_code == 200
+    assert move(third, [2, 3]).status_code == 200
+    assert build(third, [2, 3, "up"]).status_code == 200
+    for target in ([1.0, 0], [1, "0"], [True, 0]):
+        assert move(first, target).status_code == 400
+    response = move(first, [4, 0])
+    assert response.status_code == 400 and response.get_json()["error"] == "路径被墙体阻挡"
+
+
+def test_game_ends_when_players_are_walled_apart():
+    first, second = new_room()
+    # 玩家1把自己围在左上角的2格里，直到最后一面墙之前游戏都在进行
+    for player, target, wall in [(first, [0, 1], [0, 1, "right"]), (second, [4, 3], [4, 3, "left"]),
+                                 (first, [0, 0], [0, 0, "right"]), (second, [4, 2], [4, 2, "left"])]:
+        assert move(player, target).status_code == 200
+        assert build(player, wall).status_code == 200
+        assert first.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["status"] == "playing"
+    assert move(first, [0, 1]).status_code == 200
+    assert build(first, [0, 1, "down"]).status_code == 200
+    state = first.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert state["status"] == "finished" and state["winner"] == 1
+    game = siege_app.get_game(BOARD_ID)
+    regions = siege_app.player_regions(game)
+    assert [game["region_sizes"][r] for r in regions] == [2, 23]
+
+
+def test_enclosed_player_is_skipped():
+    first, second, third = new_room(players=3)
+    # 玩家1留在角上，两面墙后四面都是墙，之后的回合跳过该玩家
+    assert build(first, [0, 0, "right"]).status_code == 200
+    assert move(second, [4, 1]).status_code == 200
+    assert build(second, [4, 1, "down"]).status_code == 200
+    assert move(third, [2, 3]).status_code == 200
+    assert build(third, [2, 3, "up"]).status_code == 200
+    assert build(first, [0, 0, "down"]).status_code == 200
+    state = first.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert state["status"] == "playing" and state["current_turn"] == 1
+    assert move(second, [4, 0]).status_code == 200
+    assert build(second, [4, 0, "left"]).status_code == 200
+    assert first.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["current_turn"] == 2
+    assert move(third, [1, 3]).status_code == 200
+    assert build(third, [1, 3, "up"]).status_code == 200
+    assert first.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["current_turn"] == 1
+
+
+def test_legal_actions_match_move_and_build():
+    first, second = new_room()
+    actions = first.get(f"/api/legal_actions?board_id={BOARD_ID}").get_json()
+    assert actions["your_turn"] and actions["player"] == 0 and not actions["moved"]
+    assert sorted(map(tuple, actions["targets"])) == [(0, 1), (0, 2), (0, 3), (1, 0), (2, 0), (3, 0)]
+    assert sorted(actions["walls"]) == [[0, 0, "down"], [0, 0, "right"]]
+    assert second.get(f"/api/legal_actions?board_id={BOARD_ID}").get_json()["your_turn"] is False
+    for target in actions["targets"]:
+        game = siege_app.get_game(BOARD_ID)
+        assert siege_app.is_valid_move(game, 0, (0, 0), tuple(target))[0]
+
+    assert move(first, [0, 3]).status_code == 200
+    actions = first.get(f"/api/legal_actions?board_id={BOARD_ID}").get_json()
+    assert actions["moved"] and actions["targets"] == []
+    assert move(first, [0, 4]).status_code == 400  # 每回合只能移动一次
+    assert build(first, actions["walls"][0]).status_code == 200
+    actions = second.get(f"/api/legal_actions?board_id={BOARD_ID}").get_json()
+    assert actions["your_turn"] and actions["player"] == 1 and actions["targets"]
+
+
+async def asgi_get(path, query):
+    """直接调用asgi_app发送一个GET请求，返回(状态码, JSON)"""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+             'headers': [], 'http_version': '1.1', 'scheme': 'http', 'root_path': ''}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await siege_app.asgi_app(scope, receive, send)
+    return messages[0]['status'], json.loads(b''.join(m.get('body', b'') for m in messages[1:]))
+
+
+def test_long_poll_waits_for_next_version():
+    first, _ = new_room()
+    version = first.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["version"]
+    query = f"board_id={BOARD_ID}&since_version={version}&wait=10"
+
+    async def main():
+        started = time.time()
+        poll = asyncio.ensure_future(asgi_get("/api/gamestate", query))
+        await asyncio.sleep(0.2)
+        assert not poll.done() and siege_app.LONG_POLL.waiting() == 1
+        assert (await asyncio.to_thread(move, first, [0, 1])).status_code == 200
+        status, state = await poll
+        assert status == 200 and state["version"] == version + 1 and time.time() - started < 5
+        # 超时仍无变化时返回unchanged
+        status, state = await asgi_get("/api/gamestate", f"board_id={BOARD_ID}&since_version={version + 1}&wait=0.2")
+        assert state == {"unchanged": True, "version": version + 1}
+        assert siege_app.LONG_POLL.waiting() == 0
+        # 不合法的房间id不进入长轮询，也不读存储，由路由直接返回400
+        status, state = await asgi_get("/api/gamestate", "board_id=../../x&since_version=0&wait=10")
+        assert status == 400 and state["error"] == "无效的房间id"
+
+    asyncio.run(main())
+
+
+def test_board_size_and_start_positions():
+    clients = new_room(players=9, size=25)
+    state = clients[0].get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert state["size"] == 25 and state["status"] == "playing"
+    positions = [tuple(p["pos"]) for p in state["players"]]
+    assert len(set(positions)) == 9 and (12, 12) in positions
+    assert siege_app.start_positions(5, 5) == [(0, 0), (4, 0), (0, 4), (4, 4), (2, 2)]
+    assert clients[0].post(f"/api/reset?board_id={BOARD_ID}", json={"size": 26}).status_code == 400
+    # 不指定大小时沿用原房间的大小
+    clients[0].post(f"/api/reset?board_id={BOARD_ID}")
+    assert clients[0].get(f"/api/gamestate?board_id={BOARD_ID}").get_json()["size"] == 25
+
+
+def test_bot_action_is_legal():
+    size = 7
+    positions = siege_app.start_positions(size, 3)
+    occupant = [-1] * (size * size)
+    for idx, (x, y) in enumerate(positions):
+        occupant[y * size + x] = idx
+    blocked = rules.new_blocked(size)
+    action = bot.choose_action(size, blocked, occupant, positions, 1, 0.2)
+    target = tuple(action["target"])
+    assert target in rules.reachable_targets(size, blocked, occupant, positions[1], 1)
+    assert action["wall"][:2] == list(target)
+    assert action["wall"][2] in rules.wall_slots(size, blocked, target)
+
+
+def test_bot_turn_is_validated_before_it_is_applied(monkeypatch):
+    from concurrent.futures import Future
+
+    actions = []
+
+    class FixedPool:
+        """代替搜索子进程，按顺序返回预先给定的动作"""
+        def submit(self, *args):
+            future = Future()
+            future.set_result(actions.pop(0))
+            return future
+
+    monkeypatch.setattr(siege_app, "schedule_bot_turn", lambda board_id: None)
+    monkeypatch.setattr(siege_app, "bot_pool", lambda board_id: (0, FixedPool()))
+    client = siege_app.app.test_client()
+    client.post(f"/api/reset?board_id={BOARD_ID}")
+    client.post(f"/api/add_bot?board_id={BOARD_ID}")
+    client.post(f"/api/join?board_id={BOARD_ID}")
+    client.post(f"/api/start_game?board_id={BOARD_ID}")
+    before = client.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    # 落点合法但墙不在落点四周：整个回合都不执行，机器人留在原地
+    actions.append({"target": [0, 1], "wall": [0, 0, "right"]})
+    assert siege_app.play_bot_turn(BOARD_ID) is False
+    assert client.get(f"/api/gamestate?board_id={BOARD_ID}").get_json() == before
+    actions.append({"target": [0, 1], "wall": [0, 1, "right"]})
+    assert siege_app.play_bot_turn(BOARD_ID) is True
+    state = client.get(f"/api/gamestate?board_id={BOARD_ID}").get_json()
+    assert state["players"][0]["pos"] == [0, 1] and state["current_turn"] == 1
+    assert state["version"] == before["version"] + 2
+
+
+def test_bots_play_a_full_game():
+    board_id = "SiegeBot"
+    client = siege_app.app.test_client()
+    client.post(f"/api/reset?board_id={board_id}")
+    for _ in range(3):
+        assert client.post(f"/api/add_bot?board_id={board_id}").status_code == 200
+    client.post(f"/api/start_game?board_id={board_id}")
+    deadline = time.time() + 60
+    state = None
+    while time.time() < deadline:
+        state = client.get(f"/api/gamestate?board_id={board_id}").get_json()
+        if state["status"] == "finished":
+            break
+        time.sleep(0.05)
+    assert state["status"] == "finished"
+    assert all(p["bot"] for p in state["players"]) and state["walls"]
+    assert client.post(f"/api/add_bot?board_id={board_id}").status_code == 403
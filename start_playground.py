@@ -23,7 +23,9 @@ def main():
     cmd = [
         sys.executable, '-m', 'gunicorn',
         '--bind', '0.0.0.0:35100',
-        '--workers', '1',
+        '--workers', '1',  # 游戏服务器由主页进程内的监管器管理，只能有一个worker
+        '--worker-class', 'gthread',
+        '--threads', '16',  # 主页的状态推送（SSE）每条连接占一个线程
         '--timeout', '120',
         '--access-logfile', '-',
         '--error-logfile', '-',
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+游戏服务器进程的监管：所有子进程由后台线程中的一个asyncio事件循环统一管理
+
+- start/stop/restart只把命令投递给事件循环，立即返回；状态变化经on_change(name, status)回调通知
+  （main.py借此推送给主页）。同一服务器的命令按投递顺序逐个执行
+- 就绪检查：启动后轮询健康检查地址，间隔从READY_POLL_MIN起每次翻倍，最长READY_POLL_MAX；
+  READY_DEADLINE秒内仍未就绪则判为error并终止进程
+- 崩溃重启：进程意外退出后自动重启，等待时间从RESTART_DELAY_MIN起按连续崩溃次数翻倍；
+  CRASH_WINDOW秒内崩溃达到CRASH_LIMIT次则不再重启，状态为error，需手动启动
+- 停止：子进程在独立的会话（进程组）中启动，向整个进程组发SIGTERM，STOP_TIMEOUT秒后仍未退出则发SIGKILL；
+  gunicorn的worker和AI子进程都在同一进程组中，一并结束，不必再按端口查找进程
+
+状态：stopped / starting / running / stopping / error
+"""
+
+import asyncio
+import os
+import signal
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+READY_POLL_MIN = 0.1     # 秒，就绪检查的初始间隔
+READY_POLL_MAX = 2.0     # 秒，就绪检查的最长间隔
+READY_DEADLINE = 30      # 秒，启动后多久仍未就绪判为失败
+PROBE_TIMEOUT = 2        # 秒，单次健康检查的超时
+STOP_TIMEOUT = 5         # 秒，SIGTERM之后等待多久改发SIGKILL
+RESTART_DELAY_MIN = 0.5  # 秒，崩溃后第一次重启前的等待时间
+RESTART_DELAY_MAX = 30   # 秒，崩溃重启等待时间的上限
+CRASH_WINDOW = 60        # 秒，统计崩溃次数的时间窗口
+CRASH_LIMIT = 5          # 窗口内崩溃达到此次数则不再自动重启
+
+
+class Server:
+    """一个受监管的服务器进程；字段只在事件循环中修改"""
+
+    def __init__(self, name, cmd, cwd, env, health_url):
+        self.name = name
+        self.cmd = cmd
+        self.cwd = cwd
+        self.env = env
+        self.health_url = health_url
+        self.status = 'stopped'
+        self.process = None
+        self.wanted = False      # 是否应当保持运行，意外退出时据此决定是否重启
+        self.crashes = deque()   # 最近的崩溃时间
+        self.lock = None         # 串行执行同一服务器的命令，在事件循环中创建
+
+
+async def probe(url):
+    """GET健康检查地址，返回是否为200"""
+    parts = urlsplit(url)
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, parts.port or 80), PROBE_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        writer.write(f'GET {parts.path or "/"} HTTP/1.0\r\nHost: {parts.netloc}\r\n\r\n'.encode('latin-1'))
+        status_line = await asyncio.wait_for(reader.readline(), PROBE_TIMEOUT)
+        return status_line.split()[1:2] == [b'200']
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+def signal_group(process, sig):
+    """向进程所在的进程组发信号；进程以start_new_session启动，进程组号即其pid"""
+    try:
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class Supervisor:
+    def __init__(self, on_change=None):
+        self.servers = {}
+        self._on_change = on_change
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def add(self, name, cmd, cwd, env, health_url):
+        """登记一个服务器（不启动）"""
+        self.servers[name] = Server(name, cmd, cwd, env, health_url)
+
+    def status(self, name):
+        return self.servers[name].status
+
+    def start(self, name):
+        self._submit(self._command(name, self._start))
+
+    def stop(self, name):
+        self._submit(self._command(name, self._stop))
+
+    def restart(self, name):
+        self._submit(self._command(name, self._restart))
+
+    def shutdown(self, timeout=STOP_TIMEOUT + 5):
+        """停止所有服务器，最多等待timeout秒（用于退出时清理）"""
+        if self._loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._stop_all(), self._loop)
+        try:
+            future.result(timeout)
+        except Exception:
+            pass
+
+    def _submit(self, coro):
+        # 事件循环在第一次使用时才启动，只导入本模块的进程（如调试模式下的重载监视进程）不会多出线程
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='supervisor', daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _set_status(self, server, status):
+        if server.status != status:
+            server.status = status
+            if self._on_change:
+                try:
+                    self._on_change(server.name, status)
+                except Exception as e:
+                    # 回调出错不能打断进程的监管
+                    print(f"[{server.name}] 状态回调出错: {e!r}")
+
+    async def _command(self, name, action):
+        server = self.servers[name]
+        if server.lock is None:
+            server.lock = asyncio.Lock()
+        async with server.lock:
+            await action(server)
+
+    async def _stop_all(self):
+        await asyncio.gather(*(self._command(name, self._stop) for name in self.servers))
+
+    async def _start(self, server):
+        if server.process is not None:
+            return
+        server.wanted = True
+        server.crashes.clear()
+        await self._launch(server)
+
+    async def _stop(self, server):
+        server.wanted = False
+        await self._halt(server)
+        self._set_status(server, 'stopped')
+
+    async def _restart(self, server):
+        await self._halt(server)
+        server.wanted = True
+        server.crashes.clear()
+        await self._launch(server)
+
+    async def _launch(self, server):
+        self._set_status(server, 'starting')
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *server.cmd, cwd=server.cwd, env=server.env, start_new_session=True,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        except OSError as e:
+            print(f"[{server.name}] 启动失败: {e}")
+            server.wanted = False
+            self._set_status(server, 'error')
+            return
+        server.process = process
+        asyncio.ensure_future(self._pump(process.stdout, f'{server.name}-stdout'))
+        asyncio.ensure_future(self._pump(process.stderr, f'{server.name}-stderr'))
+        asyncio.ensure_future(self._wait_ready(server, process))
+        asyncio.ensure_future(self._watch(server, process))
+
+    async def _halt(self, server):
+        """终止当前进程组并等待其退出"""
+        process, server.process = server.process, None
+        if process is None or process.returncode is not None:
+            return
+        self._set_status(server, 'stopping')
+        signal_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            signal_group(process, signal.SIGKILL)
+            await process.wait()
+
+    async def _pump(self, stream, prefix):
+        """实时打印子进程日志"""
+        async for line in stream:
+            print(f"[{prefix}] {line.decode(errors='replace').rstrip()}")
+
+    async def _wait_ready(self, server, process):
+        """按指数退避轮询健康检查，直到就绪、进程退出或超过期限"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + READY_DEADLINE
+        delay = READY_POLL_MIN
+        while server.process is process and process.returncode is None:
+            if await probe(server.health_url):
+                if server.process is process:
+                    self._set_status(server, 'running')
+                return
+            if loop.time() >= deadline:
+                print(f"[{server.name}] {READY_DEADLINE}秒内未就绪，终止进程")
+                await self._command(server.name, lambda s: self._fail(s, process))
+                return
+            await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            delay = min(delay * 2, READY_POLL_MAX)
+
+    async def _fail(self, server, process):
+        if server.process is process:
+            server.wanted = False
+            await self._halt(server)
+            self._set_status(server, 'error')
+
+    async def _watch(self, server, process):
+        """进程意外退出时按退避时间重启，短时间内反复崩溃则放弃"""
+        code = await process.wait()
+        if server.process is not process:
+            return  # 已被stop/restart替换或终止
+        server.process = None
+        if not server.wanted:
+            self._set_status(server, 'stopped')
+            return
+        now = time.time()
+        server.crashes.append(now)
+        while server.crashes and server.crashes[0] < now - CRASH_WINDOW:
+            server.crashes.popleft()
+        if len(server.crashes) >= CRASH_LIMIT:
+            print(f"[{server.name}] {CRASH_WINDOW}秒内崩溃{len(server.crashes)}次，不再自动重启")
+            server.wanted = False
+            self._set_status(server, 'error')
+            return
+        delay = min(RESTART_DELAY_MIN * 2 ** (len(server.crashes) - 1), RESTART_DELAY_MAX)
+        print(f"[{server.name}] 进程意外退出（返回码{code}），{delay:g}秒后重启")
+        self._set_status(server, 'starting')
+        await asyncio.sleep(delay)
+        await self._command(server.name, self._relaunch)
+
+    async def _relaunch(self, server):
+        # 等待期间可能已被stop或手动start
+        if server.wanted and server.process is None:
+            await self._launch(server)